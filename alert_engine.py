@@ -0,0 +1,212 @@
+"""
+IoT Greenhouse - Alert Rule Engine
+Evaluates alert rules against every reading as it is ingested
+
+Each rule watches one metric of one sensor table, per sector:
+- opens when the value crosses `threshold` and stays past it for `for_seconds`
+  (measured on reading timestamps, so one spike doesn't raise an alert)
+- closes when the value comes back past `clear` (hysteresis, so a value
+  hovering around the threshold doesn't flap)
+
+Active alerts are kept in memory, so /api/alerts is a dictionary read. Open and
+close events are appended to alert_history (migration 0004). Readings can be
+ingested by several processes (the Flask app and ingest_worker.py), so each
+engine also replays the other processes' events from alert_history, at most
+every SYNC_INTERVAL seconds.
+
+Rules are ALERT_RULES below, or a JSON list of the same dicts in ALERT_RULES_FILE.
+"""
+
+import json
+import os
+import threading
+import time
+import logging
+
+# Configuration
+ALERT_RULES = [
+    {'id': 'soil_dry', 'table': 'soil_health', 'metric': 'soil_moisture', 'above': False,
+     'threshold': 30, 'clear': 33, 'for_seconds': 120, 'type': 'warning', 'action': 'water_needed',
+     'per_sector': True, 'message': 'Sector {sector_id} soil moisture is low ({value}%)'},
+    {'id': 'soil_wet', 'table': 'soil_health', 'metric': 'soil_moisture', 'above': True,
+     'threshold': 80, 'clear': 77, 'for_seconds': 120, 'type': 'info', 'action': 'drainage_needed',
+     'per_sector': True, 'message': 'Sector {sector_id} soil moisture is very high ({value}%)'},
+    {'id': 'temperature_high', 'table': 'ventilation', 'metric': 'temperature', 'above': True,
+     'threshold': 30, 'clear': 29, 'for_seconds': 60, 'type': 'warning', 'action': 'fan_activation_recommended',
+     'per_sector': False, 'message': 'High temperature detected ({value}°C)'},
+    {'id': 'temperature_low', 'table': 'ventilation', 'metric': 'temperature', 'above': False,
+     'threshold': 18, 'clear': 19, 'for_seconds': 60, 'type': 'warning', 'action': 'heating_recommended',
+     'per_sector': False, 'message': 'Low temperature detected ({value}°C)'},
+]
+ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE', 'alert_rules.json')
+SYNC_INTERVAL = 5.0  # Seconds between reads of other processes' events
+
+logger = logging.getLogger(__name__)
+
+
+def load_rules(path=ALERT_RULES_FILE):
+    """ALERT_RULES, or the rules in path if that file exists"""
+    if not os.path.exists(path):
+        return ALERT_RULES
+    with open(path) as f:
+        rules = json.load(f)
+    logger.info(f"Loaded {len(rules)} alert rules from {path}")
+    return rules
+
+
+def breaches(rule, value):
+    return value > rule['threshold'] if rule['above'] else value < rule['threshold']
+
+
+def cleared(rule, value):
+    return value <= rule['clear'] if rule['above'] else value >= rule['clear']
+
+
+class AlertEngine:
+    def __init__(self, connect, rules=None):
+        self.connect = connect  # Returns a database connection; close() releases it
+        self.rules = {rule['id']: rule for rule in (rules if rules is not None else load_rules())}
+        self.rules_by_table = {}
+        for rule in self.rules.values():
+            self.rules_by_table.setdefault(rule['table'], []).append(rule)
+        self.lock = threading.Lock()
+        self.active = {}  # (rule id, sector) -> alert
+        self.breach_since = {}  # (rule id, sector) -> first breaching reading time, not yet open
+        self.last_event_id = None  # None until active alerts are loaded from alert_history
+        self.last_sync = 0.0
+
+    def observe(self, table, readings):
+        """Evaluate the rules for table against readings (dicts with sector_id, timestamp and metrics)"""
+        rules = self.rules_by_table.get(table)
+        if not rules:
+            return
+        with self.lock:
+            self.ensure_loaded()
+            events = []
+            for reading in readings:
+                for rule in rules:
+                    value = reading.get(rule['metric'])
+                    if value is not None:
+                        event = self.evaluate(rule, reading['sector_id'], float(value), reading['timestamp'])
+                        if event:
+                            events.append(event)
+            if events:
+                self.record(events)
+
+    def evaluate(self, rule, sector_id, value, timestamp):
+        """Advance one (rule, sector) state machine; returns an open/close event or None"""
+        key = (rule['id'], sector_id)
+        if key in self.active:
+            if cleared(rule, value):
+                del self.active[key]
+                return {'event': 'close', 'rule': rule, 'sector_id': sector_id, 'value': value, 'timestamp': timestamp}
+            return None
+
+        if not breaches(rule, value):
+            self.breach_since.pop(key, None)
+            return None
+
+        since = self.breach_since.setdefault(key, timestamp)
+        if (timestamp - since).total_seconds() < rule['for_seconds']:
+            return None
+
+        del self.breach_since[key]
+        self.active[key] = self.alert(rule, sector_id, value, since)
+        return {'event': 'open', 'rule': rule, 'sector_id': sector_id, 'value': value, 'timestamp': since}
+
+    def alert(self, rule, sector_id, value, since):
+        """Alert in the shape /api/alerts returns"""
+        alert = {
+            'rule': rule['id'],
+            'type': rule['type'],
+            'message': rule['message'].format(sector_id=sector_id, value=round(value, 1)),
+            'action': rule['action'],
+            'value': round(value, 1),
+            'since': since.isoformat()
+        }
+        if rule.get('per_sector', True):
+            alert['sector_id'] = sector_id  # The dashboard offers a "Fix" button for these
+        return alert
+
+    def record(self, events):
+        """Append open/close events to alert_history (best effort; in-memory state is authoritative)"""
+        conn = self.connect()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO alert_history (rule_id, sector_id, event, severity, action, message, value, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, [(
+                event['rule']['id'], event['sector_id'], event['event'], event['rule']['type'],
+                event['rule']['action'],
+                event['rule']['message'].format(sector_id=event['sector_id'], value=round(event['value'], 1)),
+                event['value'], event['timestamp']
+            ) for event in events])
+            conn.commit()
+            for event in events:
+                logger.info(f"Alert {event['event']}: {event['rule']['id']} sector {event['sector_id']} ({event['value']})")
+        except Exception as e:
+            logger.error(f"Failed to record {len(events)} alert events: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+    def ensure_loaded(self):
+        """Rebuild active alerts from alert_history once (the latest event per rule and sector)"""
+        if self.last_event_id is not None:
+            return
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT h.* FROM alert_history h
+                JOIN (SELECT MAX(id) AS id FROM alert_history GROUP BY rule_id, sector_id) latest ON latest.id = h.id
+            """)
+            rows = cursor.fetchall()
+            self.last_event_id = max((row['id'] for row in rows), default=0)
+            self.last_sync = time.monotonic()
+        finally:
+            cursor.close()
+            conn.close()
+        for row in rows:
+            self.apply(row)
+        logger.info(f"Loaded {len(self.active)} active alerts")
+
+    def sync(self):
+        """Apply events other processes appended since the last sync (a primary-key range read)"""
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT * FROM alert_history WHERE id > %s ORDER BY id", (self.last_event_id,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        for row in rows:
+            self.apply(row)
+            self.last_event_id = row['id']
+        self.last_sync = time.monotonic()
+
+    def apply(self, row):
+        """Replay one alert_history row; idempotent, so this process's own events are harmless"""
+        key = (row['rule_id'], row['sector_id'])
+        rule = self.rules.get(row['rule_id'])  # None if the rule was removed since
+        if row['event'] == 'close' or rule is None:
+            self.active.pop(key, None)
+        else:
+            self.breach_since.pop(key, None)
+            self.active[key] = self.alert(rule, row['sector_id'], row['value'], row['timestamp'])
+
+    def active_alerts(self):
+        """Current alerts, warnings first"""
+        with self.lock:
+            try:
+                self.ensure_loaded()
+                if time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+                    self.sync()
+            except Exception as e:
+                # Serve what this process knows rather than nothing
+                logger.error(f"Alert sync failed: {e}")
+            return sorted(self.active.values(), key=lambda alert: alert['type'] != 'warning')
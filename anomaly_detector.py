@@ -0,0 +1,181 @@
+"""
+IoT Greenhouse - Streaming Sensor Anomaly Detection
+Screens every reading before insert_readings() stores it
+
+Per (table, sector, metric) the detector keeps a Welford running mean/variance,
+an EWMA of the recent level, the last value and how often it repeated, in
+flat arrays indexed by a slot number (a few dozen bytes per sensor, O(1) per
+reading). A reading is anomalous when it is:
+- out_of_range   outside the metric's physical limits (a disconnected soil probe
+                 at the ADC rail 1023, an ultrasonic misread far above the pot)
+- outlier        more than Z_THRESHOLD standard deviations from the EWMA level
+- stuck          the same value the metric's stuck_repeats times in a row
+
+Anomalous readings don't update the statistics. LEVEL_SHIFT_READINGS outliers
+in a row are taken as a real change (watering, lights on) and accepted.
+
+ANOMALY_MODE 'quarantine' keeps anomalous rows out of the sensor tables;
+'flag' stores them anyway. Either way each one is written to sensor_anomalies
+(migration 0005). State is snapshotted to ANOMALY_STATE_FILE every
+SNAPSHOT_INTERVAL seconds and at exit, and reloaded on first use.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import logging
+from array import array
+
+# Configuration
+ANOMALY_MODE = os.environ.get('ANOMALY_MODE', 'quarantine')  # 'quarantine' or 'flag'
+ANOMALY_STATE_FILE = os.environ.get('ANOMALY_STATE_FILE', 'anomaly_state.json')
+SNAPSHOT_INTERVAL = 60.0
+WARMUP_READINGS = 30  # Readings per sensor before outliers are judged
+Z_THRESHOLD = 6.0
+EWMA_ALPHA = 0.2
+LEVEL_SHIFT_READINGS = 5
+MIN_STD = {'temperature': 0.2, 'humidity': 0.5, 'raw_value': 2, 'soil_moisture': 0.5, 'height_cm': 0.3, 'leaf_count': 1}
+
+# table: {metric: (min, max, stuck_repeats or None if a constant value is normal)}
+DETECTED_METRICS = {
+    'ventilation': {'temperature': (-10, 60, 60), 'humidity': (0, 100, 60)},
+    'soil_health': {'raw_value': (1, 1022, 60), 'soil_moisture': (0, 100, None)},
+    'plant': {'height_cm': (0, 40, None)},  # Sensor 50 cm up, 10 cm pots (light_sensor.ino)
+    'leaf_count': {'leaf_count': (0, 500, None)},
+}
+FIELDS = ('count', 'mean', 'm2', 'ewma', 'last', 'repeats', 'outlier_run')
+
+logger = logging.getLogger(__name__)
+
+
+class AnomalyDetector:
+    def __init__(self, state_path=ANOMALY_STATE_FILE, mode=ANOMALY_MODE):
+        self.state_path = state_path
+        self.mode = mode
+        self.slots = {}  # (table, sector_id, metric) -> index into the arrays
+        self.state = {field: array('d') for field in FIELDS}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.last_snapshot = time.monotonic()
+        atexit.register(self.snapshot)
+
+    def slot(self, key):
+        index = self.slots.get(key)
+        if index is None:
+            index = self.slots[key] = len(self.slots)
+            for values in self.state.values():
+                values.append(0.0)
+        return index
+
+    def check(self, key, value, limits):
+        """Classify one value and update its sensor's state; returns (reason or None, score)"""
+        low, high, stuck_repeats = limits
+        if not low <= value <= high:
+            return 'out_of_range', None
+
+        s = self.state
+        i = self.slot(key)
+        count = s['count'][i]
+
+        # Stuck-at: the same reading over and over from a sensor that normally jitters
+        if count and value == s['last'][i]:
+            s['repeats'][i] += 1
+        else:
+            s['repeats'][i] = 0
+            s['last'][i] = value
+        if stuck_repeats and s['repeats'][i] >= stuck_repeats:
+            return 'stuck', s['repeats'][i] + 1
+
+        score = None
+        if count >= WARMUP_READINGS:
+            std = max((s['m2'][i] / (count - 1)) ** 0.5, MIN_STD.get(key[2], 0.0))
+            score = abs(value - s['ewma'][i]) / std
+            if score > Z_THRESHOLD:
+                s['outlier_run'][i] += 1
+                if s['outlier_run'][i] < LEVEL_SHIFT_READINGS:
+                    return 'outlier', round(score, 2)
+                s['ewma'][i] = value  # Sustained change: follow it instead of rejecting it forever
+
+        # Accepted: Welford update and EWMA
+        s['outlier_run'][i] = 0
+        count += 1
+        delta = value - s['mean'][i]
+        s['mean'][i] += delta / count
+        s['m2'][i] += delta * (value - s['mean'][i])
+        s['count'][i] = count
+        s['ewma'][i] = value if count == 1 else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * s['ewma'][i]
+        return None, score
+
+    def screen(self, table, readings):
+        """Split readings (dicts) into (stored, anomalies); anomalies are rows for sensor_anomalies"""
+        metrics = DETECTED_METRICS.get(table)
+        if not metrics:
+            return readings, []
+
+        stored, anomalies = [], []
+        with self.lock:
+            self.ensure_loaded()
+            for reading in readings:
+                found = []
+                for metric, limits in metrics.items():
+                    try:
+                        value = float(reading.get(metric))
+                    except (TypeError, ValueError):
+                        continue  # Missing or non-numeric; left to the database as before
+                    reason, score = self.check((table, reading['sector_id'], metric), value, limits)
+                    if reason:
+                        found.append((metric, value, reason, score))
+
+                quarantined = bool(found) and self.mode == 'quarantine'
+                if not quarantined:
+                    stored.append(reading)
+                for metric, value, reason, score in found:
+                    anomalies.append((table, reading['sector_id'], metric, value, reason, score, quarantined,
+                                      reading['timestamp']))
+            if time.monotonic() - self.last_snapshot >= SNAPSHOT_INTERVAL:
+                self.snapshot_locked()
+
+        for table_name, sector_id, metric, value, reason, score, quarantined, _ in anomalies:
+            logger.warning(f"Anomalous {table_name} sector {sector_id} {metric}={value}: {reason}"
+                           f"{f' (score {score})' if score else ''}{', quarantined' if quarantined else ''}")
+        return stored, anomalies
+
+    def ensure_loaded(self):
+        """Restore the last snapshot once"""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                snapshot = json.load(f)
+            for key, values in zip(snapshot['keys'], zip(*(snapshot['state'][field] for field in FIELDS))):
+                i = self.slot(tuple(key))
+                for field, value in zip(FIELDS, values):
+                    self.state[field][i] = value
+            logger.info(f"Restored anomaly state for {len(self.slots)} sensors from {self.state_path}")
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Ignoring unreadable anomaly state {self.state_path}: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            self.snapshot_locked()
+
+    def snapshot_locked(self):
+        """Write the state atomically (temp file + rename)"""
+        self.last_snapshot = time.monotonic()
+        if not self.slots:
+            return
+        temp_path = self.state_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({
+                    'keys': list(self.slots),  # Slot order
+                    'state': {field: values.tolist() for field, values in self.state.items()}
+                }, f)
+            os.replace(temp_path, self.state_path)
+        except OSError as e:
+            logger.error(f"Failed to snapshot anomaly state: {e}")
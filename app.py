@@ -1,14 +1,47 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, abort
+from werkzeug.exceptions import RequestEntityTooLarge
 import requests
 import subprocess
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+import csv
+import gzip
+import io
+import json
 import logging
+import math
+import os
+import threading
+import time
 import traceback
+import zlib
+
+from alert_engine import AlertEngine
+from anomaly_detector import AnomalyDetector
+from command_queue import COMMAND_NODES, enqueue_command
+from control_engine import ControlEngine
+from scheduler import Scheduler, validate_schedule
+from migrations import migrate
+
+try:
+    import brotli  # Optional: enables Content-Encoding: br on responses
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
+# Compression settings
+MAX_REQUEST_BYTES = 1 * 1024 * 1024  # Largest request body on the wire (compressed or not)
+MAX_DECOMPRESSED_BYTES = 4 * 1024 * 1024  # Largest gzip request body after decompression
+COMPRESS_MIN_SIZE = 1024  # JSON responses smaller than this are sent as-is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 0-11; 4-6 is the usual sweet spot for dynamic responses
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
 
 
 # Enable debug logging
@@ -49,14 +82,56 @@ db_config = {
 # }
 
 
+DB_POOL_NAME = 'greenhouse_pool'
+DB_POOL_SIZE = 16  # Per process: request threads, DASHBOARD_WORKERS, alert/control engines, scheduler
+DB_POOL_WAIT = 2.0  # Seconds to wait for a free connection before failing (the pool itself doesn't wait)
+
+db_pool = None
+
+
+# Dashboard sections run concurrently, each on its own pooled connection.
+# The executor is shared by all requests so the dashboard never takes more
+# than DASHBOARD_WORKERS connections from the pool. Concurrent loads queue
+# for the workers; a section's timeout only starts once it is running.
+DASHBOARD_WORKERS = 6
+DASHBOARD_SECTION_TIMEOUT = 3.0  # Seconds a running section gets before it falls back to its default
+DASHBOARD_QUEUE_TIMEOUT = 10.0  # Seconds a section may wait for a free worker
+DASHBOARD_QUERY_TIMEOUT_MS = 2500  # Server-side SELECT limit, so timed-out queries don't keep running
+LATEST_LOOKBACK_DAYS = 7  # "Latest per sector" only scans this window (recent partitions only)
+dashboard_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard')
+
+
+def get_db_pool():
+    """Create the MySQL connection pool on first use"""
+    global db_pool
+    if db_pool is None:
+        db_pool = pooling.MySQLConnectionPool(
+            pool_name=DB_POOL_NAME,
+            pool_size=DB_POOL_SIZE,
+            **db_config
+        )
+        logger.info(f"Database pool created ({DB_POOL_SIZE} connections)")
+    return db_pool
+
+
 def get_db_connection():
-    """Get database connection with error handling"""
-    try:
-        conn = mysql.connector.connect(**db_config)
-        return conn
-    except Error as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+    """Get a pooled database connection with error handling (close() returns it to the pool)
+
+    An exhausted pool raises PoolError at once, so wait up to DB_POOL_WAIT for a
+    connection to be returned before giving up.
+    """
+    deadline = time.monotonic() + DB_POOL_WAIT
+    while True:
+        try:
+            return get_db_pool().get_connection()
+        except PoolError as e:
+            if time.monotonic() >= deadline:
+                logger.error(f"Database connection error: {e}")
+                raise
+            time.sleep(0.02)
+        except Error as e:
+            logger.error(f"Database connection error: {e}")
+            raise
 
 
 
@@ -82,162 +157,392 @@ def dashboard():
 
 
 
+################### COMPRESSION ################################
+
+def get_request_json():
+    """Parse the JSON request body, transparently decoding Content-Encoding: gzip
+
+    Returns None for a missing or invalid body. Decompression stops at
+    MAX_DECOMPRESSED_BYTES so a small gzip bomb cannot exhaust worker memory.
+    """
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return request.get_json(silent=True)
+    if encoding != 'gzip':
+        abort(415)
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip framing
+    try:
+        body = decompressor.decompress(request.get_data(), MAX_DECOMPRESSED_BYTES)
+        if decompressor.unconsumed_tail:
+            raise RequestEntityTooLarge(f'Decompressed body exceeds {MAX_DECOMPRESSED_BYTES} bytes')
+        return json.loads(body)
+    except (zlib.error, ValueError):
+        return None
+
+
+def response_encodings():
+    """Content codings this server can produce, in order of preference"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress_body(data, encoding):
+    """Compress a response body with the given content coding"""
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+@app.after_request
+def compress_response(response):
+    """Negotiate brotli/gzip for JSON responses above COMPRESS_MIN_SIZE"""
+    if (response.mimetype != 'application/json'
+            or response.is_streamed
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(response_encodings())
+    if encoding is None:
+        return response
+
+    response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+
+
+
+
 ########################################### INGESTION OF DATA ###########################3
-@app.route('/temperature-ingest', methods=['POST'])
-def temperature_ingest():
-    data = request.get_json()
-    if not data:
-        return jsonify({'error': 'Invalid or missing JSON data'}), 400
 
-    # Extract values from JSON
+# Validation shared by the HTTP ingest routes below and ingest_worker.py.
+# Each validator returns (row, error); row matches the column order of INGEST_QUERIES.
+
+INGEST_QUERIES = {
+    'ventilation': """
+        INSERT INTO ventilation (sector_id, temperature, humidity, timestamp)
+        VALUES (%s, %s, %s, %s)
+    """,
+    'soil_health': """
+        INSERT INTO soil_health (sector_id, raw_value, soil_moisture, timestamp)
+        VALUES (%s, %s, %s, %s)
+    """,
+    'plant': """
+        INSERT INTO plant (sector_id, height_cm, timestamp)
+        VALUES (%s, %s, %s)
+    """,
+    'leaf_count': """
+        INSERT INTO leaf_count (sector_id, leaf_count, timestamp)
+        VALUES (%s, %s, %s)
+    """,
+}
+
+
+INGEST_COLUMNS = {
+    'ventilation': ('sector_id', 'temperature', 'humidity', 'timestamp'),
+    'soil_health': ('sector_id', 'raw_value', 'soil_moisture', 'timestamp'),
+    'plant': ('sector_id', 'height_cm', 'timestamp'),
+    'leaf_count': ('sector_id', 'leaf_count', 'timestamp'),
+}
+
+
+def parse_local_time(value):
+    """ISO timestamp as a naive local datetime, like the datetime.now() stamps on live readings
+
+    Offsets (e.g. 'Z') are converted to the server's local time before tzinfo
+    is dropped; a timestamp without one is taken to be local already.
+    """
+    timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def is_number(value):
+    """True for a finite number, or a string holding one (MySQL converts those on insert)"""
+    if isinstance(value, bool):
+        return False
+    try:
+        return math.isfinite(float(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_temperature_reading(data, timestamp=None):
+    """Validate a temperature/humidity reading"""
     temperature = data.get('temperature')
     humidity = data.get('humidity')
     sector_id = 1  # make sure client sends this
 
     if temperature is None or humidity is None or sector_id is None:
-        return jsonify({'error': 'Missing temperature, humidity or sector_id'}), 400
+        return None, 'Missing temperature, humidity or sector_id'
+    if not (is_number(temperature) and is_number(humidity)):
+        return None, 'temperature and humidity must be numbers'
+
+    return (sector_id, temperature, humidity, timestamp or datetime.now()), None
+
+
+def validate_soil_reading(data, timestamp=None):
+    """Validate a soil moisture reading"""
+    raw_value = data.get('raw_value')
+    soil_moisture = data.get('soil_moisture')
+    sector_id = data.get('sector_id')
+
+    if raw_value is None or soil_moisture is None or sector_id is None:
+        return None, 'Missing raw_value, soil_moisture, or sector_id'
+    if not (is_number(raw_value) and is_number(soil_moisture) and is_number(sector_id)):
+        return None, 'raw_value, soil_moisture and sector_id must be numbers'
+
+    return (sector_id, raw_value, soil_moisture, timestamp or datetime.now()), None
+
+
+def validate_plant_reading(data, timestamp=None):
+    """Validate a plant height reading"""
+    sector_id = data.get('sector_id')
+    height_cm = data.get('height_cm')
+
+    if sector_id is None or height_cm is None:
+        return None, 'Missing sector_id or height_cm'
+    if not (is_number(sector_id) and is_number(height_cm)):
+        return None, 'sector_id and height_cm must be numbers'
+
+    return (sector_id, height_cm, timestamp or datetime.now()), None
+
+
+def validate_leaf_reading(data, timestamp=None):
+    """Validate a leaf count reading (sector 1 when the publisher doesn't say)"""
+    sector_id = data.get('sector_id', 1)
+    leaf_count = data.get('leaf_count')
+
+    if sector_id is None or leaf_count is None:
+        return None, 'Missing sector_id or leaf_count'
+    if not (is_number(sector_id) and is_number(leaf_count)):
+        return None, 'sector_id and leaf_count must be numbers'
+
+    return (sector_id, leaf_count, timestamp or datetime.now()), None
+
+
+INGEST_VALIDATORS = {
+    'ventilation': validate_temperature_reading,
+    'soil_health': validate_soil_reading,
+    'plant': validate_plant_reading,
+    'leaf_count': validate_leaf_reading,
+}
+
+# Screens readings for out-of-range, outlier and stuck values before they are stored
+anomaly_detector = AnomalyDetector()
+
+# Evaluate every reading store_readings() stores (also in ingest_worker.py)
+alert_engine = AlertEngine(get_db_connection)
+control_engine = ControlEngine(get_db_connection)
+
+# Timed commands. Exactly one process per deployment should fire them: set
+# SCHEDULER_ENABLED=1 for that one (e.g. one WSGI worker or `python app.py`).
+# The others still accept and list schedules through /api/schedules.
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '0') == '1'
+SCHEDULER_START_RETRY = 30  # Seconds between start attempts while the database is unavailable
+scheduler = Scheduler(get_db_connection)
+
+ANOMALY_INSERT = """
+    INSERT INTO sensor_anomalies (table_name, sector_id, metric, value, reason, score, quarantined, timestamp)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def insert_readings(table, rows):
+    """Bulk insert validated rows into a sensor table on a pooled connection
+
+    Returns the number of rows stored; readings quarantined by anomaly_detector
+    go to sensor_anomalies instead.
+    """
+    if not rows:
+        return 0
+    return store_readings(table, *screen_readings(table, rows))
+
+
+def screen_readings(table, rows):
+    """Run validated rows through anomaly_detector; returns (readings to store, anomaly rows)
+
+    This updates the detector's statistics, so each reading must be screened
+    exactly once: callers that retry a failed insert retry store_readings().
+    """
+    return anomaly_detector.screen(table, [dict(zip(INGEST_COLUMNS[table], row)) for row in rows])
+
+
+def store_readings(table, readings, anomalies):
+    """Insert screened readings and anomaly rows, then evaluate alerts and control"""
+    if not readings and not anomalies:
+        return 0
+    columns = INGEST_COLUMNS[table]
+    rows = [tuple(reading[column] for column in columns) for reading in readings]
 
+    conn = get_db_connection()
+    cursor = None
     try:
-        # Connect to MariaDB
-        conn = mysql.connector.connect(**db_config)
         cursor = conn.cursor()
-        # Insert into ventilation table
-        insert_query = """
-            INSERT INTO ventilation (sector_id, temperature, humidity, timestamp)
-            VALUES (%s, %s, %s, %s)
-        """
-        current_time = datetime.now()
-        cursor.execute(insert_query, (sector_id, temperature, humidity, current_time))
+        # executemany rewrites a plain INSERT into one multi-row VALUES statement
+        if rows:
+            cursor.executemany(INGEST_QUERIES[table], rows)
+        if anomalies:
+            cursor.executemany(ANOMALY_INSERT, anomalies)
         conn.commit()
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+    # The readings are stored; a failed evaluation must not fail the ingest
+    try:
+        alert_engine.observe(table, readings)
+    except Exception as e:
+        logger.error(f"Alert evaluation failed for {table}: {e}")
+    try:
+        control_engine.observe(table, readings)
+    except Exception as e:
+        logger.error(f"Control evaluation failed for {table}: {e}")
+    return len(rows)
+
 
+@app.route('/temperature-ingest', methods=['POST'])
+def temperature_ingest():
+    data = get_request_json()
+    if not data or not isinstance(data, dict):
+        return jsonify({'error': 'Invalid or missing JSON data'}), 400
+
+    row, error = validate_temperature_reading(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        insert_readings('ventilation', [row])
         return jsonify({'message': 'Data inserted successfully'}), 201
 
     except Error as e:
         print("Error while inserting data:", e)
         return jsonify({'error': 'Database error'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
 
 @app.route('/soil-ingest', methods=['POST'])
 def soil_health_ingest():
-    data = request.get_json()
-    if not data:
+    data = get_request_json()
+    if not data or not isinstance(data, dict):
         return jsonify({'error': 'Invalid or missing JSON data'}), 400
 
-    # Extract values
-    raw_value = data.get('raw_value')
-    soil_moisture = data.get('soil_moisture')
-    sector_id = data.get('sector_id')  # replace or make dynamic if needed
-
-    if raw_value is None or soil_moisture is None or sector_id is None:
-        return jsonify({'error': 'Missing raw_value, soil_moisture, or sector_id'}), 400
+    row, error = validate_soil_reading(data)
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
-        # Connect to MariaDB
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
-
-        # Insert into soil_health table
-        insert_query = """
-            INSERT INTO soil_health (sector_id, raw_value, soil_moisture, timestamp)
-            VALUES (%s, %s, %s, %s)
-        """
-        current_time = datetime.now()
-        cursor.execute(insert_query, (sector_id, raw_value, soil_moisture, current_time))
-        conn.commit()
-
+        insert_readings('soil_health', [row])
         return jsonify({'message': 'Soil health data inserted successfully'}), 201
 
     except Error as e:
         print("Error while inserting soil health data:", e)
         return jsonify({'error': 'Database error'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
 @app.route('/plant-ingest', methods=['POST'])
 def plant_ingest():
-    data = request.get_json()
-    if not data:
+    data = get_request_json()
+    if not data or not isinstance(data, dict):
         return jsonify({'error': 'Invalid or missing JSON data'}), 400
 
-    # Extract values from JSON
-    sector_id = data.get('sector_id')
-    height_cm = data.get('height_cm')
-
-    if sector_id is None or height_cm is None:
-        return jsonify({'error': 'Missing sector_id or height_cm'}), 400
+    row, error = validate_plant_reading(data)
+    if error:
+        return jsonify({'error': error}), 400
 
     try:
-        # Connect to MariaDB
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
-        
-        # Insert into plant table
-        insert_query = """
-            INSERT INTO plant (sector_id, height_cm, timestamp)
-            VALUES (%s, %s, %s)
-        """
-        current_time = datetime.now()
-        cursor.execute(insert_query, (sector_id, height_cm, current_time))
-        conn.commit()
-
+        insert_readings('plant', [row])
         return jsonify({'message': 'Plant data inserted successfully'}), 201
 
     except Error as e:
         print("Error while inserting plant data:", e)
         return jsonify({'error': 'Database error'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
 
 @app.route('/leaf-ingest', methods=['POST'])
 def leaf_ingest():
-    data = request.get_json()
-    if not data:
+    data = get_request_json()
+    if not data or not isinstance(data, dict):
         return jsonify({'error': 'Invalid or missing JSON data'}), 400
 
-    sector_id = 1
-    leaf_count = data.get('leaf_count')
+    # Multi-sector publishers send {"sectors": [{"sector_id": .., "leaf_count": ..}, ...]}
+    readings = data.get('sectors') or [data]
+    if not isinstance(readings, list) or not all(isinstance(reading, dict) for reading in readings):
+        return jsonify({'error': 'sectors must be a list of JSON objects'}), 400
 
-    if sector_id is None or leaf_count is None:
-        return jsonify({'error': 'Missing sector_id or leaf_count'}), 400
+    current_time = datetime.now()
+    rows = []
+    for reading in readings:
+        row, error = validate_leaf_reading(reading, current_time)
+        if error:
+            return jsonify({'error': error}), 400
+        rows.append(row)
 
     try:
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor()
-
-        insert_query = """
-            INSERT INTO leaf_count (sector_id, leaf_count, timestamp)
-            VALUES (%s, %s, %s)
-        """
-        current_time = datetime.now()
-        cursor.execute(insert_query, (sector_id, leaf_count, current_time))
-        conn.commit()
-
+        insert_readings('leaf_count', rows)
         return jsonify({'message': 'Leaf count inserted successfully'}), 201
 
     except Error as e:
         print("Database error:", e)
         return jsonify({'error': 'Database error'}), 500
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+@app.route('/batch-ingest', methods=['POST'])
+def batch_ingest():
+    """Ingest readings for several tables in one request (sent by lambda/ingest_router.py)
+
+    Body: {"ventilation": [{...}], "soil_health": [{...}], ...} using the same fields
+    as the single-reading routes, plus an optional ISO "timestamp" per reading
+    (backfills). Like them, accepts Content-Encoding: gzip.
+    """
+    data = get_request_json()
+    if not data or not isinstance(data, dict):
+        return jsonify({'error': 'Invalid or missing JSON data'}), 400
+
+    current_time = datetime.now()
+    rows_by_table = {}
+    rejected = []
+    for table, readings in data.items():
+        validator = INGEST_VALIDATORS.get(table)
+        if validator is None or not isinstance(readings, list):
+            rejected.append({'table': table, 'error': 'Unknown table or readings not a list'})
+            continue
+        for reading in readings:
+            if not isinstance(reading, dict):
+                rejected.append({'table': table, 'error': 'Reading is not a JSON object'})
+                continue
+            # Backfills send the original capture time; live readings are stamped now
+            timestamp = current_time
+            if 'timestamp' in reading:
+                try:
+                    timestamp = parse_local_time(reading['timestamp'])
+                except ValueError:
+                    rejected.append({'table': table, 'error': 'Invalid timestamp'})
+                    continue
+            row, error = validator(reading, timestamp)
+            if error:
+                rejected.append({'table': table, 'error': error})
+            else:
+                rows_by_table.setdefault(table, []).append(row)
+
+    try:
+        inserted = {table: insert_readings(table, rows) for table, rows in rows_by_table.items()}
+    except Error as e:
+        print("Error while inserting batch:", e)
+        return jsonify({'error': 'Database error'}), 500
+
+    return jsonify({
+        'message': 'Batch inserted successfully',
+        'inserted': inserted,
+        'rejected': rejected
+    }), 201
 
 
 
@@ -313,170 +618,240 @@ def debug_database():
             'traceback': traceback.format_exc()
         }), 500
 
+def dashboard_defaults():
+    """Dashboard response with every section at its default (used for failed/slow sections)"""
+    return {
+        'current_conditions': {
+            'temperature': 0,
+            'humidity': 0,
+            'last_updated': None
+        },
+        'soil_moisture': {
+            'current': {}
+        },
+        'plant_heights': {
+            'current': {},
+            'trend_7d': []
+        },
+        'leaf_count': {
+            'current': 0,
+            'timestamp': None
+        },
+        'environmental_trend': []
+    }
+
+
+def fetch_current_conditions(cursor):
+    """Latest temperature and humidity"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ temperature, humidity, timestamp 
+        FROM ventilation 
+        ORDER BY timestamp DESC 
+        LIMIT 1
+    """)
+    latest_ventilation = cursor.fetchone()
+    logger.info(f"Latest ventilation data: {latest_ventilation}")
+    if not latest_ventilation:
+        return None
+    return {
+        'temperature': float(latest_ventilation['temperature']),
+        'humidity': float(latest_ventilation['humidity']),
+        'last_updated': latest_ventilation['timestamp'].isoformat()
+    }
+
+
+def fetch_soil_moisture(cursor):
+    """Latest soil moisture per sector"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ sector_id, raw_value, soil_moisture, timestamp
+        FROM soil_health 
+        WHERE timestamp >= DATE_SUB(NOW(), INTERVAL {LATEST_LOOKBACK_DAYS} DAY)
+        ORDER BY timestamp DESC
+    """)
+    all_soil = cursor.fetchall()
+    logger.info(f"All soil data count: {len(all_soil)}")
+
+    # Get latest per sector
+    latest_soil_by_sector = {}
+    for row in all_soil:
+        sector_id = row['sector_id']
+        if sector_id not in latest_soil_by_sector:
+            latest_soil_by_sector[sector_id] = row
+
+    return {
+        f'sector_{sector_id}': {
+            'moisture_percent': row['soil_moisture'],
+            'raw_value': row['raw_value'],
+            'status': get_soil_status(row['soil_moisture']),
+            'timestamp': row['timestamp'].isoformat()
+        } for sector_id, row in latest_soil_by_sector.items()
+    }
+
+
+def fetch_plant_heights(cursor):
+    """Latest plant height per sector"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ sector_id, height_cm, timestamp
+        FROM plant 
+        WHERE timestamp >= DATE_SUB(NOW(), INTERVAL {LATEST_LOOKBACK_DAYS} DAY)
+        ORDER BY timestamp DESC
+    """)
+    all_plants = cursor.fetchall()
+    logger.info(f"All plant data count: {len(all_plants)}")
+
+    # Get latest per sector
+    latest_plants_by_sector = {}
+    for row in all_plants:
+        sector_id = row['sector_id']
+        if sector_id not in latest_plants_by_sector:
+            latest_plants_by_sector[sector_id] = row
+
+    return {
+        f'sector_{sector_id}': {
+            'height_cm': float(row['height_cm']),
+            'growth_stage': get_growth_stage(float(row['height_cm'])),
+            'timestamp': row['timestamp'].isoformat()
+        } for sector_id, row in latest_plants_by_sector.items()
+    }
+
+
+def fetch_plant_trend(cursor):
+    """Plant heights over the last 7 days"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ sector_id, height_cm, timestamp
+        FROM plant 
+        WHERE timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)
+        ORDER BY timestamp ASC
+    """)
+    return [
+        {
+            'sector_id': row['sector_id'],
+            'height_cm': float(row['height_cm']),
+            'timestamp': row['timestamp'].isoformat()
+        } for row in cursor.fetchall()
+    ]
+
+
+def fetch_leaf_count(cursor):
+    """Latest leaf count (one row per sector from the same frame, summed for the bench)"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ sector_id, leaf_count, timestamp 
+        FROM leaf_count 
+        WHERE timestamp = (SELECT MAX(timestamp) FROM leaf_count)
+        ORDER BY sector_id
+    """)
+    latest_leaf_counts = cursor.fetchall()
+    if not latest_leaf_counts:
+        return None
+    return {
+        'current': sum(row['leaf_count'] for row in latest_leaf_counts),
+        'timestamp': latest_leaf_counts[0]['timestamp'].isoformat(),
+        'sectors': {row['sector_id']: row['leaf_count'] for row in latest_leaf_counts}
+    }
+
+
+def fetch_environmental_trend(cursor):
+    """Temperature and humidity trend (simplified - last 24 readings)"""
+    cursor.execute(f"""
+        SELECT /*+ MAX_EXECUTION_TIME({DASHBOARD_QUERY_TIMEOUT_MS}) */ temperature, humidity, timestamp
+        FROM ventilation 
+        ORDER BY timestamp DESC 
+        LIMIT 24
+    """)
+    return [
+        {
+            'temperature': round(float(row['temperature']), 1),
+            'humidity': round(float(row['humidity']), 1),
+            'timestamp': row['timestamp'].isoformat()
+        } for row in reversed(cursor.fetchall())  # Reverse to get chronological order
+    ]
+
+
+# (section, where its result goes in the response, fetch function)
+DASHBOARD_SECTIONS = [
+    ('ventilation', ('current_conditions',), fetch_current_conditions),
+    ('soil', ('soil_moisture', 'current'), fetch_soil_moisture),
+    ('plant', ('plant_heights', 'current'), fetch_plant_heights),
+    ('plant trend', ('plant_heights', 'trend_7d'), fetch_plant_trend),
+    ('leaf count', ('leaf_count',), fetch_leaf_count),
+    ('environmental trend', ('environmental_trend',), fetch_environmental_trend),
+]
+
+
+def run_dashboard_section(fetch, started, name):
+    """Run one dashboard section on its own pooled connection, noting when it started"""
+    started[name] = time.monotonic()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            return fetch(cursor)
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+
 @app.route('/api/dashboard-data', methods=['GET'])
 def get_dashboard_data():
-    """Get comprehensive dashboard data from database with extensive error handling"""
+    """Get comprehensive dashboard data, running the independent sections concurrently
+
+    Each section has its own pooled connection and deadline; a section that fails
+    or is too slow keeps its default value, so latency is bounded by the slowest
+    section (DASHBOARD_SECTION_TIMEOUT once it runs) rather than the sum. Time
+    spent queued behind other requests' sections doesn't count against it.
+    """
     try:
         logger.info("Starting dashboard data fetch...")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Initialize response with default values
-        dashboard_data = {
-            'current_conditions': {
-                'temperature': 0,
-                'humidity': 0,
-                'last_updated': None
-            },
-            'soil_moisture': {
-                'current': {}
-            },
-            'plant_heights': {
-                'current': {},
-                'trend_7d': []
-            },
-            'leaf_count': {
-                'current': 0,
-                'timestamp': None
-            },
-            'environmental_trend': []
+        dashboard_data = dashboard_defaults()
+
+        started = {}  # Section name -> monotonic start time, set by the worker
+        submitted_at = time.monotonic()
+        pending = {
+            dashboard_executor.submit(run_dashboard_section, fetch, started, name): (name, path)
+            for name, path, fetch in DASHBOARD_SECTIONS
         }
-        
-        # Get latest temperature and humidity with error handling
-        try:
-            cursor.execute("""
-                SELECT temperature, humidity, timestamp 
-                FROM ventilation 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            latest_ventilation = cursor.fetchone()
-            logger.info(f"Latest ventilation data: {latest_ventilation}")
-            
-            if latest_ventilation:
-                dashboard_data['current_conditions'] = {
-                    'temperature': float(latest_ventilation['temperature']),
-                    'humidity': float(latest_ventilation['humidity']),
-                    'last_updated': latest_ventilation['timestamp'].isoformat()
-                }
-        except Exception as e:
-            logger.error(f"Error fetching ventilation data: {e}")
-        
-        # Get latest soil moisture per sector
-        try:
-            cursor.execute("""
-                SELECT sector_id, raw_value, soil_moisture, timestamp
-                FROM soil_health 
-                ORDER BY timestamp DESC
-            """)
-            all_soil = cursor.fetchall()
-            logger.info(f"All soil data count: {len(all_soil)}")
-            
-            # Get latest per sector
-            latest_soil_by_sector = {}
-            for row in all_soil:
-                sector_id = row['sector_id']
-                if sector_id not in latest_soil_by_sector:
-                    latest_soil_by_sector[sector_id] = row
-            
-            for sector_id, row in latest_soil_by_sector.items():
-                dashboard_data['soil_moisture']['current'][f'sector_{sector_id}'] = {
-                    'moisture_percent': row['soil_moisture'],
-                    'raw_value': row['raw_value'],
-                    'status': get_soil_status(row['soil_moisture']),
-                    'timestamp': row['timestamp'].isoformat()
-                }
-                
-        except Exception as e:
-            logger.error(f"Error fetching soil data: {e}")
-        
-        # Get latest plant heights per sector
-        try:
-            cursor.execute("""
-                SELECT sector_id, height_cm, timestamp
-                FROM plant 
-                ORDER BY timestamp DESC
-            """)
-            all_plants = cursor.fetchall()
-            logger.info(f"All plant data count: {len(all_plants)}")
-            
-            # Get latest per sector
-            latest_plants_by_sector = {}
-            for row in all_plants:
-                sector_id = row['sector_id']
-                if sector_id not in latest_plants_by_sector:
-                    latest_plants_by_sector[sector_id] = row
-            
-            for sector_id, row in latest_plants_by_sector.items():
-                dashboard_data['plant_heights']['current'][f'sector_{sector_id}'] = {
-                    'height_cm': float(row['height_cm']),
-                    'growth_stage': get_growth_stage(float(row['height_cm'])),
-                    'timestamp': row['timestamp'].isoformat()
-                }
-            
-            # Get plant trend (last 7 days)
-            cursor.execute("""
-                SELECT sector_id, height_cm, timestamp
-                FROM plant 
-                WHERE timestamp >= DATE_SUB(NOW(), INTERVAL 7 DAY)
-                ORDER BY timestamp ASC
-            """)
-            plant_trend = cursor.fetchall()
-            
-            dashboard_data['plant_heights']['trend_7d'] = [
-                {
-                    'sector_id': row['sector_id'],
-                    'height_cm': float(row['height_cm']),
-                    'timestamp': row['timestamp'].isoformat()
-                } for row in plant_trend
-            ]
-            
-        except Exception as e:
-            logger.error(f"Error fetching plant data: {e}")
-        
-        # Get latest leaf count
-        try:
-            cursor.execute("""
-                SELECT leaf_count, timestamp 
-                FROM leaf_count 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            latest_leaf_count = cursor.fetchone()
-            
-            if latest_leaf_count:
-                dashboard_data['leaf_count'] = {
-                    'current': latest_leaf_count['leaf_count'],
-                    'timestamp': latest_leaf_count['timestamp'].isoformat()
-                }
-        except Exception as e:
-            logger.error(f"Error fetching leaf count data: {e}")
-        
-        # Get temperature and humidity trend (simplified - last 24 readings)
-        try:
-            cursor.execute("""
-                SELECT temperature, humidity, timestamp
-                FROM ventilation 
-                ORDER BY timestamp DESC 
-                LIMIT 24
-            """)
-            temp_trend = cursor.fetchall()
-            
-            dashboard_data['environmental_trend'] = [
-                {
-                    'temperature': round(float(row['temperature']), 1),
-                    'humidity': round(float(row['humidity']), 1),
-                    'timestamp': row['timestamp'].isoformat()
-                } for row in reversed(temp_trend)  # Reverse to get chronological order
-            ]
-            
-        except Exception as e:
-            logger.error(f"Error fetching environmental trend: {e}")
-        
-        cursor.close()
-        conn.close()
-        
+
+        unavailable = []
+        while pending:
+            now = time.monotonic()
+            deadlines = {}
+            for future, (name, _) in list(pending.items()):
+                if future.done():
+                    deadlines[future] = now
+                elif name in started:
+                    deadlines[future] = started[name] + DASHBOARD_SECTION_TIMEOUT
+                else:
+                    deadlines[future] = submitted_at + DASHBOARD_QUEUE_TIMEOUT
+                if deadlines[future] <= now and not future.done():
+                    future.cancel()  # Only helps if it hasn't started; the query hint stops it server-side
+                    waited = 'ran' if name in started else 'waited for a worker'
+                    logger.error(f"Dashboard section {name} timed out ({waited} too long)")
+                    unavailable.append(name)
+                    del pending[future]
+                    del deadlines[future]
+            if not pending:
+                break
+
+            done, _ = wait(pending, timeout=max(0.0, min(deadlines.values()) - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, path = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching {name} data: {e}")
+                    unavailable.append(name)
+                    continue
+                if value is None:
+                    continue  # No rows yet - keep the default
+                target = dashboard_data
+                for key in path[:-1]:
+                    target = target[key]
+                target[path[-1]] = value
+
+        if unavailable:
+            dashboard_data['unavailable_sections'] = sorted(unavailable)
+
         logger.info("Dashboard data fetch completed successfully")
         return jsonify(dashboard_data)
         
@@ -485,100 +860,16 @@ def get_dashboard_data():
         logger.error(traceback.format_exc())
         
         # Return minimal fallback data
-        fallback_data = {
-            'current_conditions': {
-                'temperature': 0,
-                'humidity': 0,
-                'last_updated': None
-            },
-            'soil_moisture': {'current': {}},
-            'plant_heights': {'current': {}, 'trend_7d': []},
-            'leaf_count': {'current': 0, 'timestamp': None},
-            'environmental_trend': [],
-            'error': str(e)
-        }
+        fallback_data = dashboard_defaults()
+        fallback_data['error'] = str(e)
         
         return jsonify(fallback_data), 500
 
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
-    """Get system alerts based on current conditions"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        alerts = []
-        
-        # Check for dry soil (moisture < 30%) - simplified query
-        try:
-            cursor.execute("""
-                SELECT sector_id, soil_moisture, timestamp
-                FROM soil_health 
-                ORDER BY timestamp DESC 
-                LIMIT 10
-            """)
-            recent_soil = cursor.fetchall()
-            
-            # Get latest per sector
-            latest_soil = {}
-            for row in recent_soil:
-                sector_id = row['sector_id']
-                if sector_id not in latest_soil:
-                    latest_soil[sector_id] = row
-            
-            for sector_id, data in latest_soil.items():
-                if data['soil_moisture'] < 30:
-                    alerts.append({
-                        'type': 'warning',
-                        'message': f'Sector {sector_id} soil moisture is low ({data["soil_moisture"]}%)',
-                        'action': 'water_needed',
-                        'sector_id': sector_id
-                    })
-                elif data['soil_moisture'] > 80:
-                    alerts.append({
-                        'type': 'info',
-                        'message': f'Sector {sector_id} soil moisture is very high ({data["soil_moisture"]}%)',
-                        'action': 'drainage_needed',
-                        'sector_id': sector_id
-                    })
-        except Exception as e:
-            logger.error(f"Error checking soil alerts: {e}")
-        
-        # Check for temperature alerts
-        try:
-            cursor.execute("""
-                SELECT temperature, timestamp
-                FROM ventilation 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            latest_temp = cursor.fetchone()
-            
-            if latest_temp:
-                temp = float(latest_temp['temperature'])
-                if temp > 30:
-                    alerts.append({
-                        'type': 'warning',
-                        'message': f'High temperature detected ({temp}°C)',
-                        'action': 'fan_activation_recommended'
-                    })
-                elif temp < 18:
-                    alerts.append({
-                        'type': 'warning',
-                        'message': f'Low temperature detected ({temp}°C)',
-                        'action': 'heating_recommended'
-                    })
-        except Exception as e:
-            logger.error(f"Error checking temperature alerts: {e}")
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({'alerts': alerts, 'count': len(alerts)})
-        
-    except Exception as e:
-        logger.error(f"Error in alerts: {e}")
-        return jsonify({'alerts': [], 'count': 0})
+    """Active alerts, maintained by alert_engine as readings are ingested"""
+    alerts = alert_engine.active_alerts()
+    return jsonify({'alerts': alerts, 'count': len(alerts)})
 
 @app.route('/api/water-plants', methods=['POST'])
 def water_plants():
@@ -592,41 +883,25 @@ def water_plants():
         if sector not in [1, 2, 3] or duration < 1 or duration > 60:
             return jsonify({'error': 'Invalid sector (1-3) or duration (1-60 seconds)'}), 400
         
-        # Log command to database
+        # Queue the command; merges with an undelivered one for the sector (double clicks)
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create control_commands table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS control_commands (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                command_type VARCHAR(50) NOT NULL,
-                sector_id INT DEFAULT NULL,
-                duration INT DEFAULT NULL,
-                timestamp DATETIME NOT NULL,
-                status VARCHAR(20) DEFAULT 'SUCCESS'
+        try:
+            command_id, outcome = enqueue_command(
+                conn, {'command_type': 'MANUAL_WATERING', 'sector_id': sector, 'duration': duration}
             )
-        """)
-        
-        # Insert command log
-        insert_query = """
-            INSERT INTO control_commands (command_type, sector_id, duration, timestamp, status)
-            VALUES (%s, %s, %s, %s, %s)
-        """
-        current_time = datetime.now()
-        cursor.execute(insert_query, ('MANUAL_WATERING', sector, duration, current_time, 'SUCCESS'))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+        finally:
+            conn.close()
         
-        logger.info(f"Water command logged: Sector {sector}, Duration {duration}s")
+        logger.info(f"Water command {outcome}: Sector {sector}, Duration {duration}s (command {command_id})")
         
         return jsonify({
             'success': True,
             'message': f'Watering sector {sector} for {duration} seconds',
             'sector': sector,
-            'duration': duration
+            'duration': duration,
+            'command_id': command_id,
+            'queued': outcome
         })
         
     except Exception as e:
@@ -640,23 +915,20 @@ def toggle_fan():
         data = request.get_json() or {}
         action = data.get('action', 'toggle')  # This should get 'on', 'off', or 'auto'
         
-        # Log to database with the action
+        # Queue the command; supersedes any fan command the node hasn't picked up yet
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO control_commands (command_type, action, timestamp, status)
-            VALUES (%s, %s, %s, %s)
-        """, ('FAN_CONTROL', action.upper(), datetime.now(), 'SUCCESS'))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        try:
+            command_id, outcome = enqueue_command(conn, {'command_type': 'FAN_CONTROL', 'action': action.upper()})
+            conn.commit()
+        finally:
+            conn.close()
         
         return jsonify({
             'success': True,
             'message': f'Fan set to {action.upper()}',
-            'action': action
+            'action': action,
+            'command_id': command_id,
+            'queued': outcome
         })
         
     except Exception as e:
@@ -671,35 +943,23 @@ def toggle_lights():
         action = data.get('action', 'toggle')
         brightness = data.get('brightness', 80)
         
-        # Log to database (simplified)
+        # Queue the command; supersedes any light command the node hasn't picked up yet
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS control_commands (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                command_type VARCHAR(50) NOT NULL,
-                sector_id INT DEFAULT NULL,
-                duration INT DEFAULT NULL,
-                timestamp DATETIME NOT NULL,
-                status VARCHAR(20) DEFAULT 'SUCCESS'
+        try:
+            command_id, outcome = enqueue_command(
+                conn, {'command_type': 'LIGHT_CONTROL', 'action': action.upper(), 'brightness': brightness}
             )
-        """)
-        
-        cursor.execute("""
-            INSERT INTO control_commands (command_type, timestamp, status)
-            VALUES (%s, %s, %s)
-        """, ('LIGHT_CONTROL', datetime.now(), 'SUCCESS'))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+        finally:
+            conn.close()
         
         return jsonify({
             'success': True,
             'message': f'Lights set to {action.upper()} (brightness: {brightness}%)',
             'action': action,
-            'brightness': brightness
+            'brightness': brightness,
+            'command_id': command_id,
+            'queued': outcome
         })
         
     except Exception as e:
@@ -707,6 +967,119 @@ def toggle_lights():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/control/status', methods=['GET'])
+def get_control_status():
+    """Automatic control policies and how fast this process has reacted to readings"""
+    return jsonify(control_engine.status())
+
+
+def percentiles(values):
+    """Nearest-rank p50/p95/p99 and max of a list of milliseconds"""
+    if not values:
+        return {'samples': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    values = sorted(values)
+    ranks = {f'p{p}': values[max(0, -(-len(values) * p // 100) - 1)] for p in (50, 95, 99)}
+    return {'samples': len(values), **ranks, 'max': values[-1]}
+
+
+@app.route('/api/commands/latency', methods=['GET'])
+def get_command_latency():
+    """Per node type: command outcomes, dispatch latency (queued -> delivered) and
+    ack latency (delivered -> Arduino reply) over the last ?hours= (default 24, max 168)"""
+    hours = min(max(request.args.get('hours', 24, type=int) or 24, 1), 168)
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT command_type, status,
+                   TIMESTAMPDIFF(MICROSECOND, timestamp, delivered_at) / 1000 AS dispatch_ms,
+                   TIMESTAMPDIFF(MICROSECOND, delivered_at, completed_at) / 1000 AS ack_ms
+            FROM control_commands
+            WHERE timestamp >= NOW(3) - INTERVAL %s HOUR
+        """, (hours,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Error as e:
+        logger.error(f"Error reading command latency: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+    nodes = {}
+    for row in rows:
+        node = nodes.setdefault(COMMAND_NODES.get(row['command_type'], row['command_type']),
+                                {'statuses': {}, 'dispatch': [], 'ack': [], 'end_to_end': []})
+        node['statuses'][row['status']] = node['statuses'].get(row['status'], 0) + 1
+        if row['dispatch_ms'] is not None:
+            node['dispatch'].append(float(row['dispatch_ms']))
+        if row['status'] == 'ACKED' and row['ack_ms'] is not None:
+            node['ack'].append(float(row['ack_ms']))
+            if row['dispatch_ms'] is not None:
+                node['end_to_end'].append(float(row['dispatch_ms'] + row['ack_ms']))
+
+    return jsonify({
+        'hours': hours,
+        'nodes': {
+            node_type: {
+                'commands': sum(node['statuses'].values()),
+                'statuses': node['statuses'],
+                'dispatch_ms': percentiles(node['dispatch']),
+                'ack_ms': percentiles(node['ack']),
+                'end_to_end_ms': percentiles(node['end_to_end'])
+            } for node_type, node in nodes.items()
+        }
+    })
+
+
+@app.route('/api/schedules', methods=['GET'])
+def list_schedules():
+    """Active schedules with their next run, soonest first"""
+    try:
+        upcoming = scheduler.upcoming()
+    except Error as e:
+        logger.error(f"Error listing schedules: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    schedules = [
+        {key: value.isoformat() if isinstance(value, datetime) else value for key, value in schedule.items()}
+        for schedule in upcoming
+    ]
+    return jsonify({'schedules': schedules, 'count': len(schedules)})
+
+
+@app.route('/api/schedules', methods=['POST'])
+def create_schedule():
+    """Add a cron or interval schedule, e.g.
+    {"kind": "cron", "spec": "0 6 * * *", "command_type": "MANUAL_WATERING", "sector_id": 2, "duration": 15}
+    """
+    data = get_request_json()
+    if not data:
+        return jsonify({'error': 'Invalid or missing JSON data'}), 400
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+
+    schedule, error = validate_schedule(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        schedule_id = scheduler.add(schedule)
+    except Error as e:
+        logger.error(f"Error creating schedule: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    return jsonify({'success': True, 'id': schedule_id, 'name': schedule['name']}), 201
+
+
+@app.route('/api/schedules/<int:schedule_id>', methods=['DELETE'])
+def delete_schedule(schedule_id):
+    try:
+        deleted = scheduler.remove(schedule_id)
+    except Error as e:
+        logger.error(f"Error deleting schedule {schedule_id}: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    if not deleted:
+        return jsonify({'error': 'Schedule not found'}), 404
+    return jsonify({'success': True})
+
+
 @app.route('/api/statistics', methods=['GET'])
 def get_statistics():
     """Get system-wide statistics"""
@@ -834,6 +1207,199 @@ def get_statistics():
         print(f"Error in statistics: {e}")
         return jsonify({'error': str(e)}), 500
 
+
+########################################### EXPORT ###########################3
+
+# Raw readings leave the database in (timestamp, id) order, which the
+# idx_<table>_timestamp index from migration 0003 serves without a sort.
+EXPORT_COLUMNS = {
+    'ventilation': ['id', 'sector_id', 'temperature', 'humidity', 'timestamp'],
+    'soil_health': ['id', 'sector_id', 'raw_value', 'soil_moisture', 'timestamp'],
+    'plant': ['id', 'sector_id', 'height_cm', 'timestamp'],
+    'leaf_count': ['id', 'sector_id', 'leaf_count', 'timestamp'],
+}
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_ROWS = 2000  # Rows per fetchmany() and per chunk written to the client
+EXPORT_MAX_STREAMS = 2  # Concurrent streamed exports, each on its own (non-pooled) connection
+EXPORT_NET_WRITE_TIMEOUT = 600  # Seconds MySQL waits on a slow download before aborting it
+EXPORT_PAGE_SIZE = 1000
+EXPORT_MAX_PAGE_SIZE = 10000
+export_streams = threading.BoundedSemaphore(EXPORT_MAX_STREAMS)
+
+
+def parse_export_time(value):
+    """Optional ISO timestamp query parameter (naive local time, like the stored timestamps)"""
+    if not value:
+        return None
+    return parse_local_time(value)
+
+
+def export_query(table, start, end, after=None, limit=None):
+    """SELECT for one table and [start, end) range in keyset order, with its parameters"""
+    conditions, params = [], []
+    if start:
+        conditions.append("timestamp >= %s")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < %s")
+        params.append(end)
+    if after:
+        conditions.append("(timestamp, id) > (%s, %s)")
+        params.extend(after)
+
+    query = f"SELECT {', '.join(EXPORT_COLUMNS[table])} FROM `{table}`"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp, id"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_export_rows(columns, rows, fmt):
+    """One chunk of CSV lines or NDJSON records"""
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(dict(zip(columns, map(export_value, row)))) + '\n' for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows([[export_value(value) for value in row] for row in rows])
+    return buffer.getvalue()
+
+
+def open_export_cursor(query, params):
+    """Dedicated connection and unbuffered cursor for one streamed export
+
+    A long download would otherwise hold a pool connection for its whole
+    duration; rows stream from the server as they are fetched.
+    """
+    conn = mysql.connector.connect(**db_config)
+    try:
+        setup = conn.cursor()
+        setup.execute(f"SET SESSION net_write_timeout = {EXPORT_NET_WRITE_TIMEOUT}")
+        setup.close()
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, params)
+        return conn, cursor
+    except Error:
+        conn.close()
+        raise
+
+
+def close_export_cursor(conn, cursor):
+    try:
+        cursor.close()
+    except Error:
+        pass  # Unread rows after a client disconnect; closing the connection discards them
+    conn.close()
+
+
+def stream_export(table, cursor, fmt):
+    """Yield the export in EXPORT_CHUNK_ROWS chunks; only one chunk is ever in memory"""
+    columns = EXPORT_COLUMNS[table]
+    if fmt == 'csv':
+        yield ','.join(columns) + '\n'
+
+    rows = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not batch:
+                break
+            rows += len(batch)
+            yield encode_export_rows(columns, batch, fmt)
+        logger.info(f"Exported {rows} {table} rows as {fmt}")
+    except Error as e:
+        # Headers are already sent; all we can do is end the stream early
+        logger.error(f"Export of {table} failed after {rows} rows: {e}")
+
+
+@app.route('/api/export', methods=['GET'])
+def export_readings():
+    """Export raw readings for one table
+
+    Query: table, optional from/to (ISO, [from, to)), format=csv|ndjson|json.
+    csv and ndjson stream the whole range. json returns one keyset page of
+    `limit` rows plus `next_after`; pass it back as `after` for the next page.
+    """
+    table = request.args.get('table')
+    fmt = request.args.get('format', 'csv')
+    if table not in EXPORT_COLUMNS:
+        return jsonify({'error': f"table must be one of: {', '.join(EXPORT_COLUMNS)}"}), 400
+    if fmt not in EXPORT_MIMETYPES and fmt != 'json':
+        return jsonify({'error': 'format must be csv, ndjson or json'}), 400
+
+    try:
+        start = parse_export_time(request.args.get('from'))
+        end = parse_export_time(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO timestamps'}), 400
+
+    if fmt == 'json':
+        return export_page(table, start, end)
+
+    if not export_streams.acquire(blocking=False):
+        return jsonify({'error': 'Too many exports in progress, retry shortly'}), 429
+
+    query, params = export_query(table, start, end)
+    try:
+        conn, cursor = open_export_cursor(query, params)
+    except Error as e:
+        export_streams.release()
+        logger.error(f"Export of {table} failed: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+    response = Response(stream_export(table, cursor, fmt), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{fmt}'
+    # Runs when the response is closed: after the last chunk or on client disconnect
+    response.call_on_close(lambda: close_export_cursor(conn, cursor))
+    response.call_on_close(export_streams.release)
+    return response
+
+
+def export_page(table, start, end):
+    """One keyset page: WHERE (timestamp, id) > after, so deep pages cost the same as the first"""
+    try:
+        limit = min(int(request.args.get('limit', EXPORT_PAGE_SIZE)), EXPORT_MAX_PAGE_SIZE)
+        after = None
+        if request.args.get('after'):
+            after_time, after_id = request.args['after'].rsplit('|', 1)
+            after = (parse_export_time(after_time), int(after_id))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer and after a next_after value'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    query, params = export_query(table, start, end, after, limit)
+    conn = get_db_connection()
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()  # At most EXPORT_MAX_PAGE_SIZE rows
+    except Error as e:
+        logger.error(f"Export page of {table} failed: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        conn.close()
+
+    columns = EXPORT_COLUMNS[table]
+    next_after = None
+    if len(rows) == limit:
+        last = dict(zip(columns, rows[-1]))
+        next_after = f"{last['timestamp'].isoformat()}|{last['id']}"
+    return jsonify({
+        'table': table,
+        'rows': [dict(zip(columns, map(export_value, row))) for row in rows],
+        'count': len(rows),
+        'next_after': next_after
+    })
+
 @app.route('/test-db', methods=['GET'])
 def test_database_connection():
     """Test database connectivity and return basic stats"""
@@ -932,6 +1498,62 @@ def get_growth_stage(height_cm):
 
 
 
+def run_migrations():
+    """Bring the schema up to date (request paths do no DDL)"""
+    conn = get_db_connection()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+schema_ready = False
+schema_lock = threading.Lock()
+
+
+def ensure_schema():
+    """Run the migrations once per process, from its entry point
+
+    Called by `python app.py`, ingest_worker.py and the scheduler start-up, never
+    while handling a request. Under `flask run` or a WSGI server, run
+    `python -m migrations` at deploy time instead. migrate() holds a MySQL
+    GET_LOCK, so processes starting together take turns and all but the first
+    find nothing to do.
+    """
+    global schema_ready
+    if schema_ready:
+        return
+    with schema_lock:
+        if not schema_ready:
+            run_migrations()
+            schema_ready = True
+
+
+def start_scheduler():
+    """Start the scheduler in the background, retrying until the database is reachable"""
+    def start():
+        while True:
+            try:
+                ensure_schema()
+                scheduler.start()
+                return
+            except Exception as e:
+                logger.error(f"Scheduler failed to start, retrying in {SCHEDULER_START_RETRY}s: {e}")
+                time.sleep(SCHEDULER_START_RETRY)
+
+    threading.Thread(target=start, name='scheduler-start', daemon=True).start()
+
+
 # Run the app
 if __name__ == '__main__':
-    app.run(debug=True)  
\ No newline at end of file
+    try:
+        ensure_schema()
+    except Exception as e:
+        logger.error(f"Schema migration failed: {e}")
+        raise
+    # The debug reloader runs this block twice; only its child process serves requests
+    if SCHEDULER_ENABLED and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler()
+    app.run(debug=True)
+elif SCHEDULER_ENABLED:
+    start_scheduler()  # Imported by a WSGI server or `flask run`  
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+IoT Greenhouse - Command Queue
+The one place control_commands rows are created (buttons, control_engine.py,
+scheduler.py), coalescing commands the listeners haven't picked up yet
+
+Lifecycle of a command (migration 0009):
+    QUEUED      inserted here
+    DELIVERED   claimed by the node's listener just before it is written to the Arduino
+    ACKED       the Arduino confirmed it
+    REJECTED    the Arduino refused it
+    EXPIRED     not delivered within the listener's COMMAND_TTL, or no reply from the Arduino
+    SUPERSEDED  replaced by a newer command before delivery (below)
+
+- FAN_CONTROL / LIGHT_CONTROL set a state, so only the newest one matters:
+  a new command supersedes every QUEUED older one, and repeating the queued
+  command adds nothing.
+- MANUAL_WATERING for a sector within MERGE_WINDOW seconds of a QUEUED one
+  merges with it (double clicks, the control engine and a schedule firing
+  together) and runs once, for the longer duration.
+
+Superseded rows are kept, with superseded_by pointing at their replacement.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+# Configuration
+PENDING_STATUS = 'QUEUED'  # What the listeners poll for
+SUPERSEDED_STATUS = 'SUPERSEDED'
+MERGE_WINDOW = 10  # Seconds within which watering commands for a sector merge
+COMMAND_NODES = {
+    # command_type: edge_devices.node_type of the listener that executes it (latency report)
+    'MANUAL_WATERING': 'soil_health_node',
+    'FAN_CONTROL': 'ventilation_node',
+    'LIGHT_CONTROL': 'light_growth_node',
+}
+STATE_COMMANDS = ('FAN_CONTROL', 'LIGHT_CONTROL')
+
+logger = logging.getLogger(__name__)
+
+
+def latest_pending(cursor, command, since=None):
+    """(id, action, brightness, duration) of the newest undelivered command for the same target, or None"""
+    query = """
+        SELECT id, action, brightness, duration FROM control_commands
+        WHERE command_type = %s AND sector_id <=> %s AND status = %s
+    """
+    params = [command['command_type'], command.get('sector_id'), PENDING_STATUS]
+    if since:
+        query += " AND timestamp >= %s"
+        params.append(since)
+    cursor.execute(query + " ORDER BY id DESC LIMIT 1", params)
+    return cursor.fetchone()
+
+
+def enqueue_command(conn, command, source='manual', reaction_ms=None):
+    """Queue command (dict with command_type and its fields); returns (id, outcome)
+
+    outcome is 'queued' for a new row, or 'duplicate' / 'merged' when an
+    undelivered command already covers it (id is then that command's). The
+    caller commits.
+    """
+    cursor = conn.cursor()
+    try:
+        return coalesce_and_insert(cursor, command, source, reaction_ms)
+    finally:
+        cursor.close()
+
+
+def coalesce_and_insert(cursor, command, source, reaction_ms):
+    command_type = command['command_type']
+    now = datetime.now()
+
+    if command_type in STATE_COMMANDS:
+        pending = latest_pending(cursor, command)
+        if pending and (pending[1], pending[2]) == (command.get('action'), command.get('brightness')):
+            return pending[0], 'duplicate'
+    else:
+        pending = latest_pending(cursor, command, since=now - timedelta(seconds=MERGE_WINDOW))
+        if pending and (pending[3] or 0) >= (command.get('duration') or 0):
+            return pending[0], 'merged'
+
+    cursor.execute("""
+        INSERT INTO control_commands
+            (command_type, action, sector_id, duration, brightness, timestamp, status, source, reaction_ms)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (command_type, command.get('action'), command.get('sector_id'), command.get('duration'),
+          command.get('brightness'), now, PENDING_STATUS, source, reaction_ms))
+    command_id = cursor.lastrowid
+
+    # State commands: everything older for the target is moot. Watering: only the
+    # shorter run this one merges with. Bounded by command_id, so concurrent
+    # requests can't supersede a newer command.
+    query = """
+        UPDATE control_commands SET status = %s, superseded_by = %s
+        WHERE command_type = %s AND sector_id <=> %s AND status = %s AND id < %s
+    """
+    params = [SUPERSEDED_STATUS, command_id, command_type, command.get('sector_id'), PENDING_STATUS, command_id]
+    if command_type not in STATE_COMMANDS:
+        query += " AND timestamp >= %s"
+        params.append(now - timedelta(seconds=MERGE_WINDOW))
+    cursor.execute(query, params)
+    if cursor.rowcount:
+        logger.info(f"{command_type} {command_id} superseded {cursor.rowcount} undelivered command(s)")
+    return command_id, 'queued'
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Response Compression Benchmark
+Measures wire bytes and CPU cost of the gzip/brotli response encoding in app.py
+
+Builds dashboard/statistics payloads shaped like /api/dashboard-data and
+/api/statistics (3 sectors, readings at the publishers' usual cadence) and
+times compress_body() for each coding at the configured level, plus a few
+alternative levels for comparison.
+
+Usage:
+    python compression_benchmark.py
+    python compression_benchmark.py --plant-interval 60 --repeat 50
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import app
+
+SECTORS = [1, 2, 3]
+
+
+def build_dashboard_payload(plant_interval_s):
+    """A /api/dashboard-data body with a full 7-day plant trend"""
+    now = datetime.now()
+    readings_per_sector = int(7 * 24 * 3600 / plant_interval_s)
+    trend = []
+    for i in range(readings_per_sector):
+        timestamp = (now - timedelta(seconds=(readings_per_sector - i) * plant_interval_s)).isoformat()
+        for sector_id in SECTORS:
+            trend.append({
+                'sector_id': sector_id,
+                'height_cm': round(5.0 + sector_id + i * 0.0005, 1),
+                'timestamp': timestamp
+            })
+
+    return {
+        'current_conditions': {'temperature': 27.4, 'humidity': 61.0, 'last_updated': now.isoformat()},
+        'soil_moisture': {'current': {
+            f'sector_{s}': {'moisture_percent': 40.0 + s, 'raw_value': 600 - s, 'status': 'LOW',
+                            'timestamp': now.isoformat()} for s in SECTORS
+        }},
+        'plant_heights': {
+            'current': {f'sector_{s}': {'height_cm': 12.5, 'growth_stage': 'Vegetative',
+                                        'timestamp': now.isoformat()} for s in SECTORS},
+            'trend_7d': trend
+        },
+        'leaf_count': {'current': 18, 'timestamp': now.isoformat()},
+        'environmental_trend': [
+            {'temperature': 27.0 + (i % 5) * 0.1, 'humidity': 60.0 + (i % 7) * 0.2,
+             'timestamp': (now - timedelta(minutes=24 - i)).isoformat()} for i in range(24)
+        ]
+    }
+
+
+def build_statistics_payload():
+    """A /api/statistics body"""
+    now = datetime.now()
+    return {
+        'total_readings': {'temperature': 120000, 'soil_moisture': 360000, 'plant_height': 90000, 'leaf_count': 4000},
+        'environmental_stats_24h': {
+            'temperature': {'average': 27.1, 'min': 22.4, 'max': 31.9},
+            'humidity': {'average': 61.3, 'min': 48.0, 'max': 77.5}
+        },
+        'soil_stats_24h': {f'sector_{s}': {'average_moisture': 41.2, 'min_moisture': 30.1, 'max_moisture': 55.0,
+                                           'reading_count': 1440} for s in SECTORS},
+        'plant_growth_stats': {f'sector_{s}': {'current_height': 12.5, 'initial_height': 2.0, 'total_growth': 10.5,
+                                               'measurement_count': 30000} for s in SECTORS},
+        'recent_commands': [{'command': 'MANUAL_WATERING', 'action': None, 'sector_id': 1 + i % 3,
+                             'timestamp': (now - timedelta(minutes=i)).isoformat(), 'status': 'ACKED'}
+                            for i in range(10)]
+    }
+
+
+def time_call(func, repeat):
+    """Median wall time of func() in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def benchmark_payload(name, payload, repeat):
+    # Same serialisation Flask's jsonify uses
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    print(f"\n{name}: {len(raw):,} bytes uncompressed")
+    print(f"  {'coding':<22}{'wire bytes':>12}{'ratio':>8}{'compress ms':>14}{'decompress ms':>16}")
+
+    variants = [(f'gzip level {level}', 'gzip', level) for level in (1, app.GZIP_LEVEL, 9)]
+    if app.brotli is not None:
+        variants += [(f'br quality {quality}', 'br', quality) for quality in (1, app.BROTLI_QUALITY, 11)]
+
+    for label, coding, level in variants:
+        if coding == 'gzip':
+            compress = lambda: gzip.compress(raw, compresslevel=level)
+            decompress = gzip.decompress
+        else:
+            compress = lambda: app.brotli.compress(raw, mode=app.brotli.MODE_TEXT, quality=level)
+            decompress = app.brotli.decompress
+        body = compress()
+        compress_ms = time_call(compress, repeat)
+        decompress_ms = time_call(lambda: decompress(body), repeat)
+        marker = ' *' if level == (app.GZIP_LEVEL if coding == 'gzip' else app.BROTLI_QUALITY) else ''
+        print(f"  {label + marker:<22}{len(body):>12,}{len(raw) / len(body):>7.1f}x"
+              f"{compress_ms:>14.2f}{decompress_ms:>16.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON response compression")
+    parser.add_argument("--plant-interval", type=int, default=300,
+                        help="Seconds between plant height readings in the 7-day trend")
+    parser.add_argument("--repeat", type=int, default=20, help="Timing repetitions per measurement")
+    args = parser.parse_args()
+
+    print("Response compression benchmark (* = level configured in app.py)")
+    print("=" * 72)
+    benchmark_payload(f"/api/dashboard-data (plant reading every {args.plant_interval}s)",
+                      build_dashboard_payload(args.plant_interval), args.repeat)
+    benchmark_payload("/api/statistics", build_statistics_payload(), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
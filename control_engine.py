@@ -0,0 +1,192 @@
+"""
+IoT Greenhouse - Closed-Loop Control Engine
+Turns ingested readings into actuator commands without a human in the loop
+
+Runs on every batch insert_readings() stores:
+- watering  soil moisture below the sector's target -> MANUAL_WATERING for a
+            duration proportional to the shortfall
+- fan       temperature above the setpoint -> FAN_CONTROL ON; once it is back
+            below setpoint - hysteresis -> release_action (AUTO hands the fan
+            back to the firmware's own thermostat)
+
+Commands are queued straight into control_commands (source 'auto', through
+command_queue.py), where the listeners pick them up. reaction_ms on each row is
+the time from the reading being received to the command being queued.
+
+Guards, per actuator: a cooldown since its last command (manual or automatic),
+a longer hold after a manual command so automation doesn't fight the user, and
+at most max_per_hour automatic commands. These are checked against
+control_commands only when a policy wants to act, so manual commands and other
+ingesting processes are respected; per-reading evaluation stays in memory.
+
+Off unless CONTROL_ENABLED=1, so a deployment only starts driving actuators
+once someone has chosen to.
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+
+from command_queue import enqueue_command
+
+# Configuration
+CONTROL_ENABLED = os.environ.get('CONTROL_ENABLED', '0') == '1'  # Opt-in: set CONTROL_ENABLED=1 to let it act
+MAX_READING_AGE = 300  # Seconds; older readings (backfills) never trigger commands
+MANUAL_HOLD_SECONDS = 1800  # Automation leaves an actuator alone this long after a manual command
+REACTION_SAMPLES = 200  # Recent reaction times kept for /api/control/status
+# Commands that went (or may still go) out; superseded, expired and rejected ones never acted
+EFFECTIVE_STATUSES = ('QUEUED', 'DELIVERED', 'ACKED')
+
+WATERING_DEFAULTS = {
+    'target': 40.0,  # Soil moisture % the sector is watered back up to
+    'seconds_per_percent': 1.0,
+    'min_duration': 5,
+    'max_duration': 30,  # /api/water-plants allows up to 60
+    'cooldown': 900,  # Let the water soak in before the probe is trusted again
+    'max_per_hour': 2,
+}
+WATERING_POLICIES = {1: {}, 2: {}, 3: {}}  # Sectors under automatic watering: overrides of WATERING_DEFAULTS
+FAN_POLICY = {
+    'setpoint': 28.0,
+    'hysteresis': 1.5,
+    'release_action': 'AUTO',
+    'cooldown': 120,
+    'max_per_hour': 10,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ControlEngine:
+    def __init__(self, connect, enabled=CONTROL_ENABLED):
+        self.connect = connect  # Returns a database connection; close() releases it
+        self.enabled = enabled
+        self.watering = {sector: {**WATERING_DEFAULTS, **overrides} for sector, overrides in WATERING_POLICIES.items()}
+        self.fan = FAN_POLICY
+        self.lock = threading.Lock()
+        self.fan_state = None  # Last FAN_CONTROL action seen when acting; None until then
+        self.blocked_until = {}  # actuator -> monotonic time before which guards are known to block
+        self.reactions = deque(maxlen=REACTION_SAMPLES)
+
+    def observe(self, table, readings):
+        """Evaluate the policies for table against freshly stored readings"""
+        if not self.enabled or table not in ('soil_health', 'ventilation'):
+            return
+        now = datetime.now()
+        with self.lock:
+            for reading in readings:
+                if (now - reading['timestamp']).total_seconds() > MAX_READING_AGE:
+                    continue
+                if table == 'soil_health':
+                    self.evaluate_watering(reading)
+                else:
+                    self.evaluate_fan(reading)
+
+    def evaluate_watering(self, reading):
+        policy = self.watering.get(reading['sector_id'])
+        if policy is None or reading.get('soil_moisture') is None:
+            return
+        shortfall = policy['target'] - float(reading['soil_moisture'])
+        if shortfall <= 0:
+            return
+        duration = int(round(shortfall * policy['seconds_per_percent']))
+        duration = max(policy['min_duration'], min(policy['max_duration'], duration))
+        self.act(('watering', reading['sector_id']), policy, reading, {
+            'command_type': 'MANUAL_WATERING', 'sector_id': reading['sector_id'], 'duration': duration
+        })
+
+    def evaluate_fan(self, reading):
+        if reading.get('temperature') is None:
+            return
+        temperature = float(reading['temperature'])
+        if temperature > self.fan['setpoint'] and self.fan_state != 'ON':
+            action = 'ON'
+        elif temperature < self.fan['setpoint'] - self.fan['hysteresis'] and self.fan_state == 'ON':
+            action = self.fan['release_action']
+        else:
+            return
+        self.act(('fan', None), self.fan, reading, {'command_type': 'FAN_CONTROL', 'action': action})
+
+    def act(self, actuator, policy, reading, command):
+        """Queue command unless a guard blocks it"""
+        if time.monotonic() < self.blocked_until.get(actuator, 0):
+            return
+
+        conn = self.connect()
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            blocked_for = self.guard(cursor, actuator, policy, command)
+            if blocked_for:
+                self.blocked_until[actuator] = time.monotonic() + blocked_for
+                return
+
+            reaction_ms = int((datetime.now() - reading['timestamp']).total_seconds() * 1000)
+            command_id, outcome = enqueue_command(conn, command, source='auto', reaction_ms=reaction_ms)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to queue {command['command_type']}: {e}")
+            return
+        finally:
+            if cursor:
+                cursor.close()
+            conn.close()
+
+        if command['command_type'] == 'FAN_CONTROL':
+            self.fan_state = command['action']
+        self.blocked_until[actuator] = time.monotonic() + policy['cooldown']
+        self.reactions.append(reaction_ms)
+        logger.info(f"Auto {command['command_type']} {command.get('action') or ''}"
+                    f"{' sector ' + str(command['sector_id']) if command.get('sector_id') else ''}"
+                    f"{' for ' + str(command['duration']) + 's' if command.get('duration') else ''}"
+                    f" {outcome} as {command_id} {reaction_ms} ms after the reading")
+
+    def guard(self, cursor, actuator, policy, command):
+        """Seconds the actuator is blocked for (0 if the command may go out now)"""
+        cursor.execute("""
+            SELECT action, source, timestamp FROM control_commands
+            WHERE command_type = %s AND sector_id <=> %s AND status IN (%s, %s, %s)
+            ORDER BY timestamp DESC LIMIT 1
+        """, (command['command_type'], command.get('sector_id'), *EFFECTIVE_STATUSES))
+        last = cursor.fetchone()
+        now = datetime.now()
+        if last:
+            if command['command_type'] == 'FAN_CONTROL':
+                self.fan_state = last['action']
+                if last['action'] == command['action']:
+                    return policy['cooldown']  # Already in the wanted state
+            age = (now - last['timestamp']).total_seconds()
+            hold = MANUAL_HOLD_SECONDS if last['source'] != 'auto' else policy['cooldown']
+            if age < hold:
+                return hold - age
+
+        cursor.execute("""
+            SELECT timestamp FROM control_commands
+            WHERE command_type = %s AND sector_id <=> %s AND source = 'auto' AND timestamp >= %s
+              AND status IN (%s, %s, %s)
+            ORDER BY timestamp
+        """, (command['command_type'], command.get('sector_id'), now - timedelta(hours=1), *EFFECTIVE_STATUSES))
+        recent = cursor.fetchall()
+        if len(recent) >= policy['max_per_hour']:
+            # Blocked until the oldest command in the window is an hour old
+            oldest = recent[len(recent) - policy['max_per_hour']]['timestamp']
+            return max(1.0, 3600 - (now - oldest).total_seconds())
+        return 0
+
+    def status(self):
+        """Policies, fan state and recent reaction times (ms)"""
+        with self.lock:
+            reactions = sorted(self.reactions)
+        return {
+            'enabled': self.enabled,
+            'watering': self.watering,
+            'fan': {**self.fan, 'state': self.fan_state},
+            'reaction_ms': {
+                'samples': len(reactions),
+                'p50': reactions[len(reactions) // 2] if reactions else None,
+                'max': reactions[-1] if reactions else None
+            }
+        }
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Direct MQTT Ingest Worker
+Subscribes to the schedule_1/* sensor topics and writes readings straight into MySQL
+
+This replaces the IoT Core -> Lambda -> HTTP POST -> Flask route path for sensor data.
+Messages are decoded as they arrive, validated with the same helpers as the Flask
+ingest routes (app.py), buffered, and flushed as bulk inserts on pooled connections.
+
+Requirements:
+- pip install paho-mqtt mysql-connector-python flask
+
+Usage:
+    python ingest_worker.py                                    # AWS IoT Core (TLS + certs)
+    python ingest_worker.py --host localhost --port 1883 --no-tls   # local Mosquitto broker
+"""
+
+import argparse
+import json
+import queue
+import time
+import logging
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+from mysql.connector import Error, InterfaceError, OperationalError
+from mysql.connector.errors import PoolError
+
+from app import INGEST_VALIDATORS, anomaly_detector, ensure_schema, screen_readings, store_readings
+
+# Configuration
+CLIENT_ID = "greenhouse_ingest_worker"
+BATCH_SIZE = 200  # Flush as soon as this many readings are buffered
+FLUSH_INTERVAL = 2.0  # ...or at least this often (seconds)
+MAX_BUFFERED = 10000  # Readings kept in memory while the database is unavailable
+ANOMALY_STATE_FILE = "anomaly_state_ingest_worker.json"  # Separate from the Flask app's snapshot
+# Errors worth retrying the same rows for (database unreachable or busy). Anything
+# else (DataError, IntegrityError, ...) is about the rows and would fail every time.
+TRANSIENT_ERRORS = (InterfaceError, OperationalError, PoolError)
+
+# AWS IoT Configuration - Use your actual certificate files
+AWS_IOT_ENDPOINT = "azoj5h57hjr65-ats.iot.us-east-1.amazonaws.com"
+ROOT_CA_PATH = "./certs/AmazonRootCA1.pem"
+PRIVATE_KEY_PATH = "./certs/5435e0960ffa0fc7dee861aef3306c7ed7fac5896304b3cfa27991354fdfc227-private.pem.key"
+CERTIFICATE_PATH = "./certs/5435e0960ffa0fc7dee861aef3306c7ed7fac5896304b3cfa27991354fdfc227-certificate.pem.crt"
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+# Topic decoders - same field mapping as the lambda/*.py handlers.
+# Each returns a list of (table, data) pairs in the shape the Flask routes accept,
+# and raises ValueError for a message that doesn't have the expected structure.
+
+def require_object(value, what):
+    """value if it is a JSON object (dict), else ValueError"""
+    if not isinstance(value, dict):
+        raise ValueError(f"{what} is not a JSON object")
+    return value
+
+
+def decode_temperature(message):
+    """schedule_1/temperature -> one ventilation reading"""
+    return [('ventilation', {
+        'temperature': message.get('temperature'),
+        'humidity': message.get('humidity'),
+        'sector_id': message.get('sector_id', 1)
+    })]
+
+
+def decode_soil_moisture(message):
+    """schedule_1/soil_moisture -> one soil_health reading per sensor"""
+    readings = []
+    sensors = require_object(message.get('soil_sensors', {}), 'soil_sensors')
+    for sensor_key in ['sensor_a', 'sensor_b', 'sensor_c']:
+        sensor_data = sensors.get(sensor_key)
+        if sensor_data:
+            require_object(sensor_data, sensor_key)
+            readings.append(('soil_health', {
+                'sector_id': sensor_data.get('sector'),
+                'raw_value': sensor_data.get('raw_value'),
+                'soil_moisture': sensor_data.get('moisture_percent')
+            }))
+    return readings
+
+
+def decode_light_growth(message):
+    """schedule_1/light_growth -> one plant reading per plant with a height"""
+    readings = []
+    for key, plant in require_object(message.get('plant_heights') or {}, 'plant_heights').items():
+        require_object(plant, key)
+        height_cm = plant.get('height_cm')
+        # Skip plants the ultrasonic sensor could not read
+        if height_cm is None or height_cm == -1:
+            continue
+        readings.append(('plant', {
+            'sector_id': plant.get('sector'),
+            'height_cm': height_cm
+        }))
+    return readings
+
+
+def decode_leaf_count(message):
+    """schedule_1/leaf_count -> one leaf_count reading per sector"""
+    sectors = message.get('sectors')
+    if not sectors:
+        return [('leaf_count', {'leaf_count': message.get('leaf_count'), 'sector_id': message.get('sector_id', 1)})]
+    if not isinstance(sectors, list):
+        raise ValueError("sectors is not a JSON array")
+    return [('leaf_count', {'leaf_count': sector.get('leaf_count'), 'sector_id': sector.get('sector_id')})
+            for sector in (require_object(sector, 'sectors entry') for sector in sectors)]
+
+
+TOPIC_DECODERS = {
+    "schedule_1/temperature": decode_temperature,
+    "schedule_1/soil_moisture": decode_soil_moisture,
+    "schedule_1/light_growth": decode_light_growth,
+    "schedule_1/leaf_count": decode_leaf_count,
+}
+
+
+def decode_message(topic, payload, received_at=None):
+    """Decode one MQTT message into validated (table, row) pairs"""
+    decoder = TOPIC_DECODERS.get(topic)
+    if decoder is None:
+        return []
+
+    try:
+        readings = decoder(require_object(json.loads(payload), 'message'))
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.warning(f"Dropping malformed message on {topic}: {e}")
+        return []
+
+    received_at = received_at or datetime.now()
+    rows = []
+    for table, data in readings:
+        row, error = INGEST_VALIDATORS[table](data, received_at)
+        if error:
+            logger.warning(f"Dropping invalid {table} reading from {topic}: {error}")
+            continue
+        rows.append((table, row))
+    return rows
+
+
+class IngestWorker:
+    def __init__(self, host=AWS_IOT_ENDPOINT, port=8883, use_tls=True):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.mqtt_client = None
+        self.incoming = queue.Queue()
+        self.buffered = {table: [] for table in INGEST_VALIDATORS}  # Validated rows, not screened yet
+        self.screened = {table: ([], []) for table in INGEST_VALIDATORS}  # (readings, anomalies) awaiting insert
+        self.running = False
+        self.total_written = 0
+        anomaly_detector.state_path = ANOMALY_STATE_FILE
+
+    def setup_mqtt(self):
+        """Initialize MQTT client and subscribe to the sensor topics"""
+        self.mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID)
+        if self.use_tls:
+            self.mqtt_client.tls_set(ca_certs=ROOT_CA_PATH, certfile=CERTIFICATE_PATH, keyfile=PRIVATE_KEY_PATH)
+        self.mqtt_client.reconnect_delay_set(min_delay=1, max_delay=32)
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+
+        self.mqtt_client.connect_async(self.host, self.port, keepalive=60)
+        self.mqtt_client.loop_start()
+        logger.info(f"Connecting to MQTT broker {self.host}:{self.port} (TLS: {self.use_tls})")
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        """(Re)subscribe every time the connection comes up"""
+        if reason_code.is_failure:
+            logger.error(f"MQTT connection refused: {reason_code}")
+            return
+        client.subscribe([(topic, 1) for topic in TOPIC_DECODERS])
+        logger.info(f"Subscribed to {', '.join(TOPIC_DECODERS)}")
+
+    def on_message(self, client, userdata, msg):
+        """Decode on the network thread; database writes happen in run()"""
+        try:
+            for table, row in decode_message(msg.topic, msg.payload):
+                self.incoming.put((table, row))
+        except Exception as e:
+            # An exception here would end paho's network loop, and with it all ingestion
+            logger.error(f"Dropping message on {msg.topic} that failed to decode: {e}")
+
+    def buffered_count(self):
+        return sum(len(rows) for rows in self.buffered.values())
+
+    def drain_incoming(self, timeout):
+        """Move queued readings into the per-table buffers, waiting up to timeout for the first one"""
+        try:
+            table, row = self.incoming.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.buffered[table].append(row)
+        while self.buffered_count() < BATCH_SIZE:
+            try:
+                table, row = self.incoming.get_nowait()
+            except queue.Empty:
+                break
+            self.buffered[table].append(row)
+
+    def flush(self):
+        """Write buffered readings, one bulk insert per table
+
+        New rows are screened for anomalies once, here; a failed insert keeps the
+        screened readings, so retries don't feed them to the detector again.
+        """
+        for table, rows in self.buffered.items():
+            readings, anomalies = self.screened[table]
+            if rows:
+                new_readings, new_anomalies = screen_readings(table, rows)
+                readings += new_readings
+                anomalies += new_anomalies
+                self.buffered[table] = []
+            if not readings and not anomalies:
+                continue
+            try:
+                written = store_readings(table, readings, anomalies)
+                self.total_written += written
+                logger.info(f"Inserted {written} {table} readings")
+                self.screened[table] = ([], [])
+            except TRANSIENT_ERRORS as e:
+                logger.error(f"Failed to insert {len(readings)} {table} readings, will retry: {e}")
+                if len(readings) > MAX_BUFFERED:
+                    dropped = len(readings) - MAX_BUFFERED
+                    del readings[:dropped]
+                    logger.warning(f"Buffer full, dropped {dropped} oldest {table} readings")
+                del anomalies[:-MAX_BUFFERED]
+            except Error as e:
+                logger.error(f"Database rejected the {table} batch ({e}), isolating the bad readings")
+                written, remaining = self.store_isolating(table, readings, anomalies)
+                self.total_written += written
+                logger.info(f"Inserted {written} {table} readings")
+                self.screened[table] = remaining
+
+    def store_isolating(self, table, readings, anomalies):
+        """Store a batch the database rejected, bisecting it to drop only the rows it refuses
+
+        Returns (written, (readings, anomalies) still to store); the latter is
+        non-empty only if a transient error interrupted, so it is retried later.
+        """
+        try:
+            store_readings(table, [], anomalies)
+        except TRANSIENT_ERRORS:
+            return 0, (readings, anomalies)
+        except Error as e:
+            logger.error(f"Dropping {len(anomalies)} {table} anomaly rows the database rejects: {e}")
+
+        written = 0
+        chunks = [readings]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                written += store_readings(table, chunk, [])
+            except TRANSIENT_ERRORS as e:
+                logger.error(f"Failed to insert {table} readings, will retry: {e}")
+                return written, (chunk + [reading for rest in reversed(chunks) for reading in rest], [])
+            except Error as e:
+                if len(chunk) == 1:
+                    logger.error(f"Dropping {table} reading the database rejects: {chunk[0]} ({e})")
+                else:
+                    middle = len(chunk) // 2
+                    chunks += [chunk[middle:], chunk[:middle]]
+        return written, ([], [])
+
+    def run(self):
+        """Main loop - batch decoded readings and flush them to the database"""
+        logger.info("Starting ingest worker...")
+        logger.info(f"Batch size {BATCH_SIZE}, flush interval {FLUSH_INTERVAL}s")
+        try:
+            ensure_schema()  # alert_history, sensor_anomalies etc. may not exist yet on a fresh database
+        except Exception as e:
+            logger.error(f"Schema migration failed, not starting: {e}")
+            raise
+        self.setup_mqtt()
+        self.running = True
+        last_flush = time.monotonic()
+
+        try:
+            while self.running:
+                remaining = max(0.0, FLUSH_INTERVAL - (time.monotonic() - last_flush))
+                self.drain_incoming(timeout=remaining)
+
+                if self.buffered_count() >= BATCH_SIZE or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    self.flush()
+                    last_flush = time.monotonic()
+
+        except KeyboardInterrupt:
+            logger.info("Shutting down...")
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """Stop MQTT and write whatever is still buffered"""
+        self.running = False
+        if self.mqtt_client:
+            self.mqtt_client.loop_stop()
+            self.mqtt_client.disconnect()
+            logger.info("MQTT connection closed")
+
+        while True:
+            try:
+                table, row = self.incoming.get_nowait()
+            except queue.Empty:
+                break
+            self.buffered[table].append(row)
+        self.flush()
+        logger.info(f"Ingest worker stopped. Total readings written: {self.total_written}")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Ingest greenhouse sensor readings from MQTT into MySQL")
+    parser.add_argument("--host", default=AWS_IOT_ENDPOINT, help="MQTT broker host")
+    parser.add_argument("--port", type=int, default=8883, help="MQTT broker port")
+    parser.add_argument("--no-tls", action="store_true", help="Plain TCP, e.g. a local Mosquitto broker")
+    args = parser.parse_args()
+
+    worker = IngestWorker(host=args.host, port=args.port, use_tls=not args.no_tls)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
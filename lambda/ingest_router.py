@@ -0,0 +1,165 @@
+import gzip
+import json
+import os
+import random
+import time
+import urllib3
+
+# Single handler for every schedule_1/* IoT rule. Replaces the per-topic
+# temperature/soil_moisture/plant/leaf_count handlers: each invocation sends
+# ONE gzip-compressed POST to /batch-ingest instead of one POST per reading.
+#
+# IoT rule SQL: SELECT *, topic() AS topic FROM 'schedule_1/#'
+# (without the topic field the router falls back to the event shape)
+
+INGEST_URL = os.environ.get('INGEST_URL', 'http://34.199.73.137/batch-ingest')  # Update with your EC2 IP or domain
+CONNECT_TIMEOUT = float(os.environ.get('CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('READ_TIMEOUT', '5'))
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', '3'))
+BACKOFF_BASE = 0.2  # seconds, doubled per retry with full jitter
+
+RETRY_STATUSES = {502, 503, 504}
+
+# Created once per container so warm invocations reuse the keep-alive connection.
+# Retries are handled below so they can respect the Lambda's remaining time.
+http = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=1,
+    timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+    retries=False
+)
+
+
+def route_temperature(event):
+    return {'ventilation': [{
+        'temperature': event.get('temperature'),
+        'humidity': event.get('humidity'),
+        'sector_id': event.get('sector_id', 1)
+    }]}
+
+
+def route_soil_moisture(event):
+    sensors = event.get('soil_sensors', {})
+    readings = []
+    for sensor_key in ['sensor_a', 'sensor_b', 'sensor_c']:
+        sensor_data = sensors.get(sensor_key)
+        if sensor_data:
+            readings.append({
+                'sector_id': sensor_data.get('sector'),
+                'raw_value': sensor_data.get('raw_value'),
+                'soil_moisture': sensor_data.get('moisture_percent')
+            })
+    return {'soil_health': readings}
+
+
+def route_light_growth(event):
+    readings = []
+    for plant in (event.get('plant_heights') or {}).values():
+        height_cm = plant.get('height_cm')
+        # Skip if no reading
+        if height_cm is None or height_cm == -1:
+            continue
+        readings.append({'sector_id': plant.get('sector'), 'height_cm': height_cm})
+    return {'plant': readings}
+
+
+def route_leaf_count(event):
+    sectors = event.get('sectors')
+    if not sectors:
+        return {'leaf_count': [{
+            'leaf_count': event.get('leaf_count'),
+            'sector_id': event.get('sector_id', 1)
+        }]}
+    return {'leaf_count': [{
+        'leaf_count': sector.get('leaf_count'),
+        'sector_id': sector.get('sector_id')
+    } for sector in sectors]}
+
+
+TOPIC_ROUTES = {
+    'schedule_1/temperature': route_temperature,
+    'schedule_1/soil_moisture': route_soil_moisture,
+    'schedule_1/light_growth': route_light_growth,
+    'schedule_1/leaf_count': route_leaf_count,
+}
+
+
+def pick_route(event):
+    """Choose a route from the topic if the rule passed it, otherwise from the event shape"""
+    route = TOPIC_ROUTES.get(event.get('topic'))
+    if route:
+        return route
+    if 'soil_sensors' in event:
+        return route_soil_moisture
+    if 'plant_heights' in event:
+        return route_light_growth
+    if 'leaf_count' in event:
+        return route_leaf_count
+    if 'temperature' in event:
+        return route_temperature
+    return None
+
+
+def build_batch(events):
+    """Merge the readings of one or more events into a single /batch-ingest body"""
+    batch = {}
+    skipped = 0
+    for event in events:
+        route = pick_route(event)
+        if route is None:
+            skipped += 1
+            continue
+        for table, readings in route(event).items():
+            batch.setdefault(table, []).extend(readings)
+    return {table: readings for table, readings in batch.items() if readings}, skipped
+
+
+def post_batch(batch, context=None):
+    """POST the batch once, retrying connection failures and 502/503/504 with jittered backoff"""
+    body = gzip.compress(json.dumps(batch).encode('utf-8'))
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = http.request('POST', INGEST_URL, body=body, headers=headers)
+            if response.status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS:
+                return response.status, response.data.decode('utf-8')
+        except urllib3.exceptions.ReadTimeoutError:
+            # The server may already have inserted the rows; retrying could duplicate them
+            raise
+        except urllib3.exceptions.HTTPError:
+            if attempt == MAX_ATTEMPTS:
+                raise
+
+        delay = random.uniform(0, BACKOFF_BASE * (2 ** (attempt - 1)))
+        # Don't sleep past the Lambda deadline (keep room for one more connect + read)
+        if context is not None:
+            remaining = context.get_remaining_time_in_millis() / 1000.0
+            if remaining - delay < CONNECT_TIMEOUT + READ_TIMEOUT:
+                raise TimeoutError('Not enough time left in the invocation to retry')
+        time.sleep(delay)
+
+
+def lambda_handler(event, context):
+    try:
+        # A rule can deliver a single message or (e.g. from a batching rule/SQS) a list of them
+        events = event if isinstance(event, list) else event.get('events', [event])
+
+        batch, skipped = build_batch(events)
+        if not batch:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'No recognisable readings in event', 'skipped': skipped})
+            }
+
+        status, body = post_batch(batch, context)
+        return {
+            'statusCode': status,
+            'body': body
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': str(e)
+        }
@@ -13,20 +13,34 @@ def lambda_handler(event, context):
         #   "leaf_count": 18,
         #   "sector_id": 1
         # }
+        # or, from a multi-sector publisher:
+        # {
+        #   "leaf_count": 41,
+        #   "sectors": [{"sector_id": 1, "leaf_count": 18}, {"sector_id": 2, "leaf_count": 23}]
+        # }
 
-        leaf_count = event.get("leaf_count")
-        sector_id = 1
-
-        if leaf_count is None or sector_id is None:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Missing leaf_count or sector_id"})
+        sectors = event.get("sectors")
+        if sectors:
+            payload = {
+                "sectors": [
+                    {"sector_id": sector.get("sector_id"), "leaf_count": sector.get("leaf_count")}
+                    for sector in sectors
+                ]
+            }
+        else:
+            leaf_count = event.get("leaf_count")
+            sector_id = event.get("sector_id", 1)
+
+            if leaf_count is None or sector_id is None:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"error": "Missing leaf_count or sector_id"})
+                }
+
+            payload = {
+                "leaf_count": leaf_count,
+                "sector_id": sector_id
             }
-
-        payload = {
-            "leaf_count": leaf_count,
-            "sector_id": sector_id
-        }
 
         response = http.request(
             "POST",
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Local replay harness for lambda/ingest_router.py
+
+Replays sample IoT Core events (same shapes the publisher/*.py nodes send) through
+the router handler against a locally running Flask app and reports invocation
+duration, i.e. what the Lambda would be billed for.
+
+Usage:
+    python app.py                                   # in another terminal
+    python lambda/replay_harness.py --url http://localhost:5000/batch-ingest -n 200
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+SAMPLE_EVENTS = [
+    {
+        "topic": "schedule_1/temperature",
+        "timestamp": "2025-06-01T10:00:00Z",
+        "node_id": "temperature_node",
+        "temperature": 27.4,
+        "humidity": 61.0,
+        "fan_status": "OFF",
+        "location": "greenhouse_section_2"
+    },
+    {
+        "topic": "schedule_1/soil_moisture",
+        "timestamp": "2025-06-01T10:00:00Z",
+        "node_id": "soil_moisture_node",
+        "soil_sensors": {
+            "sensor_a": {"sector": 1, "raw_value": 850, "moisture_percent": 16.9, "status": "DRY"},
+            "sensor_b": {"sector": 2, "raw_value": 650, "moisture_percent": 36.5, "status": "OK"},
+            "sensor_c": {"sector": 3, "raw_value": 400, "moisture_percent": 60.9, "status": "OK"},
+            "average_moisture": 38.1
+        },
+        "system_state": "WATERING",
+        "location": "greenhouse_section_1"
+    },
+    {
+        "topic": "schedule_1/light_growth",
+        "timestamp": "2025-06-01T10:00:00Z",
+        "node_id": "light_growth_node",
+        "light_sensor": {"light_level": 25, "light_status": "DARK", "led_status": "ON", "led_brightness": 78},
+        "plant_heights": {
+            "plant_1": {"sector": 1, "height_cm": 12.5, "growth_stage": "Vegetative"},
+            "plant_2": {"sector": 2, "height_cm": 8.2, "growth_stage": "Seedling"},
+            "plant_3": {"sector": 3, "height_cm": -1, "growth_stage": "No Reading"}
+        },
+        "location": "greenhouse_section_3"
+    },
+    {
+        "topic": "schedule_1/leaf_count",
+        "timestamp": "2025-06-01T10:00:00Z",
+        "node_id": "leaf_count_node",
+        "leaf_count": 18,
+        "location": "greenhouse_monitoring"
+    },
+]
+
+
+class FakeContext:
+    """Minimal stand-in for the Lambda context object"""
+    def __init__(self, timeout_s):
+        self.deadline = time.monotonic() + timeout_s
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0.0, self.deadline - time.monotonic()) * 1000)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay sample IoT events through the ingest router")
+    parser.add_argument("--url", default="http://localhost:5000/batch-ingest", help="Local /batch-ingest URL")
+    parser.add_argument("-n", "--invocations", type=int, default=100, help="Invocations per sample event")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Simulated Lambda timeout (seconds)")
+    args = parser.parse_args()
+
+    # The router reads its configuration at import time
+    os.environ["INGEST_URL"] = args.url
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import ingest_router
+
+    print(f"Replaying {len(SAMPLE_EVENTS)} sample events x {args.invocations} against {args.url}")
+    print("=" * 70)
+
+    for event in SAMPLE_EVENTS:
+        batch, _ = ingest_router.build_batch([event])
+        raw_size = len(json.dumps(batch).encode("utf-8"))
+        gzip_size = len(gzip.compress(json.dumps(batch).encode("utf-8")))
+
+        durations_ms = []
+        statuses = {}
+        for _ in range(args.invocations):
+            start = time.perf_counter()
+            result = ingest_router.lambda_handler(event, FakeContext(args.timeout))
+            durations_ms.append((time.perf_counter() - start) * 1000)
+            statuses[result["statusCode"]] = statuses.get(result["statusCode"], 0) + 1
+
+        print(f"{event['topic']}")
+        print(f"  body: {raw_size} B json -> {gzip_size} B gzip")
+        print(f"  duration ms: mean {statistics.mean(durations_ms):.1f}  p50 {percentile(durations_ms, 50):.1f}"
+              f"  p95 {percentile(durations_ms, 95):.1f}  max {max(durations_ms):.1f}")
+        print(f"  status codes: {statuses}")
+
+    # The whole set as one invocation, e.g. from a batching rule
+    start = time.perf_counter()
+    result = ingest_router.lambda_handler({"events": SAMPLE_EVENTS}, FakeContext(args.timeout))
+    print("=" * 70)
+    print(f"All {len(SAMPLE_EVENTS)} events in one invocation: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"(status {result['statusCode']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Batch Scoring
+Scores archived frames offline, for backfills and model comparisons
+
+Images are read from a directory (recursively) or a tar archive, decoded and
+preprocessed by DataLoader worker processes, and scored in batches by one
+inference engine using the remaining cores. Counts are written as CSV or
+NDJSON (chosen by the output extension), in input order.
+
+Resume: the output file doubles as the checkpoint. Rows are flushed per batch;
+on restart, images already in the output are skipped and a partially written
+last line is discarded.
+
+With --post-url, every batch is also sent to the ingest service (/batch-ingest)
+with the frame's modification time as its timestamp. A batch is posted before
+it is written, so an interruption can at worst re-post one batch, never lose one.
+
+Usage:
+    python batch_score.py archive/ counts.csv
+    python batch_score.py frames.tar counts.ndjson --backend int8 --workers 3
+    python batch_score.py archive/ counts.csv --post-url http://34.199.73.137/batch-ingest --sector-id 2
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import tarfile
+import time
+import logging
+import urllib.request
+from datetime import datetime
+
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from inference_engine import BACKENDS, ENGINE_DIR, MODEL_PATH, load_engine
+from leaf_model import FramePreprocessor
+
+# Configuration
+BATCH_SIZE = 32
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+FIELDS = ["image", "captured_at", "leaf_count", "raw_output", "model", "backend"]
+POST_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+def list_images(source):
+    """(name, captured_at) for every image in a directory tree or tar archive, sorted by name"""
+    if os.path.isdir(source):
+        images = []
+        for root, _, files in os.walk(source):
+            for file_name in files:
+                if file_name.lower().endswith(IMAGE_SUFFIXES):
+                    path = os.path.join(root, file_name)
+                    images.append((os.path.relpath(path, source), os.path.getmtime(path)))
+    else:
+        # Reads headers only for plain tar; .tar.gz has to be decompressed once to list it
+        with tarfile.open(source) as archive:
+            images = [(member.name, member.mtime) for member in archive.getmembers()
+                      if member.isfile() and member.name.lower().endswith(IMAGE_SUFFIXES)]
+    return sorted(images)
+
+
+class ImageDataset(Dataset):
+    """Decodes and preprocesses one archived image per item (runs in DataLoader workers)"""
+    def __init__(self, source, images):
+        self.source = source
+        self.images = images
+        self.is_tar = not os.path.isdir(source)
+        self.archive = None  # Opened lazily, once per worker process
+        self.preprocessor = None
+
+    def __len__(self):
+        return len(self.images)
+
+    def read(self, name):
+        if not self.is_tar:
+            with open(os.path.join(self.source, name), "rb") as f:
+                return f.read()
+        if self.archive is None:
+            self.archive = tarfile.open(self.source)
+        return self.archive.extractfile(name).read()
+
+    def __getitem__(self, index):
+        if self.preprocessor is None:
+            self.preprocessor = FramePreprocessor()
+        name, captured_at = self.images[index]
+        frame = cv2.imdecode(np.frombuffer(self.read(name), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            # Unreadable files are reported, not fatal
+            return name, captured_at, torch.zeros(3, self.preprocessor.size, self.preprocessor.size), False
+        return name, captured_at, self.preprocessor.to_tensor(frame)[0].clone(), True
+
+
+def worker_init(_):
+    """One thread per loader worker; the inference engine gets the cores"""
+    torch.set_num_threads(1)
+    cv2.setNumThreads(1)
+
+
+class ResultWriter:
+    """Appends CSV or NDJSON rows, resuming after the last complete one"""
+    def __init__(self, path):
+        self.path = path
+        self.ndjson = path.endswith((".ndjson", ".jsonl"))
+        self.done = self.recover()
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "a", newline="")
+        self.csv_writer = None
+        if not self.ndjson:
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if not exists:
+                self.csv_writer.writeheader()
+
+    def recover(self):
+        """Names already scored; truncates a partially written last line"""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                keep = data.rfind(b"\n") + 1
+                f.truncate(keep)
+                data = data[:keep]
+                logger.warning(f"Discarded a partially written row at the end of {self.path}")
+
+        lines = data.decode("utf-8").splitlines()
+        if self.ndjson:
+            return {json.loads(line)["image"] for line in lines if line.strip()}
+        return {row["image"] for row in csv.DictReader(lines)}
+
+    def write(self, rows):
+        for row in rows:
+            if self.ndjson:
+                self.file.write(json.dumps(row) + "\n")
+            else:
+                self.csv_writer.writerow(row)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def post_counts(url, rows, sector_id):
+    """Bulk-post one batch to /batch-ingest with the frames' own timestamps"""
+    body = json.dumps({"leaf_count": [
+        {"sector_id": sector_id, "leaf_count": row["leaf_count"], "timestamp": row["captured_at"]}
+        for row in rows
+    ]}).encode("utf-8")
+    request = urllib.request.Request(url, data=gzip.compress(body), method="POST", headers={
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip"
+    })
+    with urllib.request.urlopen(request, timeout=POST_TIMEOUT) as response:
+        result = json.loads(response.read())
+    if result.get("rejected"):
+        logger.warning(f"Ingest rejected {len(result['rejected'])} reading(s): {result['rejected'][:3]}")
+
+
+def score(source, output, backend, model_path, engine_dir, batch_size, workers, threads, post_url, sector_id):
+    images = list_images(source)
+    writer = ResultWriter(output)
+    todo = [image for image in images if image[0] not in writer.done]
+    logger.info(f"{len(images)} images in {source}, {len(images) - len(todo)} already scored, {len(todo)} to go")
+    if not todo:
+        writer.close()
+        return
+
+    engine = load_engine(backend, model_path, engine_dir, threads)
+    loader = DataLoader(
+        ImageDataset(source, todo),
+        batch_size=batch_size,
+        num_workers=workers,
+        worker_init_fn=worker_init if workers else None,
+        prefetch_factor=4 if workers else None,
+        persistent_workers=False
+    )
+    model_name = os.path.basename(model_path)
+
+    scored = 0
+    start = time.perf_counter()
+    try:
+        for names, captured_at, batch, valid in loader:
+            outputs = engine(batch).reshape(-1).tolist()
+            rows = []
+            for name, mtime, output, ok in zip(names, captured_at.tolist(), outputs, valid.tolist()):
+                if not ok:
+                    logger.warning(f"Skipping unreadable image {name}")
+                rows.append({
+                    "image": name,
+                    "captured_at": datetime.utcfromtimestamp(mtime).isoformat() + "Z",
+                    "leaf_count": max(0, int(round(output))) if ok else None,
+                    "raw_output": round(output, 4) if ok else None,
+                    "model": model_name,
+                    "backend": backend
+                })
+
+            if post_url:
+                post_counts(post_url, [row for row in rows if row["leaf_count"] is not None], sector_id)
+            writer.write(rows)
+
+            scored += len(rows)
+            elapsed = time.perf_counter() - start
+            logger.info(f"{scored}/{len(todo)} scored ({scored / elapsed:.1f} images/s)")
+    finally:
+        writer.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Score archived leaf images in batches")
+    parser.add_argument("source", help="Directory of images or a tar archive")
+    parser.add_argument("output", help="Results file: .csv, or .ndjson/.jsonl")
+    parser.add_argument("--backend", default="fused", choices=BACKENDS)
+    parser.add_argument("--model", default=MODEL_PATH, help="best.pt or a model variant")
+    parser.add_argument("--engine-dir", default=ENGINE_DIR)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=max(1, cores // 2), help="Decoding processes")
+    parser.add_argument("--threads", type=int, default=cores, help="Inference threads")
+    parser.add_argument("--post-url", help="Also bulk-post counts, e.g. http://host/batch-ingest")
+    parser.add_argument("--sector-id", type=int, default=1, help="Sector the archived frames belong to")
+    args = parser.parse_args()
+
+    score(args.source, args.output, args.backend, args.model, args.engine_dir, args.batch_size,
+          args.workers, args.threads, args.post_url, args.sector_id)
+
+
+if __name__ == "__main__":
+    main()
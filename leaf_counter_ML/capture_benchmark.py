@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Capture Benchmark
+Compares the old per-cycle capture path with the persistent-camera path
+
+Old path (one cycle):  open camera -> read -> cv2.imwrite JPEG -> PIL open -> Resize + ToTensor -> release
+New path (one cycle):  grab stale frames -> read -> FramePreprocessor.to_tensor (no disk I/O)
+
+Reports per-cycle latency and bytes written to storage. Model inference is the
+same in both paths and is not included.
+
+Usage:
+    python capture_benchmark.py                  # default camera, 20 cycles
+    python capture_benchmark.py --cycles 50 --camera 1
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+from PIL import Image
+from torchvision import transforms
+
+from leaf_model import FramePreprocessor, MODEL_INPUT_SIZE
+
+# Camera settings - keep in sync with leaf_count_publisher.py
+CAPTURE_WIDTH = 320
+CAPTURE_HEIGHT = 240
+CAMERA_WARMUP_FRAMES = 10
+STALE_FRAMES = 2
+
+
+def old_cycle(camera_index, image_path, transform):
+    """One cycle of the original capture_image() + count_leaves() preprocessing"""
+    cap = cv2.VideoCapture(camera_index)
+    ret, frame = cap.read()
+    if not ret:
+        cap.release()
+        raise RuntimeError("Failed to capture image")
+    cv2.imwrite(image_path, frame)
+    cap.release()
+
+    image = Image.open(image_path).convert("RGB")
+    transform(image).unsqueeze(0)
+    return os.path.getsize(image_path)
+
+
+def new_cycle(camera, preprocessor):
+    """One cycle of the persistent-camera path"""
+    for _ in range(STALE_FRAMES):
+        camera.grab()
+    ret, frame = camera.read()
+    if not ret:
+        raise RuntimeError("Failed to capture image")
+    preprocessor.to_tensor(frame)
+    return 0
+
+
+def summarise(name, samples_ms, bytes_written):
+    print(f"{name}")
+    print(f"  latency ms: mean {statistics.mean(samples_ms):.1f}  median {statistics.median(samples_ms):.1f}"
+          f"  max {max(samples_ms):.1f}")
+    print(f"  storage writes per cycle: {bytes_written:,} bytes"
+          f"  ({bytes_written * 1440 / 1024 / 1024:.1f} MB/day at one cycle per minute)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark leaf count capture paths")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index")
+    parser.add_argument("--cycles", type=int, default=20, help="Cycles per path")
+    args = parser.parse_args()
+
+    transform = transforms.Compose([
+        transforms.Resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)),
+        transforms.ToTensor()
+    ])
+
+    # Old path
+    old_ms = []
+    old_bytes = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        image_path = os.path.join(tmpdir, "leaf_image.jpg")
+        for _ in range(args.cycles):
+            start = time.perf_counter()
+            old_bytes.append(old_cycle(args.camera, image_path, transform))
+            old_ms.append((time.perf_counter() - start) * 1000)
+
+    # New path - camera opened and warmed up once, outside the timed cycles
+    open_start = time.perf_counter()
+    camera = cv2.VideoCapture(args.camera)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    for _ in range(CAMERA_WARMUP_FRAMES):
+        camera.grab()
+    open_ms = (time.perf_counter() - open_start) * 1000
+
+    preprocessor = FramePreprocessor()
+    new_ms = []
+    try:
+        for _ in range(args.cycles):
+            start = time.perf_counter()
+            new_cycle(camera, preprocessor)
+            new_ms.append((time.perf_counter() - start) * 1000)
+    finally:
+        camera.release()
+
+    print(f"Capture benchmark: {args.cycles} cycles per path, camera {args.camera}")
+    print("=" * 60)
+    summarise("Old path (open/read/imwrite/PIL per cycle)", old_ms, int(statistics.mean(old_bytes)))
+    summarise(f"New path (persistent camera, one-time open {open_ms:.0f} ms)", new_ms, 0)
+    print("=" * 60)
+    print(f"Per-cycle speed-up: {statistics.mean(old_ms) / statistics.mean(new_ms):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Inference Engine
+Export-and-serve paths for Conv7Net_3Channel_Wide on CPU
+
+Backends:
+- eager        original model, fp32, unfused (reference)
+- fused        Conv+BatchNorm(+ReLU) folded, channels-last, tuned threads
+- torchscript  fused model traced, frozen and optimised for inference
+- onnx         fused model exported to ONNX and run with onnxruntime
+- dynamic_int8 fused model with int8 dynamically-quantized fully connected layers
+- int8         static int8 quantization of the whole network, calibrated on captured images
+- remote       frames sent to inference_server.py, which batches them across devices
+
+eager/fused/dynamic_int8 are built from best.pt at startup. torchscript/onnx/int8
+are loaded from files written by the export command.
+
+Usage:
+    python inference_engine.py export --calibration-dir calibration_images/
+    python inference_engine.py report --images-dir calibration_images/
+"""
+
+import argparse
+import base64
+import glob
+import json
+import os
+import pickle
+import platform
+import statistics
+import time
+import logging
+import urllib.request
+
+# Configuration
+MODEL_PATH = "best.pt"
+ENGINE_DIR = "engines"  # Exported TorchScript / ONNX files
+INFERENCE_THREADS = 4  # Raspberry Pi 4/5 have 4 cores
+LOCAL_BACKENDS = ["eager", "fused", "torchscript", "onnx", "dynamic_int8", "int8"]
+BACKENDS = LOCAL_BACKENDS + ["remote"]
+INFERENCE_SERVER_URL = os.environ.get("INFERENCE_SERVER_URL", "http://localhost:8500/count")
+REMOTE_TIMEOUT = 30  # Seconds, covers the server's batching wait and queueing
+REMOTE_JPEG_QUALITY = 95
+EXPORT_FILES = {
+    "torchscript": "leaf_count_fused.ts",
+    "onnx": "leaf_count_fused.onnx",
+    "int8": "leaf_count_int8.ts",
+}
+IMAGE_EXTENSIONS = ("*.jpg", "*.jpeg", "*.png")
+VARIANTS_MANIFEST = os.path.join("variants", "variants.json")  # Written by model_compression.py report
+
+# torch, cv2 and leaf_model are imported inside the functions that use them, so
+# importing this module for its constants (publisher, server) stays cheap
+
+logger = logging.getLogger(__name__)
+
+CONV_LAYERS = ["layer1", "layer2", "layer3", "layer4", "layer5", "layer6", "layer7"]
+
+
+def select_model(latency_budget_ms, manifest_path=VARIANTS_MANIFEST, default=MODEL_PATH):
+    """Path of the most accurate model variant whose measured p50 fits the budget
+
+    Accuracy is agreement with best.pt (same rounded count, then mean |delta|).
+    Falls back to the fastest variant if none fits, and to default without a manifest.
+    """
+    if not os.path.exists(manifest_path):
+        logger.warning(f"No variant manifest at {manifest_path}, using {default}")
+        return default
+    with open(manifest_path) as f:
+        variants = json.load(f)["variants"]
+    if not variants:
+        return default
+
+    def accuracy(variant):
+        same = variant["same_count"] if variant["same_count"] is not None else 0.0
+        delta = variant["mean_abs_delta"] if variant["mean_abs_delta"] is not None else float("inf")
+        return (same, -delta)
+
+    fitting = [variant for variant in variants if variant["p50_ms"] <= latency_budget_ms]
+    if fitting:
+        chosen = max(fitting, key=accuracy)
+    else:
+        chosen = min(variants, key=lambda variant: variant["p50_ms"])
+        logger.warning(f"No model variant fits {latency_budget_ms} ms, using the fastest")
+    logger.info(f"Selected model variant {chosen['name']} ({chosen['p50_ms']} ms p50, "
+                f"same count {chosen['same_count']}) for a {latency_budget_ms} ms budget")
+    return chosen["path"]
+
+
+def quantized_engine():
+    """qnnpack on ARM (Raspberry Pi), x86 elsewhere"""
+    import torch
+    supported = torch.backends.quantized.supported_engines
+    if platform.machine().lower() in ("aarch64", "arm64", "armv7l") and "qnnpack" in supported:
+        return "qnnpack"
+    return "x86" if "x86" in supported else "fbgemm"
+
+
+def configure_threads(num_threads=INFERENCE_THREADS):
+    """Use every core for one inference; inter-op parallelism doesn't help a sequential CNN"""
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Can only be set once, before any parallel work has started
+
+
+def load_fp32_model(model_path=MODEL_PATH):
+    """Load the eager fp32 model (best.pt or a compressed variant)
+
+    The weights are memory-mapped instead of read into RAM, and the model is
+    built on the meta device so no time goes into random initialisation that the
+    checkpoint would overwrite. Pages are read from disk as layers first touch them.
+    """
+    import torch
+    from leaf_model import Conv7Net_3Channel_Wide, Conv7Net_Slim
+    try:
+        checkpoint = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError):
+        # Checkpoints saved in the legacy (non-zip) format can't be memory-mapped, and
+        # ones pickling more than tensors (full modules, numpy values) fail weights_only
+        checkpoint = torch.load(model_path, map_location="cpu")
+
+    # Pruned/distilled variants are saved as {"config": ..., "state_dict": ...} (model_compression.py)
+    with torch.device("meta"):
+        if "config" in checkpoint:
+            model = Conv7Net_Slim(**checkpoint["config"])
+        else:
+            model = Conv7Net_3Channel_Wide(dropout=0.5)
+    model.load_state_dict(checkpoint.get("state_dict", checkpoint), assign=True)
+    model.eval()
+    return model
+
+
+def fuse_model(model):
+    """Fold each BatchNorm into its convolution and fuse the ReLU (inference only)"""
+    import torch
+    model.eval()
+    # Each layerN is Sequential(Conv2d, BatchNorm2d, ReLU, Pool)
+    return torch.ao.quantization.fuse_modules(
+        model, [[f"{layer}.0", f"{layer}.1", f"{layer}.2"] for layer in CONV_LAYERS], inplace=False
+    )
+
+
+def example_input(batch_size=1):
+    import torch
+    from leaf_model import MODEL_INPUT_SIZE
+    return torch.rand(batch_size, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+
+
+def build_torchscript(fused_model):
+    import torch
+    # optimize_for_inference output is not serialisable, so it is applied after loading
+    traced = torch.jit.trace(fused_model, example_input())
+    return torch.jit.freeze(traced.eval())
+
+
+def build_dynamic_int8(fused_model):
+    """int8 weights for the fully connected head (fc1 alone is 2M parameters)"""
+    import torch
+    import torch.nn as nn
+    torch.backends.quantized.engine = quantized_engine()
+    return torch.ao.quantization.quantize_dynamic(fused_model, {nn.Linear}, dtype=torch.qint8)
+
+
+def build_static_int8(fp32_model, calibration_batches):
+    """Static int8 quantization of convs and linears, calibrated on real frames"""
+    import torch
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+    prepared = prepare_fx(fp32_model.eval(), get_default_qconfig_mapping(engine), (example_input(),))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def load_image_tensors(images_dir, limit=None):
+    """Preprocess image files exactly like camera frames"""
+    import cv2
+    from leaf_model import FramePreprocessor
+    paths = []
+    for pattern in IMAGE_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(images_dir, pattern)))
+    paths = sorted(paths)[:limit]
+
+    preprocessor = FramePreprocessor()
+    tensors = []
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            logger.warning(f"Skipping unreadable image {path}")
+            continue
+        tensors.append(preprocessor.to_tensor(frame).clone())
+    return paths, tensors
+
+
+class InferenceEngine:
+    """Callable wrapper: engine(input_tensor) -> output tensor of shape (N, 1)"""
+    def __init__(self, backend, module=None, ort_session=None, channels_last=False):
+        self.backend = backend
+        self.module = module
+        self.ort_session = ort_session
+        self.channels_last = channels_last
+
+    def __call__(self, x):
+        import torch
+        if self.ort_session is not None:
+            input_name = self.ort_session.get_inputs()[0].name
+            output = self.ort_session.run(None, {input_name: x.contiguous().numpy()})[0]
+            return torch.from_numpy(output)
+
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return self.module(x)
+
+    def supports_uncertainty(self):
+        """MC dropout needs the eager module's layers (not TorchScript/ONNX graphs)"""
+        import torch
+        return self.module is not None and not isinstance(self.module, torch.jit.ScriptModule)
+
+    def predict_with_uncertainty(self, x, passes):
+        """(prediction, mean, std): the deterministic output plus mean and std over `passes`
+        dropout samples of the FC head, conv features computed once"""
+        import torch
+        from leaf_model import conv_features, mc_dropout_head
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return mc_dropout_head(self.module, conv_features(self.module, x), passes)
+
+
+class RemoteEngine:
+    """Callable like InferenceEngine, but the forward pass runs on inference_server.py
+
+    The already-resized input tiles are sent back as JPEGs (about 15 KB each
+    instead of 768 KB of float32), so the server's resize is a no-op.
+    """
+    def __init__(self, url=INFERENCE_SERVER_URL, timeout=REMOTE_TIMEOUT):
+        self.backend = "remote"
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, x):
+        import cv2
+        import torch
+        images = []
+        for tile in x.reshape(-1, *x.shape[-3:]):
+            rgb = (tile * 255).round().clamp(0, 255).to(torch.uint8).permute(1, 2, 0).numpy()
+            ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR),
+                                       [cv2.IMWRITE_JPEG_QUALITY, REMOTE_JPEG_QUALITY])
+            if not ok:
+                raise RuntimeError("Failed to encode frame")
+            images.append(base64.b64encode(encoded.tobytes()).decode("ascii"))
+
+        request = urllib.request.Request(self.url, data=json.dumps({"images": images}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            outputs = json.loads(response.read())["outputs"]
+        return torch.tensor(outputs, dtype=torch.float32).reshape(-1, 1)
+
+    def supports_uncertainty(self):
+        """The server only returns point predictions"""
+        return False
+
+
+def load_engine(backend, model_path=MODEL_PATH, engine_dir=ENGINE_DIR, num_threads=INFERENCE_THREADS):
+    """Build or load the requested backend"""
+    import torch
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', choose from {BACKENDS}")
+
+    if backend == "remote":
+        return RemoteEngine()
+
+    configure_threads(num_threads)
+
+    if backend == "eager":
+        return InferenceEngine(backend, load_fp32_model(model_path))
+
+    if backend == "fused":
+        fused = fuse_model(load_fp32_model(model_path)).to(memory_format=torch.channels_last)
+        return InferenceEngine(backend, fused, channels_last=True)
+
+    if backend == "dynamic_int8":
+        return InferenceEngine(backend, build_dynamic_int8(fuse_model(load_fp32_model(model_path))))
+
+    export_path = os.path.join(engine_dir, EXPORT_FILES[backend])
+    if not os.path.exists(export_path):
+        raise FileNotFoundError(f"{export_path} not found - run: python inference_engine.py export")
+
+    if backend == "onnx":
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(export_path, options, providers=["CPUExecutionProvider"])
+        return InferenceEngine(backend, ort_session=session)
+
+    if backend == "int8":
+        torch.backends.quantized.engine = quantized_engine()
+        return InferenceEngine(backend, torch.jit.load(export_path).eval())
+
+    module = torch.jit.optimize_for_inference(torch.jit.load(export_path).eval())
+    return InferenceEngine(backend, module, channels_last=True)
+
+
+def export(model_path, engine_dir, calibration_dir, calibration_limit):
+    """Write the TorchScript, ONNX and int8 engines"""
+    import torch
+    os.makedirs(engine_dir, exist_ok=True)
+    fp32_model = load_fp32_model(model_path)
+    fused = fuse_model(fp32_model)
+
+    path = os.path.join(engine_dir, EXPORT_FILES["torchscript"])
+    build_torchscript(fused.to(memory_format=torch.channels_last)).save(path)
+    logger.info(f"Wrote {path}")
+
+    path = os.path.join(engine_dir, EXPORT_FILES["onnx"])
+    torch.onnx.export(fuse_model(fp32_model), example_input(), path,
+                      input_names=["image"], output_names=["leaf_count"],
+                      dynamic_axes={"image": {0: "batch"}, "leaf_count": {0: "batch"}},
+                      opset_version=17, dynamo=False)
+    logger.info(f"Wrote {path}")
+
+    _, calibration = load_image_tensors(calibration_dir, calibration_limit)
+    if not calibration:
+        logger.warning(f"No calibration images in {calibration_dir}, skipping int8 export")
+        return
+    quantized = build_static_int8(fp32_model, calibration)
+    path = os.path.join(engine_dir, EXPORT_FILES["int8"])
+    torch.jit.save(torch.jit.trace(quantized, example_input()), path)
+    logger.info(f"Wrote {path} (calibrated on {len(calibration)} images)")
+
+
+def report(model_path, engine_dir, images_dir, repeat):
+    """Accuracy delta and latency of every available backend against eager fp32"""
+    import torch
+    paths, images = load_image_tensors(images_dir)
+    if not images:
+        raise SystemExit(f"No images found in {images_dir}")
+
+    reference = load_engine("eager", model_path, engine_dir)
+    expected = [reference(image).item() for image in images]
+
+    print(f"Backend report on {len(images)} images from {images_dir} "
+          f"({torch.get_num_threads()} threads, quantized engine {quantized_engine()})")
+    print(f"{'backend':<14}{'p50 ms':>9}{'mean |delta|':>14}{'max |delta|':>13}{'same count':>12}")
+    for backend in LOCAL_BACKENDS:
+        try:
+            engine = load_engine(backend, model_path, engine_dir)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"{backend:<14}  skipped: {e}")
+            continue
+
+        outputs = [engine(image).item() for image in images]
+        deltas = [abs(out - exp) for out, exp in zip(outputs, expected)]
+        same = sum(max(0, round(out)) == max(0, round(exp)) for out, exp in zip(outputs, expected))
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            engine(images[0])
+            timings.append((time.perf_counter() - start) * 1000)
+
+        print(f"{backend:<14}{statistics.median(timings):>9.1f}{statistics.mean(deltas):>14.4f}"
+              f"{max(deltas):>13.4f}{same / len(images):>11.0%}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export and compare leaf count inference backends")
+    parser.add_argument("--model", default=MODEL_PATH, help="fp32 state dict (best.pt)")
+    parser.add_argument("--engine-dir", default=ENGINE_DIR, help="Where exported engines are written/read")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write TorchScript, ONNX and int8 engines")
+    export_parser.add_argument("--calibration-dir", default=".", help="Captured frames for int8 calibration")
+    export_parser.add_argument("--calibration-limit", type=int, default=200, help="Max calibration images")
+
+    report_parser = subparsers.add_parser("report", help="Accuracy delta and latency vs eager fp32")
+    report_parser.add_argument("--images-dir", default=".", help="Images to evaluate on")
+    report_parser.add_argument("--repeat", type=int, default=10, help="Timed runs per backend")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.model, args.engine_dir, args.calibration_dir, args.calibration_limit)
+    else:
+        report(args.model, args.engine_dir, args.images_dir, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
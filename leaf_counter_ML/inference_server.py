@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Inference Server
+Serves Conv7Net_3Channel_Wide to many capture clients with dynamic micro-batching
+
+Capture clients POST frames over HTTP; the server collects frames from all
+clients into micro-batches and runs each batch in one forward pass on a pool of
+worker processes. A batch is sent as soon as it is full or MAX_WAIT_MS after
+its first frame arrived, whichever comes first, so a lone client pays at most
+MAX_WAIT_MS extra latency and busy periods get large, efficient batches.
+
+Endpoints:
+    POST /count    image/jpeg or image/png body           -> {"outputs": [x], "leaf_counts": [n]}
+                   application/json {"images": [base64]}  -> one output/count per image
+    GET  /health   worker pool and batching statistics
+
+Edge devices use it through the "remote" inference backend (see inference_engine.py):
+    python leaf_count_publisher.py --backend remote
+
+Usage:
+    python inference_server.py --backend fused --workers 2
+"""
+
+import argparse
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import logging
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from inference_engine import ENGINE_DIR, LOCAL_BACKENDS, MODEL_PATH
+
+# Configuration
+HOST = "0.0.0.0"
+PORT = 8500
+INFERENCE_BACKEND = "fused"  # Any local backend from inference_engine.py
+WORKERS = 2  # Worker processes, each with its own copy of the model
+MAX_BATCH_SIZE = 16  # Frames per forward pass
+MAX_WAIT_MS = 20  # How long the first frame of a batch waits for company
+MAX_QUEUED_FRAMES = 256  # Beyond this, clients get 503 instead of unbounded latency
+MAX_REQUEST_BYTES = 8 * 1024 * 1024
+REQUEST_TIMEOUT = 30  # Seconds a request waits for its counts
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of the pool workers
+_engine = None
+_preprocessor = None
+
+
+def init_worker(backend, model_path, engine_dir, num_threads):
+    """Pool initializer: load the model once per worker process"""
+    global _engine, _preprocessor
+    from inference_engine import load_engine
+    from leaf_model import FramePreprocessor
+    _engine = load_engine(backend, model_path, engine_dir, num_threads)
+    _preprocessor = FramePreprocessor()
+
+
+def run_batch(frames):
+    """Preprocess and infer one micro-batch of BGR frames in a worker process"""
+    import torch
+    batch = torch.empty((len(frames), 3, _preprocessor.size, _preprocessor.size), dtype=torch.float32)
+    for index, frame in enumerate(frames):
+        _preprocessor.to_tensor(frame, out=batch[index])
+    return _engine(batch).reshape(-1).tolist()
+
+
+def decode_image(data):
+    """BGR frame from encoded image bytes; ValueError with a client-facing message if they aren't one"""
+    if not data:
+        raise ValueError("Empty image")
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        frame = None
+    if frame is None:
+        raise ValueError("Could not decode image")
+    return frame
+
+
+class MicroBatcher:
+    """Collects frames from concurrent requests into batches for the worker pool"""
+    def __init__(self, backend, model_path, engine_dir, workers, max_batch_size, max_wait_ms):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.pending = queue.Queue()  # (frames, Future) per request
+        self.queued_frames = 0
+        self.free_workers = threading.Semaphore(workers)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.batches = 0
+        self.frames_done = 0
+
+        # Split the cores between workers so they don't oversubscribe the CPU
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(backend, model_path, engine_dir, num_threads)
+        )
+        self.thread = threading.Thread(target=self.batch_loop, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, frames):
+        """Queue a request's frames; the Future resolves to one raw output per frame"""
+        future = Future()
+        with self.lock:
+            if self.queued_frames + len(frames) > MAX_QUEUED_FRAMES:
+                raise OverflowError("Inference queue full")
+            self.queued_frames += len(frames)
+        self.pending.put((frames, future))
+        return future
+
+    def batch_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                first = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            # Hold the batch open until it is full or the first frame has waited max_wait
+            requests = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+
+            # While every worker is busy, requests keep queueing and the next batch grows
+            self.free_workers.acquire()
+            frames = [frame for request_frames, _ in requests for frame in request_frames]
+            with self.lock:
+                self.queued_frames -= len(frames)
+            try:
+                batch_future = self.pool.submit(run_batch, frames)
+            except Exception as e:
+                self.free_workers.release()
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            batch_future.add_done_callback(lambda done, requests=requests: self.finish_batch(done, requests))
+
+    def finish_batch(self, batch_future, requests):
+        self.free_workers.release()
+        try:
+            outputs = batch_future.result()
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        with self.lock:
+            self.batches += 1
+            self.frames_done += len(outputs)
+        start = 0
+        for frames, future in requests:
+            future.set_result(outputs[start:start + len(frames)])
+            start += len(frames)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued_frames": self.queued_frames,
+                "batches": self.batches,
+                "frames": self.frames_done,
+                "avg_batch_size": round(self.frames_done / self.batches, 2) if self.batches else 0.0
+            }
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+        self.pool.shutdown(cancel_futures=True)
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    batcher = None  # Set by serve()
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_frames(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = 0
+        if length <= 0 or length > MAX_REQUEST_BYTES:
+            raise ValueError(f"Body must be 1..{MAX_REQUEST_BYTES} bytes")
+        body = self.rfile.read(length)
+
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        if content_type == "application/json":
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                raise ValueError("Body is not valid JSON")
+            images = payload.get("images") if isinstance(payload, dict) else None
+            if not isinstance(images, list) or not images:
+                raise ValueError("Expected {\"images\": [base64, ...]}")
+            frames = []
+            for index, image in enumerate(images):
+                try:
+                    data = base64.b64decode(image, validate=True)
+                except (ValueError, TypeError):
+                    raise ValueError(f"images[{index}] is not a base64 string")
+                frames.append(decode_image(data))
+            return frames
+        return [decode_image(body)]
+
+    def do_POST(self):
+        if self.path != "/count":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            frames = self.read_frames()
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            future = self.batcher.submit(frames)
+        except OverflowError as e:
+            self.send_json(503, {"error": str(e)})
+            return
+
+        try:
+            outputs = future.result(timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Inference failed: {e}")
+            self.send_json(500, {"error": "Inference failed"})
+            return
+        self.send_json(200, {
+            "outputs": outputs,
+            "leaf_counts": [max(0, int(round(output))) for output in outputs]
+        })
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, self.batcher.stats())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host, port, backend, model_path, engine_dir, workers, max_batch_size, max_wait_ms):
+    batcher = MicroBatcher(backend, model_path, engine_dir, workers, max_batch_size, max_wait_ms)
+    InferenceRequestHandler.batcher = batcher
+    server = ThreadingHTTPServer((host, port), InferenceRequestHandler)
+    server.daemon_threads = True
+    logger.info(f"Leaf count inference server on {host}:{port} ({backend}, {workers} workers, "
+                f"batches up to {max_batch_size} frames / {max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Leaf count inference server with dynamic micro-batching")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=LOCAL_BACKENDS)
+    parser.add_argument("--model", default=MODEL_PATH, help="fp32 state dict (best.pt)")
+    parser.add_argument("--engine-dir", default=ENGINE_DIR, help="Exported engines (torchscript/onnx/int8)")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.backend, args.model, args.engine_dir,
+          args.workers, args.max_batch_size, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
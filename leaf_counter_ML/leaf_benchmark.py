@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Inference Benchmark
+Reproducible CPU latency/throughput baseline for Conv7Net_3Channel_Wide
+
+Every (backend, thread count) runs in a fresh process so model load time and
+peak RSS are measured from a cold start and backends can't affect each other.
+Inputs are fixed sample images (leaf_image.jpg by default), preprocessed
+exactly like camera frames and tiled up to each batch size.
+
+Reports as JSON, per backend / threads / batch size:
+- load_s                  time to build or load the engine
+- p50_ms / p99_ms         latency of one forward pass over the batch
+- images_per_s            throughput at that batch size
+- peak_rss_mb             peak resident memory of the benchmark process
+
+Usage:
+    python leaf_benchmark.py --output baseline.json
+    python leaf_benchmark.py --backends fused int8 --threads 1 4 --batch-sizes 1 8
+    python leaf_benchmark.py --compare baseline.json   # exit 1 if p50 regressed past --tolerance
+"""
+
+import argparse
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+import logging
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from inference_engine import ENGINE_DIR, LOCAL_BACKENDS, MODEL_PATH
+
+# Configuration
+SAMPLE_IMAGES = ["leaf_image.jpg"]
+BATCH_SIZES = [1, 4, 8]
+THREAD_COUNTS = [1, 2, 4]
+WARMUP_RUNS = 3
+TIMED_RUNS = 30
+SEED = 0
+REGRESSION_TOLERANCE = 0.10  # Allowed p50 slowdown against a baseline before --compare fails
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def benchmark_backend(backend, num_threads, batch_sizes, image_paths, model_path, engine_dir,
+                      warmup_runs, timed_runs):
+    """Run in a fresh process: load one backend, then time every batch size"""
+    import torch
+    from inference_engine import load_engine
+    from leaf_model import FramePreprocessor
+    import cv2
+
+    torch.manual_seed(SEED)
+    preprocessor = FramePreprocessor()
+    images = []
+    for path in image_paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise FileNotFoundError(f"Cannot read sample image {path}")
+        images.append(preprocessor.to_tensor(frame).clone())
+    rss_before_load = peak_rss_mb()
+
+    start = time.perf_counter()
+    engine = load_engine(backend, model_path, engine_dir, num_threads)
+    load_s = time.perf_counter() - start
+
+    results = []
+    for batch_size in batch_sizes:
+        # Cycle through the sample images so every batch has the same content
+        batch = torch.cat([images[i % len(images)] for i in range(batch_size)])
+        for _ in range(warmup_runs):
+            engine(batch)
+        timings = []
+        for _ in range(timed_runs):
+            start = time.perf_counter()
+            engine(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        p50 = statistics.median(timings)
+        results.append({
+            "backend": backend,
+            "threads": num_threads,
+            "batch_size": batch_size,
+            "load_s": round(load_s, 3),
+            "p50_ms": round(p50, 2),
+            "p99_ms": round(percentile(timings, 0.99), 2),
+            "mean_ms": round(statistics.mean(timings), 2),
+            "images_per_s": round(batch_size * 1000 / p50, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "model_rss_mb": round(peak_rss_mb() - rss_before_load, 1)
+        })
+    return results
+
+
+def environment():
+    import torch
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": mp.cpu_count(),
+    }
+
+
+def run(backends, thread_counts, batch_sizes, image_paths, model_path, engine_dir, warmup_runs, timed_runs):
+    report = {"environment": environment(), "config": {
+        "images": image_paths, "warmup_runs": warmup_runs, "timed_runs": timed_runs, "seed": SEED
+    }, "results": [], "skipped": []}
+
+    for backend in backends:
+        for num_threads in thread_counts:
+            logger.info(f"Benchmarking {backend} with {num_threads} thread(s)")
+            # A fresh spawned process per configuration: cold load time, clean peak RSS
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                future = pool.submit(benchmark_backend, backend, num_threads, batch_sizes, image_paths,
+                                     model_path, engine_dir, warmup_runs, timed_runs)
+                try:
+                    report["results"].extend(future.result())
+                except (FileNotFoundError, ImportError) as e:
+                    logger.warning(f"Skipping {backend}: {e}")
+                    report["skipped"].append({"backend": backend, "threads": num_threads, "reason": str(e)})
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """List configurations whose p50 latency regressed by more than tolerance"""
+    def key(result):
+        return (result["backend"], result["threads"], result["batch_size"])
+
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = previous.get(key(result))
+        if old and result["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append({
+                "backend": result["backend"], "threads": result["threads"], "batch_size": result["batch_size"],
+                "baseline_p50_ms": old["p50_ms"], "p50_ms": result["p50_ms"],
+                "slowdown": round(result["p50_ms"] / old["p50_ms"] - 1, 3)
+            })
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark leaf count inference on CPU")
+    parser.add_argument("--backends", nargs="+", default=LOCAL_BACKENDS, choices=LOCAL_BACKENDS)
+    parser.add_argument("--threads", nargs="+", type=int, default=THREAD_COUNTS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--images", nargs="+", default=SAMPLE_IMAGES, help="Fixed sample images")
+    parser.add_argument("--model", default=MODEL_PATH, help="fp32 state dict (best.pt)")
+    parser.add_argument("--engine-dir", default=ENGINE_DIR, help="Exported engines (torchscript/onnx/int8)")
+    parser.add_argument("--warmup", type=int, default=WARMUP_RUNS)
+    parser.add_argument("--runs", type=int, default=TIMED_RUNS)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Baseline JSON report to check for p50 regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    report = run(args.backends, args.threads, args.batch_sizes, args.images, args.model, args.engine_dir,
+                 args.warmup, args.runs)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        logger.info(f"Wrote {args.output}")
+    else:
+        print(output)
+
+    if regressions:
+        logger.error(f"{len(regressions)} configuration(s) regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
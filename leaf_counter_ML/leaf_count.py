@@ -60,7 +60,6 @@ class Conv7Net_3Channel_Wide(nn.Module):
         out = self.layer6(out)
         out = self.layer7(out)
         out = out.reshape(out.size(0), -1)
-        print("Flattened size:", out.shape)  # 🔍 DEBUG HERE
 
         out = self.fc1(out)
         out = self.dropout1(out)
@@ -5,6 +5,7 @@ Uses machine learning to count leaves from camera images and publishes to AWS Io
 
 Requirements:
 - pip install torch torchvision opencv-python pillow AWSIoTPythonSDK
+- pip install onnxruntime (only for the onnx inference backend)
 
 Hardware:
 - Camera (USB webcam or Pi camera)
@@ -13,26 +14,73 @@ Hardware:
 
 Model Output:
 - Simplified leaf count data (no image metadata)
+- One count per sector: each sector is a region of interest of the same frame,
+  and all sector tiles of a burst go through the model in one forward pass
 """
 
-import torch
-import torch.nn as nn
-from torchvision import transforms
-from PIL import Image
-import cv2
 import time
 import os
 import json
+import argparse
 import logging
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+from inference_engine import BACKENDS, ENGINE_DIR, select_model  # torch is not imported here
+
+# torch (via leaf_pipeline/leaf_model) and cv2 are imported on first use: torch on a
+# background thread while MQTT and the camera come up, cv2 when the camera is opened.
+# The spawned inference process re-imports this module, so it stays light for it too.
+
+PROCESS_START = time.monotonic()  # For the time-to-first-count measurement
 
 # Configuration
 MQTT_TOPIC = "schedule_1/leaf_count"
 CLIENT_ID = "leaf_count_node_raspberry_pi"
 MODEL_PATH = "best.pt"  # Path to your trained model
-IMAGE_SAVE_PATH = "leaf_image.jpg"  # Temporary image file
+LATENCY_BUDGET_MS = None  # Per-frame inference budget; picks a variant from variants/variants.json
+                          # (see model_compression.py). None always uses MODEL_PATH. Variants apply to
+                          # eager/fused/dynamic_int8; export a variant to its own --engine-dir for the others
+INFERENCE_BACKEND = "fused"  # eager, fused, torchscript, onnx, dynamic_int8, int8 or remote (see inference_engine.py)
 CAPTURE_INTERVAL = 60  # Capture and publish every 60 seconds
+MAX_CONSECUTIVE_ERRORS = 5  # Publish failures before the MQTT connection is rebuilt
+
+# Camera Configuration - the camera stays open between cycles
+CAMERA_INDEX = 0  # Use 0 for default camera
+CAPTURE_WIDTH = 320  # Smallest common mode near the model input; the driver
+CAPTURE_HEIGHT = 240  # snaps to the nearest resolution it supports
+CAMERA_WARMUP_FRAMES = 10  # Frames discarded after opening while auto-exposure settles
+STALE_FRAMES = 2  # Buffered frames dropped before each capture so the image is current
+
+# Burst Configuration - several frames per cycle, one batched inference, robust aggregate.
+# Off by default: batching doesn't make a burst cheap, the conv layers dominate and
+# scale with the frame count, so a burst of K costs close to K single inferences
+# (5 frames: 390 ms batched vs 464 ms one by one, fused backend, 1 core). Raise it to
+# trade CPU time for robustness; leaf_benchmark.py --batch-sizes 1 5 measures it on the device.
+BURST_SIZE = 1  # Frames per cycle (1 disables burst mode, e.g. 5 to enable it)
+BURST_SPACING = 0.2  # Seconds between burst frames, so motion/glare differs between them
+AGGREGATION = "median"  # "median" or "trimmed_mean"
+TRIM_FRACTION = 0.2  # Share of lowest and highest predictions dropped by trimmed_mean
+
+# Uncertainty - Monte-Carlo dropout on the fully connected head (conv features computed once)
+MC_DROPOUT_PASSES = 30  # Dropout samples per tile (0 disables); other backends run without uncertainty
+
+# Sector Configuration - regions of interest in the camera frame, as fractions
+# (x, y, width, height) so they survive a capture resolution change.
+# Tiles are resized to 256x256, so raise CAPTURE_WIDTH/HEIGHT when using several sectors.
+SECTOR_ROIS = {
+    1: (0.0, 0.0, 1.0, 1.0),  # Whole frame
+}
+# Example: one wide frame over a three-sector bench
+# SECTOR_ROIS = {
+#     1: (0.0, 0.0, 0.333, 1.0),
+#     2: (0.333, 0.0, 0.334, 1.0),
+#     3: (0.667, 0.0, 0.333, 1.0),
+# }
+
+# Change Detection - skip inference while the scene is unchanged
+CHANGE_THRESHOLD = 4.0  # Mean grey-level difference of 32x32 thumbnails (0 disables the gate)
+MAX_REUSE_AGE = 15 * 60  # Seconds a count may be reused before inference is forced
 
 # AWS IoT Configuration - Use your actual certificate files
 AWS_IOT_ENDPOINT = "azoj5h57hjr65-ats.iot.us-east-1.amazonaws.com"
@@ -44,98 +92,53 @@ CERTIFICATE_PATH = "./certs/5435e0960ffa0fc7dee861aef3306c7ed7fac5896304b3cfa279
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class Conv7Net_3Channel_Wide(nn.Module):
-    """Neural network model for leaf counting (from your original code)"""
-    def __init__(self, dropout):
-        super().__init__()
-        self.layer1 = nn.Sequential(
-            nn.Conv2d(3, 32, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(32),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer2 = nn.Sequential(
-            nn.Conv2d(32, 64, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(64),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer3 = nn.Sequential(
-            nn.Conv2d(64, 128, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(128),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer4 = nn.Sequential(
-            nn.Conv2d(128, 256, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(256),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer5 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(256),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer6 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(256),
-            nn.ReLU(),
-            nn.MaxPool2d(kernel_size=2, stride=2))
-        self.layer7 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
-            nn.BatchNorm2d(256),
-            nn.ReLU(),
-            nn.AvgPool2d(kernel_size=2, stride=2))
-        self.fc1 = nn.Linear(1024, 2000)
-        self.dropout1 = nn.Dropout(dropout)
-        self.fc2 = nn.Linear(2000, 100)
-        self.dropout2 = nn.Dropout(dropout)
-        self.fc3 = nn.Linear(100, 1)
-        
-    def forward(self, x):
-        out = self.layer1(x)
-        out = self.layer2(out)
-        out = self.layer3(out)
-        out = self.layer4(out)
-        out = self.layer5(out)
-        out = self.layer6(out)
-        out = self.layer7(out)
-        out = out.reshape(out.size(0), -1)
-        out = self.fc1(out)
-        out = self.dropout1(out)
-        out = self.fc2(out)
-        out = self.dropout2(out)
-        out = self.fc3(out)
-        return out
-
 class LeafCountPublisher:
-    def __init__(self):
+    def __init__(self, backend=INFERENCE_BACKEND, latency_budget_ms=LATENCY_BUDGET_MS):
         self.mqtt_client = None
-        self.model = None
-        self.transform = None
-        self.setup_model()
+        self.backend = backend
+        self.model_path = MODEL_PATH if latency_budget_ms is None else select_model(latency_budget_ms)
+        self.camera = None
+        self.pipeline = None
+        self.model_loader = None
+        self.model_error = None
+        self.first_count_published = False
+        self.consecutive_errors = 0
+        self.setup_model()  # Returns immediately, the model loads in the background
         self.setup_mqtt()
+        logger.info(f"MQTT ready {time.monotonic() - PROCESS_START:.1f}s after start")
+        self.setup_camera()
         
     def setup_model(self):
-        """Load the trained leaf counting model"""
+        """Check the model is present and start loading it in the background"""
+        if self.backend == "remote":
+            logger.info("Using the remote inference server, no local model needed")
+        elif not os.path.exists(self.model_path):
+            logger.error(f"Failed to load model: Model file not found: {self.model_path}")
+            raise FileNotFoundError(f"Model file not found: {self.model_path}")
+        
+        self.model_loader = threading.Thread(target=self.start_inference, name="model-loader", daemon=True)
+        self.model_loader.start()
+    
+    def start_inference(self):
+        """Import torch and start the inference process, which memory-maps and loads the model"""
         try:
-            # Check if model file exists
-            if not os.path.exists(MODEL_PATH):
-                raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
-            
-            # Load the model
-            self.model = Conv7Net_3Channel_Wide(dropout=0.5)
-            self.model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device("cpu")))
-            self.model.eval()
-            
-            # Setup image preprocessing
-            self.transform = transforms.Compose([
-                transforms.Resize((256, 256)),  # Match model input size
-                transforms.ToTensor()
-            ])
-            
-            logger.info("Leaf counting model loaded successfully")
+            from leaf_pipeline import ChangeGate, LeafCountPipeline
             
+            self.pipeline = LeafCountPipeline(
+                capture=self.capture_burst,
+                on_result=self.handle_result,
+                interval=CAPTURE_INTERVAL,
+                backend=self.backend,
+                model_path=self.model_path,
+                engine_dir=ENGINE_DIR,
+                batch_size=BURST_SIZE,
+                gate=ChangeGate(CHANGE_THRESHOLD, MAX_REUSE_AGE) if CHANGE_THRESHOLD > 0 else None,
+                rois=list(SECTOR_ROIS.values()),
+                mc_passes=MC_DROPOUT_PASSES
+            )
+            self.pipeline.start_inference()
         except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            raise
+            self.model_error = e
     
     def setup_mqtt(self):
         """Initialize AWS IoT MQTT client"""
@@ -161,62 +164,125 @@ class LeafCountPublisher:
             logger.error(f"Failed to setup MQTT connection: {e}")
             raise
     
-    def capture_image(self):
-        """Capture image from camera"""
+    def setup_camera(self):
+        """Open the camera once and keep it open between cycles"""
+        import cv2
         try:
-            cap = cv2.VideoCapture(0)  # Use 0 for default camera
+            self.camera = cv2.VideoCapture(CAMERA_INDEX)
             
-            if not cap.isOpened():
+            if not self.camera.isOpened():
                 logger.error("Cannot access camera")
-                return None
+                self.camera = None
+                return False
+            
+            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Not every backend honours this
+            
+            # Let auto-exposure / white balance settle once, not every cycle
+            for _ in range(CAMERA_WARMUP_FRAMES):
+                self.camera.grab()
+            
+            width = int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            logger.info(f"Camera opened at {width}x{height}, "
+                        f"{time.monotonic() - PROCESS_START:.1f}s after start")
+            return True
             
-            ret, frame = cap.read()
-            if ret:
-                cv2.imwrite(IMAGE_SAVE_PATH, frame)
-                logger.info(f"Image captured and saved to {IMAGE_SAVE_PATH}")
-                cap.release()
-                return IMAGE_SAVE_PATH
-            else:
-                logger.error("Failed to capture image")
-                cap.release()
-                return None
-                
         except Exception as e:
-            logger.error(f"Error capturing image: {e}")
-            return None
+            logger.error(f"Error opening camera: {e}")
+            self.camera = None
+            return False
     
-    def count_leaves(self, image_path):
-        """Count leaves in the captured image using the ML model"""
+    def capture_frame(self):
+        """Capture a BGR frame from the already-open camera (no disk write)"""
         try:
-            if not os.path.exists(image_path):
-                logger.error(f"Image path {image_path} does not exist")
+            if self.camera is None and not self.setup_camera():
                 return None
-
-            # Load and preprocess image
-            image = Image.open(image_path).convert("RGB")
-            image_tensor = self.transform(image).unsqueeze(0)  # Add batch dimension
             
-            # Run inference
-            with torch.no_grad():
-                output = self.model(image_tensor)
+            # The driver queues frames while we sleep; drop them so the image is current
+            for _ in range(STALE_FRAMES):
+                self.camera.grab()
             
-            # Get leaf count (ensure it's a positive integer)
-            leaf_count = max(0, int(round(output.item())))
-            
-            logger.info(f"Leaf count prediction: {leaf_count}")
-            return leaf_count
+            ret, frame = self.camera.read()
+            if ret:
+                return frame
             
+            logger.error("Failed to capture image, reopening camera")
+            self.release_camera()
+            return None
+                
         except Exception as e:
-            logger.error(f"Error counting leaves: {e}")
+            logger.error(f"Error capturing image: {e}")
+            self.release_camera()
             return None
     
-    def publish_leaf_count(self, leaf_count):
-        """Publish leaf count data to AWS IoT Core"""
+    def capture_burst(self):
+        """Capture BURST_SIZE frames a short interval apart (pipeline capture callback)"""
+        frames = []
+        for index in range(BURST_SIZE):
+            if index > 0:
+                time.sleep(BURST_SPACING)
+            frame = self.capture_frame()
+            if frame is not None:
+                frames.append(frame)
+        return frames
+    
+    def sector_counts(self, outputs, mc_mean=None, uncertainty=None):
+        """Split frame-major tile outputs by sector and aggregate each sector over the burst"""
+        from leaf_model import aggregate_counts
+        sector_ids = list(SECTOR_ROIS)
+        counts = []
+        for index, sector_id in enumerate(sector_ids):
+            leaf_count, spread = aggregate_counts(outputs[index::len(sector_ids)], AGGREGATION, TRIM_FRACTION)
+            sector = {"sector_id": sector_id, "leaf_count": leaf_count, "leaf_count_spread": round(spread, 2)}
+            if uncertainty:
+                # Model uncertainty: MC-dropout mean and std, averaged over the sector's burst tiles
+                stds = uncertainty[index::len(sector_ids)]
+                sector["leaf_count_mean"] = round(sum(mc_mean[index::len(sector_ids)]) / len(stds), 2)
+                sector["leaf_count_std"] = round((sum(std ** 2 for std in stds) / len(stds)) ** 0.5, 2)
+            counts.append(sector)
+        return counts
+    
+    def handle_result(self, result):
+        """Called by the pipeline for each inference result - turn it into per-sector counts and publish"""
+        # Get leaf counts (ensure they're positive integers) and how much the burst frames disagreed
+        outputs = result['outputs']
+        sectors = self.sector_counts(outputs, result.get('mc_mean'), result.get('uncertainty'))
+        frames = len(outputs) // len(sectors)
+        summary = ", ".join(f"sector {s['sector_id']}: {s['leaf_count']}"
+                            + (f" ±{s['leaf_count_std']}" if 'leaf_count_std' in s else "") for s in sectors)
+        if result.get('reused'):
+            logger.info(f"Leaf count reused: {summary} (from {result['reuse_age_s']:.0f}s ago)")
+        else:
+            logger.info(f"Leaf count prediction: {summary} ({frames} frames x {len(sectors)} sectors, "
+                        f"inference {result['inference_ms']:.0f} ms)")
+        
+        if self.publish_leaf_count(sectors, frames, result.get('reused', False)):
+            self.consecutive_errors = 0  # Reset error counter
+            if not self.first_count_published:
+                self.first_count_published = True
+                logger.info(f"Time to first published count: {time.monotonic() - PROCESS_START:.1f}s")
+        else:
+            self.consecutive_errors += 1
+        
+        # If too many consecutive errors, try to reconnect MQTT
+        if self.consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+            logger.warning("Too many consecutive errors, attempting to reconnect MQTT...")
+            self.reconnect_mqtt()
+            self.consecutive_errors = 0
+    
+    def publish_leaf_count(self, sectors, frames=1, reused=False):
+        """Publish per-sector leaf count data to AWS IoT Core in one message"""
         try:
             data = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
                 "node_id": "leaf_count_node",
-                "leaf_count": leaf_count,
+                "leaf_count": sum(s["leaf_count"] for s in sectors),  # Whole bench
+                "sectors": sectors,  # sector_id, leaf_count, leaf_count_spread (std dev over frames),
+                                     # leaf_count_mean/leaf_count_std (MC dropout, when enabled)
+                "frames": frames,
+                "reused": reused,  # True when the scene was unchanged and inference was skipped
                 "location": "greenhouse_monitoring"
             }
             
@@ -230,66 +296,26 @@ class LeafCountPublisher:
             return False
     
     def run(self):
-        """Main loop - capture images, count leaves, and publish results"""
+        """Main loop - run the capture/preprocess/inference pipeline and publish results"""
         logger.info("Starting leaf count publisher...")
         logger.info(f"Will capture and analyze images every {CAPTURE_INTERVAL} seconds")
         
-        consecutive_errors = 0
-        max_errors = 5
-        
         try:
+            # MQTT and the camera are up; wait for torch and the inference process to start
+            self.model_loader.join()
+            if self.pipeline is None:
+                raise RuntimeError(f"Failed to start inference: {self.model_error}")
+            self.pipeline.start_stages()
             while True:
-                try:
-                    logger.info("Starting new leaf count cycle...")
-                    
-                    # Capture image
-                    image_path = self.capture_image()
-                    if not image_path:
-                        consecutive_errors += 1
-                        logger.warning("Failed to capture image, skipping this cycle")
-                        time.sleep(CAPTURE_INTERVAL)
-                        continue
-                    
-                    # Count leaves using ML model
-                    leaf_count = self.count_leaves(image_path)
-                    if leaf_count is None:
-                        consecutive_errors += 1
-                        logger.warning("Failed to count leaves, skipping this cycle")
-                        time.sleep(CAPTURE_INTERVAL)
-                        continue
-                    
-                    # Publish results
-                    if self.publish_leaf_count(leaf_count):
-                        consecutive_errors = 0  # Reset error counter
-                        logger.info(f"Cycle completed successfully. Leaf count: {leaf_count}")
-                    else:
-                        consecutive_errors += 1
-                    
-                    # Clean up temporary image file
-                    try:
-                        if os.path.exists(image_path):
-                            os.remove(image_path)
-                    except:
-                        pass  # Don't fail if cleanup fails
-                    
-                    # Wait for next cycle
-                    logger.info(f"Waiting {CAPTURE_INTERVAL} seconds until next capture...")
-                    time.sleep(CAPTURE_INTERVAL)
-                    
-                except Exception as e:
-                    logger.error(f"Unexpected error in main loop: {e}")
-                    consecutive_errors += 1
-                    time.sleep(CAPTURE_INTERVAL)
-                
-                # If too many consecutive errors, try to reconnect MQTT
-                if consecutive_errors >= max_errors:
-                    logger.warning("Too many consecutive errors, attempting to reconnect MQTT...")
-                    self.reconnect_mqtt()
-                    consecutive_errors = 0
+                time.sleep(1)
+                if not self.pipeline.is_alive():
+                    raise RuntimeError("Inference process exited")
                     
         except KeyboardInterrupt:
             logger.info("Shutting down...")
         finally:
+            if self.pipeline is not None:
+                self.pipeline.stop()
             self.cleanup()
     
     def reconnect_mqtt(self):
@@ -303,23 +329,35 @@ class LeafCountPublisher:
         except Exception as e:
             logger.error(f"MQTT reconnection failed: {e}")
     
+    def release_camera(self):
+        """Release the camera so the next capture reopens it"""
+        if self.camera is not None:
+            try:
+                self.camera.release()
+            except:
+                pass
+            self.camera = None
+    
     def cleanup(self):
-        """Clean up connections and temporary files"""
+        """Clean up connections and the camera"""
         if self.mqtt_client:
             self.mqtt_client.disconnect()
             logger.info("MQTT connection closed")
         
-        # Clean up temporary image file
-        try:
-            if os.path.exists(IMAGE_SAVE_PATH):
-                os.remove(IMAGE_SAVE_PATH)
-        except:
-            pass
+        self.release_camera()
+        logger.info("Camera released")
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Leaf count MQTT publisher")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, choices=BACKENDS,
+                        help="Inference backend (see inference_engine.py)")
+    parser.add_argument("--latency-budget-ms", type=float, default=LATENCY_BUDGET_MS,
+                        help="Pick the most accurate model variant within this per-frame budget")
+    args = parser.parse_args()
+    
     try:
-        publisher = LeafCountPublisher()
+        publisher = LeafCountPublisher(backend=args.backend, latency_budget_ms=args.latency_budget_ms)
         publisher.run()
     except Exception as e:
         logger.error(f"Failed to start leaf count publisher: {e}")
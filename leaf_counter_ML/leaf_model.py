@@ -0,0 +1,201 @@
+"""
+IoT Greenhouse - Leaf Count Model
+Conv7Net_3Channel_Wide and the camera-frame preprocessing shared by the leaf count scripts
+
+Kept free of MQTT/AWS imports so benchmarks and tools can load the model on their own.
+"""
+
+import numpy as np
+import cv2
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+MODEL_INPUT_SIZE = 256  # Model expects 256x256 RGB
+
+class Conv7Net_3Channel_Wide(nn.Module):
+    """Neural network model for leaf counting (from your original code)"""
+    def __init__(self, dropout):
+        super().__init__()
+        self.layer1 = nn.Sequential(
+            nn.Conv2d(3, 32, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer2 = nn.Sequential(
+            nn.Conv2d(32, 64, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(64),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer3 = nn.Sequential(
+            nn.Conv2d(64, 128, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(128),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer4 = nn.Sequential(
+            nn.Conv2d(128, 256, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(256),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer5 = nn.Sequential(
+            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(256),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer6 = nn.Sequential(
+            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(256),
+            nn.ReLU(),
+            nn.MaxPool2d(kernel_size=2, stride=2))
+        self.layer7 = nn.Sequential(
+            nn.Conv2d(256, 256, kernel_size=5, stride=1, padding=2),
+            nn.BatchNorm2d(256),
+            nn.ReLU(),
+            nn.AvgPool2d(kernel_size=2, stride=2))
+        self.fc1 = nn.Linear(1024, 2000)
+        self.dropout1 = nn.Dropout(dropout)
+        self.fc2 = nn.Linear(2000, 100)
+        self.dropout2 = nn.Dropout(dropout)
+        self.fc3 = nn.Linear(100, 1)
+        
+    def forward(self, x):
+        out = self.layer1(x)
+        out = self.layer2(out)
+        out = self.layer3(out)
+        out = self.layer4(out)
+        out = self.layer5(out)
+        out = self.layer6(out)
+        out = self.layer7(out)
+        out = out.reshape(out.size(0), -1)
+        out = self.fc1(out)
+        out = self.dropout1(out)
+        out = self.fc2(out)
+        out = self.dropout2(out)
+        out = self.fc3(out)
+        return out
+
+WIDE_WIDTHS = (32, 64, 128, 256, 256, 256, 256)  # Conv7Net_3Channel_Wide channels per layer
+WIDE_FC_SIZES = (2000, 100)
+
+
+class Conv7Net_Slim(nn.Module):
+    """Conv7Net_3Channel_Wide with configurable channels, kernel size and FC sizes
+
+    Used for the channel-pruned and distilled variants (see model_compression.py).
+    Layer names match the original so fusion and quantization work unchanged.
+    """
+    def __init__(self, widths=WIDE_WIDTHS, kernel_size=5, fc_sizes=WIDE_FC_SIZES, dropout=0.5):
+        super().__init__()
+        if len(widths) != 7:
+            raise ValueError("Conv7Net_Slim needs 7 layer widths")
+        in_channels = 3
+        for index, width in enumerate(widths, start=1):
+            pool = nn.AvgPool2d(kernel_size=2, stride=2) if index == len(widths) else nn.MaxPool2d(kernel_size=2, stride=2)
+            setattr(self, f"layer{index}", nn.Sequential(
+                nn.Conv2d(in_channels, width, kernel_size=kernel_size, stride=1, padding=kernel_size // 2),
+                nn.BatchNorm2d(width),
+                nn.ReLU(),
+                pool))
+            in_channels = width
+        # Seven 2x poolings take 256x256 down to 2x2
+        self.fc1 = nn.Linear(widths[-1] * 4, fc_sizes[0])
+        self.dropout1 = nn.Dropout(dropout)
+        self.fc2 = nn.Linear(fc_sizes[0], fc_sizes[1])
+        self.dropout2 = nn.Dropout(dropout)
+        self.fc3 = nn.Linear(fc_sizes[1], 1)
+
+    def forward(self, x):
+        out = x
+        for index in range(1, 8):
+            out = getattr(self, f"layer{index}")(out)
+        out = out.reshape(out.size(0), -1)
+        out = self.fc1(out)
+        out = self.dropout1(out)
+        out = self.fc2(out)
+        out = self.dropout2(out)
+        out = self.fc3(out)
+        return out
+
+
+def conv_features(model, x):
+    """Flattened output of layer1-7 (everything before the fully connected head)"""
+    out = x
+    for index in range(1, 8):
+        out = getattr(model, f"layer{index}")(out)
+    return out.reshape(out.size(0), -1)
+
+
+def mc_dropout_head(model, features, passes):
+    """Monte-Carlo dropout over the fully connected head only
+
+    The conv features are computed once and replicated into one (B * passes)
+    batch, so the extra cost is just `passes` runs of the small FC head.
+    Returns (prediction, mean, std), each of shape (B, 1): prediction is the
+    ordinary deterministic forward pass, mean and std are over the samples
+    (passes must be at least 2, the std of a single sample is NaN).
+    """
+    prediction = model.fc3(model.fc2(model.fc1(features)))  # Dropout is the identity at inference
+    replicated = features.repeat_interleave(passes, dim=0)
+    out = F.dropout(model.fc1(replicated), model.dropout1.p, training=True)
+    out = F.dropout(model.fc2(out), model.dropout2.p, training=True)
+    out = model.fc3(out).reshape(features.size(0), passes)
+    return prediction, out.mean(dim=1, keepdim=True), out.std(dim=1, keepdim=True)
+
+
+class FramePreprocessor:
+    """Converts BGR camera frames into a preallocated model input tensor
+
+    Equivalent to Resize((256, 256)) + ToTensor() on the RGB image, without the
+    JPEG encode/decode round trip or per-cycle allocations.
+    """
+    def __init__(self, size=MODEL_INPUT_SIZE):
+        self.size = size
+        self.resized_frame = np.empty((size, size, 3), dtype=np.uint8)
+        self.input_tensor = torch.empty((1, 3, size, size), dtype=torch.float32)
+
+    def to_tensor(self, frame, out=None):
+        """Resize + colour-convert a frame
+
+        Writes into out (a (3, H, W) tensor, e.g. a shared-memory slot) when given,
+        otherwise into the reused (1, 3, H, W) input, and returns what was written.
+        """
+        cv2.resize(frame, (self.size, self.size), dst=self.resized_frame, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.resized_frame, cv2.COLOR_BGR2RGB, dst=self.resized_frame)
+
+        # HWC uint8 view (shares memory with the numpy buffer) -> CHW float in [0, 1]
+        target = self.input_tensor[0] if out is None else out
+        target.copy_(torch.from_numpy(self.resized_frame).permute(2, 0, 1))
+        target.mul_(1.0 / 255)
+        return self.input_tensor if out is None else out
+
+
+def crop_roi(frame, roi):
+    """Crop a region of interest given as fractions (x, y, width, height) of the frame
+
+    Returns a numpy view (no copy); cv2.resize reads strided views directly.
+    Fractions keep the sector layout valid when the capture resolution changes.
+    """
+    frame_height, frame_width = frame.shape[:2]
+    x, y, width, height = roi
+    left = int(round(x * frame_width))
+    top = int(round(y * frame_height))
+    right = max(left + 1, min(frame_width, int(round((x + width) * frame_width))))
+    bottom = max(top + 1, min(frame_height, int(round((y + height) * frame_height))))
+    return frame[top:bottom, left:right]
+
+
+def aggregate_counts(outputs, method="median", trim_fraction=0.2):
+    """Combine per-frame predictions from one burst into a robust count
+
+    Returns (leaf_count, spread): the median or trimmed mean of the raw
+    predictions rounded to a non-negative integer, and their standard deviation.
+    A single blurred or glare-washed frame moves neither much.
+    """
+    values = np.sort(np.asarray(outputs, dtype=np.float64))
+    if method == "trimmed_mean":
+        trim = int(len(values) * trim_fraction)
+        central = values[trim:len(values) - trim] if len(values) > 2 * trim else values
+        estimate = central.mean()
+    else:
+        estimate = np.median(values)
+    return max(0, int(round(estimate))), float(values.std())
@@ -0,0 +1,347 @@
+"""
+IoT Greenhouse - Leaf Count Pipeline
+Capture, preprocessing and inference as separate stages connected by bounded queues
+
+- capture thread     grabs a burst of frames on an exact CAPTURE_INTERVAL grid (monotonic clock)
+- preprocess thread  crops each frame into its sector tiles and resizes/normalises them
+                     straight into a shared-memory input batch
+- inference process  owns the model, runs the whole batch in one forward pass
+                     (saves per-call overhead only; compute still grows with the batch)
+- result thread      hands results to the publisher callback (MQTT publish)
+
+An optional ChangeGate sits in the preprocessing stage: when the scene matches the
+frame behind the last count, that count is reused and the inference process is
+not woken at all.
+
+Producers never block: if the next stage is still busy the oldest pending frame
+is dropped, so a slow inference delays at most one count and never the camera
+schedule or the MQTT client's keepalive.
+"""
+
+import copy
+import math
+import queue
+import threading
+import time
+import logging
+import multiprocessing as mp
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+import torch
+
+from leaf_model import FramePreprocessor, MODEL_INPUT_SIZE, crop_roi
+
+logger = logging.getLogger(__name__)
+
+NUM_SLOTS = 2  # Shared-memory input buffers: one being filled while one is inferred on
+STOP = None  # Queue sentinel
+
+
+def slot_shape(batch_size):
+    return (batch_size, 3, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE)
+
+
+def slot_tensors(shm, batch_size, num_slots=NUM_SLOTS):
+    """float32 (batch, 3, H, W) tensor views onto each slot of the shared-memory block (no copies)"""
+    array = np.ndarray((num_slots,) + slot_shape(batch_size), dtype=np.float32, buffer=shm.buf)
+    return [torch.from_numpy(array[i]) for i in range(num_slots)]
+
+
+def put_latest(q, item):
+    """Put without blocking, replacing the oldest queued item if the queue is full"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+                logger.warning("Pipeline stage busy, dropped the oldest pending frame")
+            except queue.Empty:
+                pass
+
+
+def inference_worker(shm_name, batch_size, requests, results, free_slots, backend, model_path, engine_dir,
+                     mc_passes=0):
+    """Inference process: load the model once, then serve slots until STOP
+
+    With mc_passes > 0 each result also carries 'mc_mean' and 'uncertainty': the
+    MC-dropout mean and standard deviation per tile. 'outputs' is always the
+    deterministic forward pass. Backends that can't sample dropout (TorchScript,
+    ONNX, int8, remote) fall back to single-pass inference with a warning.
+    """
+    # Imported here so the parent process never pays for building the model
+    from inference_engine import load_engine
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        slots = slot_tensors(shm, batch_size)
+        start = time.perf_counter()
+        try:
+            engine = load_engine(backend, model_path, engine_dir)
+            uncertainty_supported = engine.supports_uncertainty()
+        except Exception as e:
+            results.put({'type': 'error', 'error': f"Failed to load model: {e}"})
+            return
+        ready = {'type': 'ready', 'load_s': time.perf_counter() - start}
+        if mc_passes and not uncertainty_supported:
+            ready['warning'] = (f"The {backend} backend can't run MC dropout (use eager, fused or dynamic_int8), "
+                                f"publishing counts without uncertainty")
+            mc_passes = 0
+        results.put(ready)
+
+        while True:
+            request = requests.get()
+            if request is STOP:
+                break
+            slot, count, captured_at = request
+            try:
+                start = time.perf_counter()
+                result = {'type': 'result', 'captured_at': captured_at}
+                if mc_passes:
+                    prediction, mean, std = engine.predict_with_uncertainty(slots[slot][:count], mc_passes)
+                    result['outputs'] = prediction.reshape(-1).tolist()
+                    result['mc_mean'] = mean.reshape(-1).tolist()
+                    result['uncertainty'] = std.reshape(-1).tolist()
+                else:
+                    result['outputs'] = engine(slots[slot][:count]).reshape(-1).tolist()
+                result['inference_ms'] = (time.perf_counter() - start) * 1000
+                results.put(result)
+            except Exception as e:
+                results.put({'type': 'error', 'error': f"Inference failed: {e}"})
+            finally:
+                free_slots.put(slot)
+    finally:
+        del slots
+        shm.close()
+
+
+class ChangeGate:
+    """Reuses the last count while the scene is unchanged
+
+    Frames are reduced to a small grayscale thumbnail and compared with the
+    thumbnail of the frame the last count came from (not the previous frame, so
+    slow drift still adds up to a change). Mean absolute difference below
+    threshold (0-255 grey levels) means the scene is unchanged.
+    """
+    def __init__(self, threshold, max_reuse_age, size=32):
+        self.threshold = threshold
+        self.max_reuse_age = max_reuse_age
+        self.size = size
+        self.lock = threading.Lock()
+        self.pending = {}  # captured_at -> signature of frames sent to inference
+        self.reference = None
+        self.last_result = None
+        self.last_inferred_at = None
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.inferences = 0
+        self.avg_inference_ms = 0.0
+
+    def signature(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def reuse(self, signature, captured_at):
+        """Return a copy of the last result if the scene is unchanged, else None (and remember the frame)"""
+        with self.lock:
+            self.frames_seen += 1
+            if self.reference is not None and self.last_result is not None:
+                age = time.monotonic() - self.last_inferred_at
+                diff = float(np.abs(signature - self.reference).mean())
+                if diff < self.threshold and age < self.max_reuse_age:
+                    self.frames_skipped += 1
+                    result = copy.deepcopy(self.last_result)
+                    result.update({'reused': True, 'reuse_age_s': age, 'scene_diff': diff,
+                                   'captured_at': captured_at, 'inference_ms': 0.0})
+                    logger.info(f"Scene unchanged (diff {diff:.1f} < {self.threshold}), reusing count from "
+                                f"{age:.0f}s ago. Skip rate {self.skip_rate():.0%} "
+                                f"({self.frames_skipped}/{self.frames_seen}), "
+                                f"~{self.frames_skipped * self.avg_inference_ms / 1000:.1f}s inference CPU saved")
+                    return result
+            self.pending[captured_at] = signature
+            return None
+
+    def record_result(self, result):
+        """The frame behind this result becomes the new reference"""
+        with self.lock:
+            signature = self.pending.pop(result['captured_at'], None)
+            if signature is None:
+                return
+            self.pending.clear()  # Anything older was dropped or superseded
+            self.reference = signature
+            self.last_result = result
+            self.last_inferred_at = time.monotonic()
+            self.inferences += 1
+            self.avg_inference_ms += (result['inference_ms'] - self.avg_inference_ms) / self.inferences
+
+    def skip_rate(self):
+        return self.frames_skipped / self.frames_seen if self.frames_seen else 0.0
+
+
+class LeafCountPipeline:
+    def __init__(self, capture, on_result, interval, backend, model_path, engine_dir, batch_size=1, gate=None,
+                 rois=None, mc_passes=0):
+        """
+        capture()          -> list of up to batch_size BGR frames (empty/None on failure),
+                              called on the capture thread
+        on_result(result)  called on the result thread with the worker's result dict;
+                              result['outputs'] holds one raw prediction per tile, frame-major
+                              (frame 0 tile 0, frame 0 tile 1, ..., frame 1 tile 0, ...)
+        rois               list of (x, y, width, height) frame fractions, one tile each;
+                              None means one tile covering the whole frame
+        mc_passes          MC-dropout samples per tile (0 disables, otherwise at least 2 for a std);
+                              adds result['mc_mean'] and ['uncertainty']
+        """
+        if mc_passes == 1 or mc_passes < 0:
+            raise ValueError(f"mc_passes must be 0 or at least 2, got {mc_passes}")
+        self.capture = capture
+        self.on_result = on_result
+        self.interval = interval
+        self.rois = rois
+        self.tiles_per_frame = len(rois) if rois else 1
+        self.frames_per_batch = batch_size
+        self.batch_size = batch_size * self.tiles_per_frame
+        self.gate = gate
+        self.mc_passes = mc_passes
+        self.backend = backend
+        self.model_path = model_path
+        self.engine_dir = engine_dir
+
+        self.preprocessor = FramePreprocessor()
+        self.frames = queue.Queue(maxsize=1)
+        self.stop_event = threading.Event()
+        self.threads = []
+
+        self.ctx = mp.get_context("spawn")
+        self.requests = self.ctx.Queue(maxsize=NUM_SLOTS)
+        self.results = self.ctx.Queue()
+        self.free_slots = self.ctx.Queue()
+        self.shm = None
+        self.slots = None
+        self.process = None
+
+    def start(self):
+        self.start_inference()
+        self.start_stages()
+
+    def start_inference(self):
+        """Start the inference process; the model loads in it while the caller brings up MQTT and the camera"""
+        slot_bytes = int(np.prod(slot_shape(self.batch_size))) * 4
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes * NUM_SLOTS)
+        self.slots = slot_tensors(self.shm, self.batch_size)
+        for slot in range(NUM_SLOTS):
+            self.free_slots.put(slot)
+
+        self.process = self.ctx.Process(
+            target=inference_worker,
+            args=(self.shm.name, self.batch_size, self.requests, self.results, self.free_slots,
+                  self.backend, self.model_path, self.engine_dir, self.mc_passes),
+            name="leaf-inference",
+            daemon=True
+        )
+        self.process.start()
+
+    def start_stages(self):
+        """Start the capture, preprocessing and result threads"""
+        for target, name in [(self.capture_loop, "leaf-capture"),
+                             (self.preprocess_loop, "leaf-preprocess"),
+                             (self.result_loop, "leaf-results")]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Pipeline started: capture every {self.interval}s, {self.tiles_per_frame} tile(s) per frame, "
+                    f"inference in pid {self.process.pid}")
+
+    def capture_loop(self):
+        """Capture on a fixed grid; a slow capture shortens the next wait instead of shifting the schedule"""
+        next_tick = time.monotonic()
+        while not self.stop_event.is_set():
+            captured_at = datetime.now(timezone.utc)
+            frames = self.capture()
+            if frames:
+                put_latest(self.frames, (captured_at, frames[:self.frames_per_batch]))
+            else:
+                logger.warning("Failed to capture image, skipping this cycle")
+
+            next_tick += self.interval
+            now = time.monotonic()
+            if now > next_tick:
+                missed = math.ceil((now - next_tick) / self.interval)
+                logger.warning(f"Capture overran its slot, skipping {missed} tick(s)")
+                next_tick += missed * self.interval
+            self.stop_event.wait(next_tick - now)
+
+    def preprocess_loop(self):
+        """Write each burst's tiles into a free shared-memory slot and hand it to the inference process"""
+        while not self.stop_event.is_set():
+            try:
+                captured_at, frames = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self.gate is not None:
+                reused = self.gate.reuse(self.gate.signature(frames[0]), captured_at)
+                if reused is not None:
+                    self.results.put(reused)
+                    continue
+            try:
+                slot = self.free_slots.get_nowait()
+            except queue.Empty:
+                logger.warning("Inference still busy, dropping frame")
+                continue
+            index = 0
+            for frame in frames:
+                for tile in self.tiles(frame):
+                    self.preprocessor.to_tensor(tile, out=self.slots[slot][index])
+                    index += 1
+            self.requests.put((slot, index, captured_at))
+
+    def tiles(self, frame):
+        if not self.rois:
+            return [frame]
+        return [crop_roi(frame, roi) for roi in self.rois]
+
+    def result_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                result = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if result['type'] == 'ready':
+                logger.info(f"Inference process ready (model loaded in {result['load_s']:.1f}s)")
+                if result.get('warning'):
+                    logger.warning(result['warning'])
+            elif result['type'] == 'error':
+                logger.error(result['error'])
+            else:
+                if self.gate is not None and not result.get('reused'):
+                    self.gate.record_result(result)
+                try:
+                    self.on_result(result)
+                except Exception as e:
+                    logger.error(f"Error handling inference result: {e}")
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        if self.process is not None:
+            try:
+                self.requests.put(STOP, timeout=1)
+            except queue.Full:
+                pass
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.shm is not None:
+            self.slots = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        logger.info("Pipeline stopped")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Leaf Count Model Compression
+Builds smaller variants of Conv7Net_3Channel_Wide from best.pt, on CPU
+
+- prune    structured channel pruning: keeps the strongest filters of every
+           conv layer (L1 norm scaled by the BatchNorm gain) and the strongest
+           fc1 units, then fine-tunes against the original model's outputs
+- distill  trains a narrow 3x3 student from scratch on the original model's outputs
+
+Both only need captured frames: the original model (the teacher) labels them,
+so no hand-counted dataset is required. 20% of the frames are held out.
+
+- report   measures best.pt and every variant on this device (fused backend, one
+           frame, p50 latency) and against the teacher on the held-out frames.
+           It writes variants/variants.json, which the publisher uses to pick the
+           most accurate variant within its latency budget (LATENCY_BUDGET_MS).
+
+Accuracy/latency trade-off: run `report` on the target Pi and read the table
+(or variants.json). Latency is device-specific, so the manifest should always
+come from the device that will use it. Agreement with the teacher is
+measured as mean |delta| of the raw output and as the share of frames with
+the same rounded count.
+
+Usage:
+    python model_compression.py prune --images-dir calibration_images/ --ratio 0.5
+    python model_compression.py distill --images-dir calibration_images/ --epochs 30
+    python model_compression.py report --images-dir calibration_images/
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import logging
+
+import torch
+import torch.nn as nn
+
+from inference_engine import MODEL_PATH, configure_threads, fuse_model, load_fp32_model, load_image_tensors
+from leaf_model import Conv7Net_Slim
+
+# Configuration
+VARIANTS_DIR = "variants"
+MANIFEST_FILE = "variants.json"
+PRUNE_RATIO = 0.5  # Share of conv channels and fc1 units removed
+STUDENT_WIDTHS = (16, 32, 48, 64, 64, 64, 64)
+STUDENT_KERNEL_SIZE = 3
+STUDENT_FC_SIZES = (256, 32)
+HOLDOUT_FRACTION = 0.2
+BATCH_SIZE = 16
+LEARNING_RATE = 1e-3
+SEED = 0
+
+logger = logging.getLogger(__name__)
+
+CONV_LAYERS = [f"layer{index}" for index in range(1, 8)]
+
+
+def split_images(images):
+    """Deterministic train/hold-out split"""
+    indices = list(range(len(images)))
+    random.Random(SEED).shuffle(indices)
+    holdout = max(1, int(len(images) * HOLDOUT_FRACTION)) if len(images) > 1 else 0
+    return [images[i] for i in indices[holdout:]], [images[i] for i in indices[:holdout]]
+
+
+def filter_importance(conv, bn):
+    """L1 norm of each filter, scaled by the BatchNorm gain that multiplies its output"""
+    gain = bn.weight.abs() / torch.sqrt(bn.running_var + bn.eps)
+    return conv.weight.abs().sum(dim=(1, 2, 3)) * gain
+
+
+def top_indices(scores, keep):
+    return torch.sort(torch.topk(scores, keep).indices).values
+
+
+def prune_model(model, ratio):
+    """Copy the strongest channels/units of model into a narrower Conv7Net_Slim"""
+    kept_channels = []
+    for name in CONV_LAYERS:
+        conv, bn = getattr(model, name)[0], getattr(model, name)[1]
+        keep = max(1, int(round(conv.out_channels * (1 - ratio))))
+        kept_channels.append(top_indices(filter_importance(conv, bn), keep))
+
+    fc1_keep = max(1, int(round(model.fc1.out_features * (1 - ratio))))
+    # Flattened fc1 inputs are channel-major: channel c owns columns 4c..4c+3 (2x2 map)
+    fc1_columns = torch.stack([kept_channels[-1] * 4 + offset for offset in range(4)], dim=1).reshape(-1)
+    fc1_units = top_indices(model.fc1.weight[:, fc1_columns].abs().sum(dim=1), fc1_keep)
+
+    pruned = Conv7Net_Slim(
+        widths=tuple(len(kept) for kept in kept_channels),
+        kernel_size=model.layer1[0].kernel_size[0],
+        fc_sizes=(fc1_keep, model.fc2.out_features)
+    )
+    with torch.no_grad():
+        in_kept = torch.arange(3)
+        for name, out_kept in zip(CONV_LAYERS, kept_channels):
+            source, target = getattr(model, name), getattr(pruned, name)
+            target[0].weight.copy_(source[0].weight[out_kept][:, in_kept])
+            target[0].bias.copy_(source[0].bias[out_kept])
+            for attr in ("weight", "bias", "running_mean", "running_var"):
+                getattr(target[1], attr).copy_(getattr(source[1], attr)[out_kept])
+            in_kept = out_kept
+
+        pruned.fc1.weight.copy_(model.fc1.weight[fc1_units][:, fc1_columns])
+        pruned.fc1.bias.copy_(model.fc1.bias[fc1_units])
+        pruned.fc2.weight.copy_(model.fc2.weight[:, fc1_units])
+        pruned.fc2.bias.copy_(model.fc2.bias)
+        pruned.fc3.load_state_dict(model.fc3.state_dict())
+    return pruned.eval()
+
+
+def augment(batch):
+    """Count-preserving augmentation: flips and a mild brightness change"""
+    if random.random() < 0.5:
+        batch = batch.flip(3)
+    if random.random() < 0.5:
+        batch = batch.flip(2)
+    return (batch * random.uniform(0.85, 1.15)).clamp(0, 1)
+
+
+def distill(student, teacher, images, epochs, learning_rate=LEARNING_RATE):
+    """Fit student outputs to teacher outputs (MSE on the raw count regression)"""
+    with torch.inference_mode():
+        targets = [teacher(image) for image in images]
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+    loss_fn = nn.MSELoss()
+    rng = random.Random(SEED)
+
+    for epoch in range(epochs):
+        student.train()
+        order = list(range(len(images)))
+        rng.shuffle(order)
+        losses = []
+        for start in range(0, len(order), BATCH_SIZE):
+            batch_indices = order[start:start + BATCH_SIZE]
+            inputs = augment(torch.cat([images[i] for i in batch_indices]))
+            target = torch.cat([targets[i] for i in batch_indices])
+            optimizer.zero_grad()
+            loss = loss_fn(student(inputs), target)
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        logger.info(f"Epoch {epoch + 1}/{epochs}: loss {statistics.mean(losses):.4f}")
+    return student.eval()
+
+
+def save_variant(model, name, variants_dir, source):
+    os.makedirs(variants_dir, exist_ok=True)
+    config = {
+        "widths": [getattr(model, layer)[0].out_channels for layer in CONV_LAYERS],
+        "kernel_size": model.layer1[0].kernel_size[0],
+        "fc_sizes": [model.fc1.out_features, model.fc2.out_features],
+    }
+    path = os.path.join(variants_dir, f"{name}.pt")
+    torch.save({"config": config, "state_dict": model.state_dict(), "source": source}, path)
+    logger.info(f"Wrote {path} ({count_parameters(model) / 1e6:.2f}M parameters, widths {config['widths']})")
+    return path
+
+
+def count_parameters(model):
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+def agreement(model, teacher, images):
+    """Mean |delta| of the raw output and share of identical rounded counts vs the teacher"""
+    if not images:
+        return None, None
+    with torch.inference_mode():
+        outputs = [model(image).item() for image in images]
+        expected = [teacher(image).item() for image in images]
+    deltas = [abs(out - exp) for out, exp in zip(outputs, expected)]
+    same = sum(max(0, round(out)) == max(0, round(exp)) for out, exp in zip(outputs, expected))
+    return statistics.mean(deltas), same / len(images)
+
+
+def latency_ms(model, repeat=20):
+    """p50 latency of one frame on the fused, channels-last model (the publisher's default backend)"""
+    fused = fuse_model(model).to(memory_format=torch.channels_last)
+    x = torch.rand(1, 3, 256, 256).contiguous(memory_format=torch.channels_last)
+    timings = []
+    with torch.inference_mode():
+        for _ in range(3):
+            fused(x)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fused(x)
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def report(model_path, variants_dir, images_dir, repeat):
+    teacher = load_fp32_model(model_path)
+    _, images = load_image_tensors(images_dir)
+    _, holdout = split_images(images)
+
+    paths = [model_path] + sorted(
+        os.path.join(variants_dir, name) for name in os.listdir(variants_dir) if name.endswith(".pt")
+    ) if os.path.isdir(variants_dir) else [model_path]
+
+    entries = []
+    print(f"Variant report: fused backend, {torch.get_num_threads()} threads, {len(holdout)} held-out frames")
+    print(f"{'variant':<22}{'params M':>10}{'p50 ms':>9}{'mean |delta|':>14}{'same count':>12}")
+    for path in paths:
+        model = load_fp32_model(path)
+        mae, same = agreement(model, teacher, holdout)
+        entry = {
+            "name": os.path.splitext(os.path.basename(path))[0],
+            "path": path,
+            "params": count_parameters(model),
+            "p50_ms": round(latency_ms(model, repeat), 2),
+            "mean_abs_delta": None if mae is None else round(mae, 4),
+            "same_count": None if same is None else round(same, 4),
+        }
+        entries.append(entry)
+        mae_text = "n/a" if mae is None else f"{mae:.4f}"
+        same_text = "n/a" if same is None else f"{same:.0%}"
+        print(f"{entry['name']:<22}{entry['params'] / 1e6:>10.2f}{entry['p50_ms']:>9.1f}{mae_text:>14}{same_text:>12}")
+
+    os.makedirs(variants_dir, exist_ok=True)
+    manifest_path = os.path.join(variants_dir, MANIFEST_FILE)
+    with open(manifest_path, "w") as f:
+        json.dump({"measured_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                   "threads": torch.get_num_threads(), "variants": entries}, f, indent=2)
+    logger.info(f"Wrote {manifest_path}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Prune or distill the leaf count model")
+    parser.add_argument("--model", default=MODEL_PATH, help="fp32 teacher state dict (best.pt)")
+    parser.add_argument("--variants-dir", default=VARIANTS_DIR)
+    parser.add_argument("--images-dir", default=".", help="Captured frames, labelled by the teacher")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prune_parser = subparsers.add_parser("prune", help="Channel-prune best.pt and fine-tune")
+    prune_parser.add_argument("--ratio", type=float, default=PRUNE_RATIO, help="Share of channels removed")
+    prune_parser.add_argument("--epochs", type=int, default=5, help="Fine-tuning epochs (0 to skip)")
+    prune_parser.add_argument("--name", help="Variant name (default pruned_<ratio>)")
+
+    distill_parser = subparsers.add_parser("distill", help="Train a small 3x3 student on the teacher's outputs")
+    distill_parser.add_argument("--epochs", type=int, default=30)
+    distill_parser.add_argument("--widths", type=int, nargs=7, default=STUDENT_WIDTHS)
+    distill_parser.add_argument("--name", default="distilled")
+
+    report_parser = subparsers.add_parser("report", help="Measure all variants and write variants.json")
+    report_parser.add_argument("--repeat", type=int, default=20, help="Timed runs per variant")
+
+    args = parser.parse_args()
+    torch.manual_seed(SEED)
+    random.seed(SEED)
+    configure_threads()
+
+    if args.command == "report":
+        report(args.model, args.variants_dir, args.images_dir, args.repeat)
+        return
+
+    teacher = load_fp32_model(args.model)
+    _, images = load_image_tensors(args.images_dir)
+    if not images:
+        raise SystemExit(f"No images found in {args.images_dir}")
+    train, holdout = split_images(images)
+
+    if args.command == "prune":
+        student = prune_model(teacher, args.ratio)
+        name = args.name or f"pruned_{int(args.ratio * 100)}"
+        mae, _ = agreement(student, teacher, holdout)
+        if mae is not None:
+            logger.info(f"Pruned before fine-tuning: mean |delta| {mae:.4f} on {len(holdout)} held-out frames")
+    else:
+        student = Conv7Net_Slim(widths=tuple(args.widths), kernel_size=STUDENT_KERNEL_SIZE,
+                                fc_sizes=STUDENT_FC_SIZES)
+        name = args.name
+
+    if args.epochs > 0:
+        student = distill(student, teacher, train, args.epochs)
+    mae, same = agreement(student, teacher, holdout)
+    if mae is not None:
+        logger.info(f"{name}: mean |delta| {mae:.4f}, same count {same:.0%} on {len(holdout)} held-out frames")
+    save_variant(student, name, args.variants_dir, source=os.path.basename(args.model))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ This Pi is dedicated to:
 - 1x Light sensor (ambient light)
 - 3x LEDs (grow lights)
 - 3x LCD displays (growth status)
+
+The database schema is created by the server: start app.py or ingest_worker.py
+(or run python -m migrations) before this listener.
 """
 
 import mysql.connector
@@ -38,6 +41,11 @@ RASPBERRY_PI_ID = "raspberry_pi_3"
 
 # Polling settings
 POLL_INTERVAL = 3  # Check for commands every 3 seconds
+COMMAND_TTL = 120  # Seconds a queued command stays valid; older ones expire instead of running
+ACK_TIMEOUT = 3  # Seconds to wait for the Arduino's reply to a command
+REPLY_PREFIX = ">>> "  # Marks the firmware's command replies; other lines are sensor output
+LIGHT_ACKS = {"ON": ("LIGHTS_MANUAL_ON",), "OFF": ("LIGHTS_MANUAL_OFF",), "AUTO": ("LIGHTS_AUTO_MODE",)}
+REJECT_REPLIES = ("UNKNOWN_COMMAND", "INVALID_")  # Replies starting with these (or ending in ERROR) are refusals
 
 # Setup logging
 logging.basicConfig(
@@ -86,19 +94,7 @@ class LightNodeCommandListener:
             conn = mysql.connector.connect(**DB_CONFIG)
             cursor = conn.cursor()
             
-            # Create edge_devices table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS edge_devices (
-                    id VARCHAR(50) PRIMARY KEY,
-                    node_type VARCHAR(50),
-                    last_command_id INT DEFAULT 0,
-                    last_seen DATETIME,
-                    status VARCHAR(20) DEFAULT 'online',
-                    arduino_port VARCHAR(50)
-                )
-            """)
-            
-            # Register this node
+            # Register this node (edge_devices is created by the server's migrations)
             cursor.execute("""
                 INSERT INTO edge_devices (id, node_type, last_command_id, last_seen, status, arduino_port)
                 VALUES (%s, %s, 0, %s, 'online', %s)
@@ -124,18 +120,71 @@ class LightNodeCommandListener:
             logger.error(f"❌ Failed to register node: {e}")
             self.last_command_id = 0
     
+    def claim_command(self, cursor, command):
+        """Mark a queued command DELIVERED; False if it was superseded or expired meanwhile"""
+        cursor.execute("""
+            UPDATE control_commands
+            SET status = 'DELIVERED', delivered_at = NOW(3), delivered_by = %s
+            WHERE id = %s AND status = 'QUEUED'
+        """, (RASPBERRY_PI_ID, command['id']))
+        return cursor.rowcount == 1
+    
+    def complete_command(self, cursor, command, status, response):
+        """Record the outcome: ACKED, REJECTED or EXPIRED (no reply from the Arduino)"""
+        cursor.execute("""
+            UPDATE control_commands
+            SET status = %s, completed_at = NOW(3), response = %s
+            WHERE id = %s
+        """, (status, response[:255] if response else None, command['id']))
+    
+    def read_reply(self, acks):
+        """Wait up to ACK_TIMEOUT for the Arduino's answer to the command just sent
+        
+        Only '>>> ' lines count; periodic sensor output and the firmware's debug
+        lines are skipped. Returns ('ACKED', reply) when the reply is one of acks,
+        ('REJECTED', reply) for UNKNOWN_COMMAND / INVALID_* / *ERROR, otherwise
+        ('EXPIRED', None).
+        """
+        deadline = time.monotonic() + ACK_TIMEOUT
+        read_timeout = self.arduino_connection.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 'EXPIRED', None
+                self.arduino_connection.timeout = remaining  # readline() mustn't run past the deadline
+                line = self.arduino_connection.readline().decode('utf-8', errors='ignore').strip()
+                if not line.startswith(REPLY_PREFIX):
+                    continue
+                reply = line[len(REPLY_PREFIX):]
+                name = reply.split(':')[0].strip()
+                if name in acks:
+                    return 'ACKED', reply
+                if name.startswith(REJECT_REPLIES) or name.endswith('ERROR'):
+                    return 'REJECTED', reply
+        finally:
+            self.arduino_connection.timeout = read_timeout
+    
     def poll_for_light_commands(self):
         """Poll database for new light control commands only"""
         try:
             conn = mysql.connector.connect(**DB_CONFIG)
             cursor = conn.cursor(dictionary=True)
             
+            # Commands that waited too long (e.g. while this Pi was offline) are stale: expire, don't run
+            cursor.execute("""
+                UPDATE control_commands
+                SET status = 'EXPIRED', completed_at = NOW(3), response = 'Not delivered within TTL'
+                WHERE status = 'QUEUED' AND command_type = 'LIGHT_CONTROL'
+                AND timestamp < NOW(3) - INTERVAL %s SECOND
+            """, (COMMAND_TTL,))
+            
             # Get only LIGHT_CONTROL commands newer than our last processed ID
             cursor.execute("""
                 SELECT id, command_type, action, brightness, timestamp
                 FROM control_commands 
                 WHERE id > %s 
-                AND status = 'SUCCESS' 
+                AND status = 'QUEUED' 
                 AND command_type = 'LIGHT_CONTROL'
                 ORDER BY id ASC
                 LIMIT 5
@@ -143,20 +192,38 @@ class LightNodeCommandListener:
             
             commands = cursor.fetchall()
             
+            # Light commands set a state: only the newest one needs to reach the Arduino
+            if len(commands) > 1:
+                effective = commands[-1]
+                skipped = [command['id'] for command in commands[:-1]]
+                cursor.execute(f"""
+                    UPDATE control_commands SET status = 'SUPERSEDED', superseded_by = %s
+                    WHERE id IN ({', '.join(['%s'] * len(skipped))})
+                """, [effective['id']] + skipped)
+                logger.info(f"⏭️ Skipping {len(skipped)} superseded light commands")
+                commands = [effective]
+            
             processed_count = 0
             for command in commands:
-                success = self.process_light_command(command)
+                if not self.arduino_connection:
+                    # Leave it queued; it expires if the Arduino doesn't come back in time
+                    logger.error("❌ No Arduino connection available")
+                    break
                 
-                if success:
-                    self.last_command_id = command['id']
-                    processed_count += 1
-                    
-                    # Update our last processed command ID
-                    cursor.execute("""
-                        UPDATE edge_devices 
-                        SET last_command_id = %s, last_seen = %s
-                        WHERE id = %s
-                    """, (self.last_command_id, datetime.now(), RASPBERRY_PI_ID))
+                # Claim it first, so the server can't supersede a command that is already on its way
+                if self.claim_command(cursor, command):
+                    status, response = self.process_light_command(command)
+                    self.complete_command(cursor, command, status, response)
+                    if status == 'ACKED':
+                        processed_count += 1
+                
+                # Update our last processed command ID
+                self.last_command_id = command['id']
+                cursor.execute("""
+                    UPDATE edge_devices 
+                    SET last_command_id = %s, last_seen = %s
+                    WHERE id = %s
+                """, (self.last_command_id, datetime.now(), RASPBERRY_PI_ID))
             
             # Update last seen timestamp even if no commands
             cursor.execute("""
@@ -178,54 +245,52 @@ class LightNodeCommandListener:
             logger.error(f"❌ Error polling for commands: {e}")
             return 0
     
-def process_light_command(self, command):
-    """Process light control command and send to Arduino"""
-    action = command.get('action', 'toggle').upper()
-    brightness = command.get('brightness')  # This might be None
-    
-    # FIX: Handle None brightness - just use fixed values for ON/OFF LEDs
-    if action == 'OFF':
-        brightness = 0  # Always 0 for OFF
-    else:
-        brightness = 100  # Always 100 for ON (or any value > 0)
-    
-    logger.info(f"💡 Processing light command: {action} at {brightness}% brightness")
-    
-    if not self.arduino_connection:
-        logger.error("❌ No Arduino connection available")
-        return False
-    
-    try:
-        # Format command for Arduino: "LIGHTS_ON_100", "LIGHTS_OFF_0", "LIGHTS_AUTO_100"
-        arduino_command = f"LIGHTS_{action}_{brightness}"
+    def process_light_command(self, command):
+        """Process light control command and send to Arduino; returns (status, Arduino reply)"""
+        action = (command.get('action') or 'toggle').upper()
+        brightness = command.get('brightness')  # This might be None
+        
+        # FIX: Handle None brightness - just use fixed values for ON/OFF LEDs
+        if action == 'OFF':
+            brightness = 0  # Always 0 for OFF
+        else:
+            brightness = 100  # Always 100 for ON (or any value > 0)
         
-        # Send command to Arduino
-        self.arduino_connection.write((arduino_command + '\n').encode())
-        self.arduino_connection.flush()
+        logger.info(f"💡 Processing light command: {action} at {brightness}% brightness")
         
-        logger.info(f"📤 Sent to Arduino: {arduino_command}")
+        if not self.arduino_connection:
+            logger.error("❌ No Arduino connection available")
+            return 'EXPIRED', 'No Arduino connection'
         
-        # Wait for Arduino response
-        time.sleep(1)
-        if self.arduino_connection.in_waiting > 0:
-            response = self.arduino_connection.readline().decode('utf-8', errors='ignore').strip()
+        try:
+            # Format command for Arduino: "LIGHTS_ON_100", "LIGHTS_OFF_0", "LIGHTS_AUTO_100"
+            arduino_command = f"LIGHTS_{action}_{brightness}"
+            
+            # Drop buffered sensor output so only lines sent after the command are read as its reply
+            self.arduino_connection.reset_input_buffer()
+            
+            # Send command to Arduino
+            self.arduino_connection.write((arduino_command + '\n').encode())
+            self.arduino_connection.flush()
+            
+            logger.info(f"📤 Sent to Arduino: {arduino_command}")
+            
+            # Wait for Arduino response
+            status, response = self.read_reply(LIGHT_ACKS.get(action, ()))
+            if status == 'EXPIRED':
+                logger.warning(f"⚠️ No reply from Arduino to {arduino_command}")
+                return status, None
             logger.info(f"📥 Arduino response: {response}")
             
-            # Check if command was accepted
-            if "LIGHTS" in response and action in response:
-                logger.info(f"✅ Light command executed successfully: {action}")
-                return True
-            elif "INVALID" in response or "ERROR" in response:
+            if status == 'REJECTED':
                 logger.error(f"❌ Arduino rejected command: {response}")
-                return False
-        
-        # Consider it successful if we got this far
-        logger.info(f"✅ Light command sent successfully: {action}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Error sending light command: {e}")
-        return False
+            else:
+                logger.info(f"✅ Light command executed successfully: {action}")
+            return status, response
+            
+        except Exception as e:
+            logger.error(f"❌ Error sending light command: {e}")
+            return 'EXPIRED', f"Serial error: {e}"
     
     def test_arduino_connection(self):
         """Test Arduino connection and get status"""
@@ -7,6 +7,9 @@ This Pi is dedicated to:
 - 3x Soil moisture sensors
 - 1x Water pump servo
 - 1x LED indicator
+
+The database schema is created by the server: start app.py or ingest_worker.py
+(or run python -m migrations) before this listener.
 """
 
 import mysql.connector
@@ -36,6 +39,11 @@ RASPBERRY_PI_ID = "raspberry_pi_1"
 
 # Polling settings
 POLL_INTERVAL = 3  # Check for commands every 3 seconds
+COMMAND_TTL = 300  # Seconds a queued command stays valid; older ones expire instead of running
+ACK_TIMEOUT = 3  # Seconds to wait for the Arduino's reply to a command
+REPLY_PREFIX = ">>> "  # Marks the firmware's command replies; other lines are sensor output
+WATERING_ACKS = ("MANUAL_WATERING_STARTED",)
+REJECT_REPLIES = ("UNKNOWN_COMMAND", "INVALID_")  # Replies starting with these (or ending in ERROR) are refusals
 
 # Setup logging
 logging.basicConfig(
@@ -84,19 +92,7 @@ class SoilNodeCommandListener:
             conn = mysql.connector.connect(**DB_CONFIG)
             cursor = conn.cursor()
             
-            # Create edge_devices table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS edge_devices (
-                    id VARCHAR(50) PRIMARY KEY,
-                    node_type VARCHAR(50),
-                    last_command_id INT DEFAULT 0,
-                    last_seen DATETIME,
-                    status VARCHAR(20) DEFAULT 'online',
-                    arduino_port VARCHAR(50)
-                )
-            """)
-            
-            # Register this node
+            # Register this node (edge_devices is created by the server's migrations)
             cursor.execute("""
                 INSERT INTO edge_devices (id, node_type, last_command_id, last_seen, status, arduino_port)
                 VALUES (%s, %s, 0, %s, 'online', %s)
@@ -122,18 +118,71 @@ class SoilNodeCommandListener:
             logger.error(f"❌ Failed to register node: {e}")
             self.last_command_id = 0
     
+    def claim_command(self, cursor, command):
+        """Mark a queued command DELIVERED; False if it was superseded or expired meanwhile"""
+        cursor.execute("""
+            UPDATE control_commands
+            SET status = 'DELIVERED', delivered_at = NOW(3), delivered_by = %s
+            WHERE id = %s AND status = 'QUEUED'
+        """, (RASPBERRY_PI_ID, command['id']))
+        return cursor.rowcount == 1
+    
+    def complete_command(self, cursor, command, status, response):
+        """Record the outcome: ACKED, REJECTED or EXPIRED (no reply from the Arduino)"""
+        cursor.execute("""
+            UPDATE control_commands
+            SET status = %s, completed_at = NOW(3), response = %s
+            WHERE id = %s
+        """, (status, response[:255] if response else None, command['id']))
+    
+    def read_reply(self, acks):
+        """Wait up to ACK_TIMEOUT for the Arduino's answer to the command just sent
+        
+        Only '>>> ' lines count; periodic sensor output and the firmware's debug
+        lines are skipped. Returns ('ACKED', reply) when the reply is one of acks,
+        ('REJECTED', reply) for UNKNOWN_COMMAND / INVALID_* / *ERROR, otherwise
+        ('EXPIRED', None).
+        """
+        deadline = time.monotonic() + ACK_TIMEOUT
+        read_timeout = self.arduino_connection.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 'EXPIRED', None
+                self.arduino_connection.timeout = remaining  # readline() mustn't run past the deadline
+                line = self.arduino_connection.readline().decode('utf-8', errors='ignore').strip()
+                if not line.startswith(REPLY_PREFIX):
+                    continue
+                reply = line[len(REPLY_PREFIX):]
+                name = reply.split(':')[0].strip()
+                if name in acks:
+                    return 'ACKED', reply
+                if name.startswith(REJECT_REPLIES) or name.endswith('ERROR'):
+                    return 'REJECTED', reply
+        finally:
+            self.arduino_connection.timeout = read_timeout
+    
     def poll_for_watering_commands(self):
         """Poll database for new watering commands only"""
         try:
             conn = mysql.connector.connect(**DB_CONFIG)
             cursor = conn.cursor(dictionary=True)
             
+            # Commands that waited too long (e.g. while this Pi was offline) are stale: expire, don't run
+            cursor.execute("""
+                UPDATE control_commands
+                SET status = 'EXPIRED', completed_at = NOW(3), response = 'Not delivered within TTL'
+                WHERE status = 'QUEUED' AND command_type = 'MANUAL_WATERING'
+                AND timestamp < NOW(3) - INTERVAL %s SECOND
+            """, (COMMAND_TTL,))
+            
             # Get only MANUAL_WATERING commands newer than our last processed ID
             cursor.execute("""
                 SELECT id, command_type, sector_id, duration, timestamp
                 FROM control_commands 
                 WHERE id > %s 
-                AND status = 'SUCCESS' 
+                AND status = 'QUEUED' 
                 AND command_type = 'MANUAL_WATERING'
                 ORDER BY id ASC
                 LIMIT 5
@@ -143,18 +192,25 @@ class SoilNodeCommandListener:
             
             processed_count = 0
             for command in commands:
-                success = self.process_watering_command(command)
+                if not self.arduino_connection:
+                    # Leave it queued; it expires if the Arduino doesn't come back in time
+                    logger.error("❌ No Arduino connection available")
+                    break
                 
-                if success:
-                    self.last_command_id = command['id']
-                    processed_count += 1
-                    
-                    # Update our last processed command ID
-                    cursor.execute("""
-                        UPDATE edge_devices 
-                        SET last_command_id = %s, last_seen = %s
-                        WHERE id = %s
-                    """, (self.last_command_id, datetime.now(), RASPBERRY_PI_ID))
+                # Claim it first, so the server can't supersede a command that is already on its way
+                if self.claim_command(cursor, command):
+                    status, response = self.process_watering_command(command)
+                    self.complete_command(cursor, command, status, response)
+                    if status == 'ACKED':
+                        processed_count += 1
+                
+                # Update our last processed command ID
+                self.last_command_id = command['id']
+                cursor.execute("""
+                    UPDATE edge_devices 
+                    SET last_command_id = %s, last_seen = %s
+                    WHERE id = %s
+                """, (self.last_command_id, datetime.now(), RASPBERRY_PI_ID))
             
             # Update last seen timestamp even if no commands
             cursor.execute("""
@@ -177,7 +233,7 @@ class SoilNodeCommandListener:
             return 0
     
     def process_watering_command(self, command):
-        """Process watering command and send to Arduino"""
+        """Process watering command and send to Arduino; returns (status, Arduino reply)"""
         sector = command['sector_id']
         duration = command['duration']
         
@@ -185,12 +241,15 @@ class SoilNodeCommandListener:
         
         if not self.arduino_connection:
             logger.error("❌ No Arduino connection available")
-            return False
+            return 'EXPIRED', 'No Arduino connection'
         
         try:
             # Format command for Arduino: "WATER_SECTOR_1_15"
             arduino_command = f"WATER_SECTOR_{sector}_{duration}"
             
+            # Drop buffered sensor output so only lines sent after the command are read as its reply
+            self.arduino_connection.reset_input_buffer()
+            
             # Send command to Arduino
             self.arduino_connection.write((arduino_command + '\n').encode())
             self.arduino_connection.flush()
@@ -198,26 +257,21 @@ class SoilNodeCommandListener:
             logger.info(f"📤 Sent to Arduino: {arduino_command}")
             
             # Wait for Arduino response
-            time.sleep(1)
-            if self.arduino_connection.in_waiting > 0:
-                response = self.arduino_connection.readline().decode('utf-8', errors='ignore').strip()
-                logger.info(f"📥 Arduino response: {response}")
-                
-                # Check if command was accepted
-                if "MANUAL_WATERING_STARTED" in response:
-                    logger.info(f"✅ Watering started successfully: Sector {sector}")
-                    return True
-                elif "INVALID" in response or "ERROR" in response:
-                    logger.error(f"❌ Arduino rejected command: {response}")
-                    return False
+            status, response = self.read_reply(WATERING_ACKS)
+            if status == 'EXPIRED':
+                logger.warning(f"⚠️ No reply from Arduino to {arduino_command}")
+                return status, None
+            logger.info(f"📥 Arduino response: {response}")
             
-            # Consider it successful if we got this far
-            logger.info(f"✅ Command sent successfully: Sector {sector} for {duration}s")
-            return True
+            if status == 'REJECTED':
+                logger.error(f"❌ Arduino rejected command: {response}")
+            else:
+                logger.info(f"✅ Watering started successfully: Sector {sector}")
+            return status, response
             
         except Exception as e:
             logger.error(f"❌ Error sending watering command: {e}")
-            return False
+            return 'EXPIRED', f"Serial error: {e}"
     
     def test_arduino_connection(self):
         """Test Arduino connection and get status"""
@@ -0,0 +1,62 @@
+"""Tables the app, ingest worker and listeners use, as they exist in production"""
+
+DESCRIPTION = "Baseline sensor, command and edge device tables"
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ventilation (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sector_id INT NOT NULL,
+            temperature FLOAT NOT NULL,
+            humidity FLOAT NOT NULL,
+            timestamp DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS soil_health (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sector_id INT NOT NULL,
+            raw_value INT,
+            soil_moisture FLOAT NOT NULL,
+            timestamp DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS plant (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sector_id INT NOT NULL,
+            height_cm FLOAT NOT NULL,
+            timestamp DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leaf_count (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            sector_id INT NOT NULL,
+            leaf_count INT NOT NULL,
+            timestamp DATETIME NOT NULL
+        )
+    """)
+    # Same definition water_plants/toggle_lights used to create on every request
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS control_commands (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            command_type VARCHAR(50) NOT NULL,
+            sector_id INT DEFAULT NULL,
+            duration INT DEFAULT NULL,
+            timestamp DATETIME NOT NULL,
+            status VARCHAR(20) DEFAULT 'SUCCESS'
+        )
+    """)
+    # Same definition each listener's register_node used to create
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS edge_devices (
+            id VARCHAR(50) PRIMARY KEY,
+            node_type VARCHAR(50),
+            last_command_id INT DEFAULT 0,
+            last_seen DATETIME,
+            status VARCHAR(20) DEFAULT 'online',
+            arduino_port VARCHAR(50)
+        )
+    """)
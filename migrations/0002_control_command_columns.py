@@ -0,0 +1,13 @@
+"""toggle_fan/toggle_lights write action and the light listener reads action and
+brightness, but the CREATE TABLE in the request paths never had them"""
+
+from migrations import column_exists
+
+DESCRIPTION = "Add action and brightness to control_commands"
+
+
+def upgrade(cursor):
+    if not column_exists(cursor, 'control_commands', 'action'):
+        cursor.execute("ALTER TABLE control_commands ADD COLUMN action VARCHAR(20) DEFAULT NULL AFTER command_type")
+    if not column_exists(cursor, 'control_commands', 'brightness'):
+        cursor.execute("ALTER TABLE control_commands ADD COLUMN brightness INT DEFAULT NULL AFTER duration")
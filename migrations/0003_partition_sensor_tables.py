@@ -0,0 +1,24 @@
+"""Range-partition the sensor tables by time (see retention_manager.py)
+
+Rebuilds each table once; on a large history run it in a maintenance window
+with `python -m migrations` rather than letting the app do it at startup.
+"""
+
+from migrations import index_exists
+
+DESCRIPTION = "Time-range partitions and (sector_id, timestamp) indexes on sensor tables"
+
+
+def upgrade(cursor):
+    # Imported here: retention_manager imports app, which imports this package
+    from retention_manager import RETENTION_POLICIES, partition_table
+
+    for table, policy in RETENTION_POLICIES.items():
+        # Latest-per-sector and trend queries read the newest rows of one partition
+        index = f"idx_{table}_sector_timestamp"
+        if not index_exists(cursor, table, index):
+            cursor.execute(f"ALTER TABLE `{table}` ADD INDEX {index} (sector_id, timestamp)")
+        index = f"idx_{table}_timestamp"
+        if not index_exists(cursor, table, index):
+            cursor.execute(f"ALTER TABLE `{table}` ADD INDEX {index} (timestamp)")
+        partition_table(cursor, table, policy['interval'])
@@ -0,0 +1,21 @@
+"""Open/close events written by alert_engine.py"""
+
+DESCRIPTION = "Add the alert_history event table"
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alert_history (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            rule_id VARCHAR(50) NOT NULL,
+            sector_id INT NOT NULL,
+            event VARCHAR(10) NOT NULL,
+            severity VARCHAR(20) NOT NULL,
+            action VARCHAR(50),
+            message VARCHAR(255),
+            value FLOAT,
+            timestamp DATETIME NOT NULL,
+            INDEX idx_alert_history_rule_sector (rule_id, sector_id, id),
+            INDEX idx_alert_history_timestamp (timestamp)
+        )
+    """)
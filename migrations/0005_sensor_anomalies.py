@@ -0,0 +1,21 @@
+"""Readings flagged or quarantined by anomaly_detector.py"""
+
+DESCRIPTION = "Add the sensor_anomalies table"
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sensor_anomalies (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            table_name VARCHAR(50) NOT NULL,
+            sector_id INT NOT NULL,
+            metric VARCHAR(50) NOT NULL,
+            value DOUBLE NOT NULL,
+            reason VARCHAR(20) NOT NULL,
+            score FLOAT,
+            quarantined BOOLEAN NOT NULL,
+            timestamp DATETIME NOT NULL,
+            INDEX idx_sensor_anomalies_timestamp (timestamp),
+            INDEX idx_sensor_anomalies_sensor (table_name, sector_id, metric, timestamp)
+        )
+    """)
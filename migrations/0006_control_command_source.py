@@ -0,0 +1,18 @@
+"""control_engine.py marks its commands and records how quickly it reacted"""
+
+from migrations import column_exists, index_exists
+
+DESCRIPTION = "Add source and reaction_ms to control_commands"
+
+
+def upgrade(cursor):
+    if not column_exists(cursor, 'control_commands', 'source'):
+        # Existing rows and the dashboard buttons are manual
+        cursor.execute("ALTER TABLE control_commands ADD COLUMN source VARCHAR(10) NOT NULL DEFAULT 'manual'")
+    if not column_exists(cursor, 'control_commands', 'reaction_ms'):
+        cursor.execute("ALTER TABLE control_commands ADD COLUMN reaction_ms INT DEFAULT NULL")
+    # The engine's cooldown and rate-limit checks: latest commands per actuator
+    if not index_exists(cursor, 'control_commands', 'idx_control_commands_actuator'):
+        cursor.execute(
+            "ALTER TABLE control_commands ADD INDEX idx_control_commands_actuator (command_type, sector_id, timestamp)"
+        )
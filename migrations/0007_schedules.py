@@ -0,0 +1,23 @@
+"""Timed actuator commands run by scheduler.py"""
+
+DESCRIPTION = "Add the schedules table"
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            kind VARCHAR(10) NOT NULL,
+            spec VARCHAR(100) NOT NULL,
+            command_type VARCHAR(50) NOT NULL,
+            action VARCHAR(20) DEFAULT NULL,
+            sector_id INT DEFAULT NULL,
+            duration INT DEFAULT NULL,
+            brightness INT DEFAULT NULL,
+            misfire_grace INT NOT NULL DEFAULT 3600,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            created_at DATETIME NOT NULL,
+            last_run_at DATETIME DEFAULT NULL
+        )
+    """)
@@ -0,0 +1,16 @@
+"""command_queue.py marks coalesced commands SUPERSEDED and links them to the
+command that replaced them"""
+
+from migrations import column_exists, index_exists
+
+DESCRIPTION = "Add superseded_by and a pending-command index to control_commands"
+
+
+def upgrade(cursor):
+    if not column_exists(cursor, 'control_commands', 'superseded_by'):
+        cursor.execute("ALTER TABLE control_commands ADD COLUMN superseded_by INT DEFAULT NULL")
+    # Undelivered commands for one target: command_type, status, id > last delivered
+    if not index_exists(cursor, 'control_commands', 'idx_control_commands_pending'):
+        cursor.execute(
+            "ALTER TABLE control_commands ADD INDEX idx_control_commands_pending (command_type, status, id)"
+        )
@@ -0,0 +1,42 @@
+"""Command lifecycle: QUEUED -> DELIVERED -> ACKED / REJECTED / EXPIRED
+
+Commands used to be inserted as 'SUCCESS' before any node had seen them. The
+listeners now claim a command (DELIVERED), send it and record the Arduino's
+reply, with millisecond timestamps at each step.
+"""
+
+from migrations import column_exists, index_exists
+
+DESCRIPTION = "Command lifecycle states and transition timestamps on control_commands"
+
+# command_type -> node_type, as in command_queue.COMMAND_NODES at the time of this migration
+COMMAND_NODES = {
+    'MANUAL_WATERING': 'soil_health_node',
+    'FAN_CONTROL': 'ventilation_node',
+    'LIGHT_CONTROL': 'light_growth_node',
+}
+
+
+def upgrade(cursor):
+    cursor.execute("ALTER TABLE control_commands MODIFY timestamp DATETIME(3) NOT NULL")
+    for column, definition in [
+        ('delivered_at', 'DATETIME(3) DEFAULT NULL'),
+        ('delivered_by', 'VARCHAR(50) DEFAULT NULL'),
+        ('completed_at', 'DATETIME(3) DEFAULT NULL'),
+        ('response', 'VARCHAR(255) DEFAULT NULL'),
+    ]:
+        if not column_exists(cursor, 'control_commands', column):
+            cursor.execute(f"ALTER TABLE control_commands ADD COLUMN {column} {definition}")
+    cursor.execute("ALTER TABLE control_commands ALTER status SET DEFAULT 'QUEUED'")
+    if not index_exists(cursor, 'control_commands', 'idx_control_commands_timestamp'):
+        cursor.execute("ALTER TABLE control_commands ADD INDEX idx_control_commands_timestamp (timestamp)")
+
+    # Commands no node has picked up yet are still to be delivered; older
+    # 'SUCCESS' rows stay as they are (their outcome was never recorded)
+    for command_type, node_type in COMMAND_NODES.items():
+        cursor.execute("""
+            UPDATE control_commands SET status = 'QUEUED'
+            WHERE status = 'SUCCESS' AND command_type = %s AND id > (
+                SELECT COALESCE(MAX(last_command_id), 0) FROM edge_devices WHERE node_type = %s
+            )
+        """, (command_type, node_type))
@@ -0,0 +1,123 @@
+"""
+IoT Greenhouse - Schema Migrations
+Ordered, versioned schema changes, applied once per database
+
+Each migration is a module NNNN_description.py in this package with
+    DESCRIPTION = "..."
+    def upgrade(cursor): ...
+Versions come from the file name prefix and are applied in order. Applied
+versions are recorded in schema_migrations, so re-running is a no-op; each
+upgrade() is also written to be safe against a partially migrated database
+(MySQL DDL commits implicitly and cannot be rolled back).
+
+Run at start-up by `python app.py` and ingest_worker.py (ensure_schema), which
+refuse to start if it fails. Deployments serving app.py through `flask run` or
+a WSGI server must apply them from the command line first:
+    python -m migrations            # apply pending migrations
+    python -m migrations --status   # list applied and pending versions
+"""
+
+import importlib
+import logging
+import os
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_LOCK = 'greenhouse_schema_migrations'
+LOCK_TIMEOUT = 30  # Seconds to wait for another process that is migrating
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+
+def discover_migrations():
+    """[(version, name, module)] for every migration file, in version order"""
+    migrations = []
+    for file_name in sorted(os.listdir(os.path.dirname(__file__))):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            module = importlib.import_module(f"{__name__}.{file_name[:-3]}")
+            migrations.append((int(match.group(1)), match.group(2), module))
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {versions}")
+    return migrations
+
+
+def column_exists(cursor, table, column):
+    """Helper for idempotent ALTERs (MySQL has no ADD COLUMN IF NOT EXISTS)"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    """)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    """Apply pending migrations in order; returns the versions applied"""
+    cursor = conn.cursor()
+    # Serialise concurrent starts (several app workers, CLI during a deploy)
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        raise RuntimeError("Timed out waiting for the schema migration lock")
+
+    applied = []
+    try:
+        ensure_migrations_table(cursor)
+        done = applied_versions(cursor)
+        for version, name, module in discover_migrations():
+            if version in done:
+                continue
+            logger.info(f"Applying migration {version:04d} {name}: {module.DESCRIPTION}")
+            module.upgrade(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                (version, name, datetime.now())
+            )
+            conn.commit()
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        cursor.fetchone()
+        cursor.close()
+
+    if applied:
+        logger.info(f"Schema migrated to version {applied[-1]:04d}")
+    else:
+        logger.info("Schema up to date")
+    return applied
+
+
+def status(conn):
+    """[(version, name, applied)] for every known migration"""
+    cursor = conn.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    return [(version, name, version in done) for version, name, _ in discover_migrations()]
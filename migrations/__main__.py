@@ -0,0 +1,30 @@
+"""Command line entry point: python -m migrations [--status]"""
+
+import argparse
+import logging
+
+import mysql.connector
+
+from app import db_config
+from migrations import migrate, status
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Apply greenhouse schema migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**db_config)
+    try:
+        if args.status:
+            for version, name, applied in status(conn):
+                print(f"{version:04d}  {'applied' if applied else 'pending':<8} {name}")
+        else:
+            migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
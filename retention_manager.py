@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+IoT Greenhouse - Sensor Data Retention Manager
+Keeps the sensor tables range-partitioned by time and bounded in size
+
+The sensor tables are partitioned by RANGE (TO_DAYS(timestamp)), monthly or
+daily per table, with a catch-all p_future partition. Queries with a time
+range (last 24 hours, 7 days) only open the partitions they need, and old
+data leaves by dropping a partition instead of a huge DELETE.
+
+    setup    partition the tables (also done once by migration 0003)
+    rotate   pre-create the next PRECREATE_PARTITIONS partitions, then export every
+             partition older than the table's retention to ARCHIVE_DIR as
+             gzip CSV and drop it. The export is verified against the
+             partition's row count before anything is dropped.
+    status   list partitions and row estimates
+
+Run rotate daily, e.g. from cron:
+    15 3 * * * cd /home/ubuntu/greenhouse && python retention_manager.py rotate
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import logging
+from datetime import date, datetime, timedelta
+
+from app import get_db_connection
+
+# Configuration
+RETENTION_POLICIES = {
+    # table: partition interval ("month" or "day") and how many intervals to keep online
+    'ventilation': {'interval': 'month', 'keep': 12},
+    'soil_health': {'interval': 'month', 'keep': 12},
+    'plant': {'interval': 'month', 'keep': 24},
+    'leaf_count': {'interval': 'month', 'keep': 24},
+}
+PRECREATE_PARTITIONS = 3  # Future partitions kept ready so inserts never land in p_future
+ARCHIVE_DIR = 'archive'
+ARCHIVE_FETCH_SIZE = 5000  # Rows per fetchmany() while exporting a partition
+FUTURE_PARTITION = 'p_future'
+
+logger = logging.getLogger(__name__)
+
+
+def interval_start(day, interval):
+    return day.replace(day=1) if interval == 'month' else day
+
+
+def next_interval(start, interval):
+    if interval == 'day':
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_interval(start, interval):
+    previous_day = start - timedelta(days=1)
+    return previous_day if interval == 'day' else previous_day.replace(day=1)
+
+
+def partition_name(start, interval):
+    return f"p{start:%Y%m}" if interval == 'month' else f"p{start:%Y%m%d}"
+
+
+def partition_start(name, interval):
+    """Start date encoded in a partition name, None for p_future or foreign names"""
+    try:
+        return datetime.strptime(name, "p%Y%m" if interval == 'month' else "p%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def partition_clause(start, interval):
+    """PARTITION definition covering [start, next interval)"""
+    end = next_interval(start, interval)
+    return f"PARTITION {partition_name(start, interval)} VALUES LESS THAN (TO_DAYS('{end.isoformat()}'))"
+
+
+def list_partitions(cursor, table):
+    """[(name, table_rows)] in partition order; empty if the table isn't partitioned"""
+    cursor.execute("""
+        SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    return cursor.fetchall()
+
+
+def primary_key_columns(cursor, table):
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY'
+        ORDER BY ORDINAL_POSITION
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def partition_table(cursor, table, interval, precreate=PRECREATE_PARTITIONS):
+    """Convert a plain table to monthly/daily range partitions (rebuilds the table once)"""
+    if list_partitions(cursor, table):
+        logger.info(f"{table} is already partitioned")
+        return False
+
+    # MySQL requires the partitioning column in every unique key
+    primary_key = primary_key_columns(cursor, table)
+    if primary_key and 'timestamp' not in primary_key:
+        columns = ", ".join(f"`{column}`" for column in primary_key + ['timestamp'])
+        cursor.execute(f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY ({columns})")
+
+    cursor.execute(f"SELECT MIN(timestamp) FROM `{table}`")
+    oldest = cursor.fetchone()[0]
+    today = date.today()
+    start = interval_start(oldest.date() if oldest else today, interval)
+    last = interval_start(today, interval)
+    for _ in range(precreate):
+        last = next_interval(last, interval)
+
+    clauses = []
+    while start <= last:
+        clauses.append(partition_clause(start, interval))
+        start = next_interval(start, interval)
+    clauses.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+
+    logger.info(f"Partitioning {table} into {len(clauses)} {interval}ly partitions (rebuilds the table)")
+    cursor.execute(f"ALTER TABLE `{table}` PARTITION BY RANGE (TO_DAYS(timestamp)) ({', '.join(clauses)})")
+    return True
+
+
+def ensure_future_partitions(cursor, table, interval, precreate=PRECREATE_PARTITIONS, dry_run=False):
+    """Split new partitions off p_future so the next `precreate` intervals each have their own"""
+    starts = [partition_start(name, interval) for name, _ in list_partitions(cursor, table)]
+    starts = [start for start in starts if start is not None]
+    if not starts:
+        raise RuntimeError(f"{table} is not partitioned - run: python retention_manager.py setup")
+
+    target = interval_start(date.today(), interval)
+    for _ in range(precreate):
+        target = next_interval(target, interval)
+
+    clauses = []
+    start = next_interval(max(starts), interval)
+    while start <= target:
+        clauses.append(partition_clause(start, interval))
+        start = next_interval(start, interval)
+    if not clauses:
+        return []
+
+    names = [clause.split()[1] for clause in clauses]
+    logger.info(f"{table}: adding partitions {', '.join(names)}")
+    if not dry_run:
+        # p_future is empty while partitions are pre-created, so this is a metadata-only change
+        cursor.execute(
+            f"ALTER TABLE `{table}` REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+            f"({', '.join(clauses)}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+        )
+    return names
+
+
+def export_partition(conn, table, partition, archive_dir=ARCHIVE_DIR):
+    """Stream one partition to archive_dir/table/partition.csv.gz; returns (path, rows written)"""
+    os.makedirs(os.path.join(archive_dir, table), exist_ok=True)
+    path = os.path.join(archive_dir, table, f"{partition}.csv.gz")
+    temp_path = path + ".tmp"
+
+    rows = 0
+    cursor = conn.cursor(buffered=False)  # Rows stream from the server, memory stays flat
+    try:
+        cursor.execute(f"SELECT * FROM `{table}` PARTITION ({partition})")
+        with gzip.open(temp_path, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(cursor.column_names)
+            while True:
+                batch = cursor.fetchmany(ARCHIVE_FETCH_SIZE)
+                if not batch:
+                    break
+                writer.writerows(batch)
+                rows += len(batch)
+    finally:
+        cursor.close()
+    os.replace(temp_path, path)
+    return path, rows
+
+
+def expire_partitions(conn, table, interval, keep, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """Archive and drop partitions that end before the retention cutoff"""
+    # Keep the current interval and the keep - 1 before it
+    cutoff = interval_start(date.today(), interval)
+    for _ in range(keep - 1):
+        cutoff = previous_interval(cutoff, interval)
+
+    cursor = conn.cursor()
+    try:
+        expired = [name for name, _ in list_partitions(cursor, table)
+                   if partition_start(name, interval) and next_interval(partition_start(name, interval), interval) <= cutoff]
+        dropped = []
+        for partition in expired:
+            if dry_run:
+                logger.info(f"{table}: would archive and drop {partition}")
+                continue
+
+            path, rows = export_partition(conn, table, partition, archive_dir)
+            cursor.execute(f"SELECT COUNT(*) FROM `{table}` PARTITION ({partition})")
+            expected = cursor.fetchone()[0]
+            if rows != expected:
+                # Late rows arrived during the export - keep the partition, retry next run
+                logger.error(f"{table}.{partition}: archived {rows} rows but partition has {expected}, not dropping")
+                continue
+
+            cursor.execute(f"ALTER TABLE `{table}` DROP PARTITION {partition}")
+            logger.info(f"{table}: archived {rows} rows to {path} and dropped {partition}")
+            dropped.append(partition)
+        return dropped
+    finally:
+        cursor.close()
+
+
+def setup(conn):
+    cursor = conn.cursor()
+    try:
+        for table, policy in RETENTION_POLICIES.items():
+            partition_table(cursor, table, policy['interval'])
+    finally:
+        cursor.close()
+
+
+def rotate(conn, dry_run=False):
+    for table, policy in RETENTION_POLICIES.items():
+        cursor = conn.cursor()
+        try:
+            ensure_future_partitions(cursor, table, policy['interval'], dry_run=dry_run)
+        finally:
+            cursor.close()
+        expire_partitions(conn, table, policy['interval'], policy['keep'], dry_run=dry_run)
+
+
+def status(conn):
+    cursor = conn.cursor()
+    try:
+        for table, policy in RETENTION_POLICIES.items():
+            partitions = list_partitions(cursor, table)
+            print(f"{table} ({policy['interval']}ly, keep {policy['keep']}): "
+                  f"{len(partitions) or 'not'} partition{'s' if len(partitions) != 1 else ''}")
+            for name, table_rows in partitions:
+                print(f"  {name:<12}{table_rows or 0:>12,} rows (estimate)")
+    finally:
+        cursor.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Partition rotation and archiving for the sensor tables")
+    parser.add_argument("command", choices=["setup", "rotate", "status"])
+    parser.add_argument("--dry-run", action="store_true", help="Log what rotate would do without changing anything")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.command == "setup":
+            setup(conn)
+        elif args.command == "rotate":
+            rotate(conn, args.dry_run)
+        else:
+            status(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+IoT Greenhouse - Actuator Command Scheduler
+Emits control_commands at fixed times: "water sector 2 for 15s at 06:00 daily",
+a light photoperiod ("0 6 * * *" ON and "0 22 * * *" OFF), or every N seconds
+
+Schedules are rows in the schedules table (migration 0007):
+- kind 'cron'      spec is a 5-field cron expression: minute hour day month weekday
+                   (*, lists, ranges and /steps; weekday 0-7, 0 and 7 are Sunday)
+- kind 'interval'  spec is a number of seconds, counted from created_at
+
+One process per deployment runs the scheduler (SCHEDULER_ENABLED in app.py).
+It loads all schedules at start; a single thread keeps their next due times in
+a heap and sleeps until the earliest one. Schedules changed through
+/api/schedules in that process take effect at once; changes made through other
+processes (other WSGI workers) are picked up by re-reading the schedules table
+every RELOAD_INTERVAL seconds.
+
+After a restart, a schedule that missed runs fires once for the most recent
+missed run if that is less than misfire_grace seconds old (e.g. the lights
+still come on after a 06:00 outage), then resumes its normal times.
+"""
+
+import heapq
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+from command_queue import enqueue_command
+
+# Configuration
+MAX_SLEEP = 60.0  # Re-check the clock at least this often (NTP steps, DST)
+RELOAD_INTERVAL = 30.0  # Seconds between re-reads of the schedules table
+SCHEDULE_FIELDS = ('kind', 'spec', 'command_type', 'action', 'sector_id', 'duration', 'brightness', 'misfire_grace')
+DEFAULT_MISFIRE_GRACE = 3600
+COMMAND_FIELDS = {
+    # command_type: fields the listeners read besides the type itself
+    'MANUAL_WATERING': ('sector_id', 'duration'),
+    'FAN_CONTROL': ('action',),
+    'LIGHT_CONTROL': ('action', 'brightness'),
+}
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]  # minute hour day month weekday
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cron_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        spec, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(value) for value in spec.split('-', 1))
+        else:
+            start = int(spec)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Invalid cron field '{text}' (allowed {low}-{high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSpec:
+    """5-field cron expression; next_after() finds the next matching minute"""
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got '{expression}'")
+        parsed = [parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = (sorted(values) for values in parsed)
+        self.weekdays = {day % 7 for day in weekdays}  # 7 is Sunday too
+        # Like cron: with both day and weekday restricted, either one matching is enough
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def day_matches(self, day):
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, after):
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(366 * 8):  # Days; enough for e.g. "Feb 29 on a Monday"
+            if t.month in self.months and self.day_matches(t):
+                for hour in self.hours:
+                    if hour < t.hour:
+                        continue
+                    for minute in self.minutes:
+                        if hour == t.hour and minute < t.minute:
+                            continue
+                        return t.replace(hour=hour, minute=minute)
+            t = (t + timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError("Cron expression never matches")
+
+
+def next_run(schedule, after):
+    """First run of schedule strictly after `after`"""
+    if schedule['kind'] == 'cron':
+        return CronSpec(schedule['spec']).next_after(after)
+    interval = timedelta(seconds=int(schedule['spec']))
+    anchor = schedule['created_at']
+    if after < anchor:
+        return anchor
+    return anchor + interval * ((after - anchor) // interval + 1)
+
+
+def validate_schedule(data):
+    """Check a schedule from /api/schedules; returns (schedule, error) like the ingest validators"""
+    kind = data.get('kind')
+    spec = str(data.get('spec', '')).strip()
+    command_type = data.get('command_type')
+    if kind not in ('cron', 'interval') or command_type not in COMMAND_FIELDS:
+        return None, f"kind must be cron or interval and command_type one of {', '.join(COMMAND_FIELDS)}"
+
+    schedule = {
+        'name': data.get('name') or f"{command_type} {spec}",
+        'kind': kind,
+        'spec': spec,
+        'command_type': command_type,
+        'action': None, 'sector_id': None, 'duration': None, 'brightness': None,
+        'misfire_grace': data.get('misfire_grace', DEFAULT_MISFIRE_GRACE),
+        'enabled': bool(data.get('enabled', True)),
+        'created_at': datetime.now().replace(microsecond=0),
+        'last_run_at': None
+    }
+    for field in COMMAND_FIELDS[command_type]:
+        schedule[field] = data.get(field)
+    if schedule['action']:
+        schedule['action'] = str(schedule['action']).upper()
+
+    # Same limits as the manual command routes
+    if command_type == 'MANUAL_WATERING' and (schedule['sector_id'] not in [1, 2, 3] or not isinstance(
+            schedule['duration'], int) or not 1 <= schedule['duration'] <= 60):
+        return None, 'Invalid sector (1-3) or duration (1-60 seconds)'
+    if command_type != 'MANUAL_WATERING' and not schedule['action']:
+        return None, 'action is required'
+    if command_type == 'LIGHT_CONTROL' and schedule['brightness'] is None:
+        schedule['brightness'] = 80
+
+    if not isinstance(schedule['misfire_grace'], int) or schedule['misfire_grace'] < 0:
+        return None, 'misfire_grace must be a non-negative number of seconds'
+    try:
+        if kind == 'interval' and int(spec) < 1:
+            raise ValueError("Interval must be at least 1 second")
+        next_run(schedule, schedule['created_at'])
+    except ValueError as e:
+        return None, str(e)
+    return schedule, None
+
+
+class Scheduler:
+    def __init__(self, connect):
+        self.connect = connect  # Returns a database connection; close() releases it
+        self.schedules = {}  # id -> schedule row
+        self.versions = {}  # id -> version; heap entries with an older version are stale
+        self.heap = []  # (due, id, version)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.last_reload = 0.0
+
+    def load(self):
+        """Enabled schedule rows"""
+        conn = self.connect()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT * FROM schedules WHERE enabled")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def start(self):
+        """Load the schedules, fire catch-up runs and start the timer thread"""
+        rows = self.load()
+        self.last_reload = time.monotonic()
+
+        now = datetime.now()
+        missed = []
+        with self.condition:
+            for schedule in rows:
+                last_due = self.catch_up_run(schedule, now)
+                if last_due:
+                    missed.append((schedule, last_due))
+                self.push(schedule, now)
+        for schedule, due in missed:
+            logger.info(f"Schedule {schedule['id']} ({schedule['name']}) missed its {due} run, firing it now")
+            self.fire(schedule, due)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+        self.thread.start()
+        logger.info(f"Scheduler started with {len(rows)} schedules")
+
+    def catch_up_run(self, schedule, now):
+        """Most recent run missed while the app was down, if still within misfire_grace"""
+        after = schedule['last_run_at'] or schedule['created_at']
+        due = next_run(schedule, after)
+        if due > now:
+            return None
+        latest = due
+        if schedule['kind'] == 'interval':
+            interval = timedelta(seconds=int(schedule['spec']))
+            latest = due + interval * ((now - due) // interval)
+        else:
+            while True:
+                following = next_run(schedule, latest)
+                if following > now:
+                    break
+                latest = following
+        if (now - latest).total_seconds() > schedule['misfire_grace']:
+            return None
+        return latest
+
+    def reload(self):
+        """Apply schedules added, changed or deleted by other processes"""
+        rows = self.load()
+        now = datetime.now()
+        with self.condition:
+            current = {schedule['id'] for schedule in rows}
+            for schedule_id in list(self.schedules):
+                if schedule_id not in current:
+                    self.schedules.pop(schedule_id)
+                    self.versions.pop(schedule_id, None)
+            for schedule in rows:
+                known = self.schedules.get(schedule['id'])
+                if known is None or any(known[field] != schedule[field] for field in SCHEDULE_FIELDS):
+                    self.push(schedule, now)
+        self.last_reload = time.monotonic()
+
+    def push(self, schedule, after):
+        """Queue the schedule's next run (caller holds the condition)"""
+        schedule_id = schedule['id']
+        self.schedules[schedule_id] = schedule
+        version = self.versions[schedule_id] = self.versions.get(schedule_id, 0) + 1
+        heapq.heappush(self.heap, (next_run(schedule, after), schedule_id, version))
+        self.condition.notify()
+
+    def add(self, schedule):
+        """Persist a validated schedule and queue it; returns its id"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO schedules (name, kind, spec, command_type, action, sector_id, duration, brightness,
+                                       misfire_grace, enabled, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (schedule['name'], schedule['kind'], schedule['spec'], schedule['command_type'],
+                  schedule['action'], schedule['sector_id'], schedule['duration'], schedule['brightness'],
+                  schedule['misfire_grace'], schedule['enabled'], schedule['created_at']))
+            conn.commit()
+            schedule['id'] = cursor.lastrowid
+        finally:
+            cursor.close()
+            conn.close()
+
+        if schedule['enabled'] and self.running:
+            with self.condition:
+                self.push(schedule, datetime.now())
+        return schedule['id']
+
+    def remove(self, schedule_id):
+        """Delete a schedule; its queued run is dropped when it reaches the top of the heap"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM schedules WHERE id = %s", (schedule_id,))
+            conn.commit()
+            deleted = cursor.rowcount > 0
+        finally:
+            cursor.close()
+            conn.close()
+
+        with self.condition:
+            self.schedules.pop(schedule_id, None)
+            self.versions.pop(schedule_id, None)
+        return deleted
+
+    def upcoming(self):
+        """Active schedules with their next run, soonest first"""
+        if not self.running:
+            # Not the scheduling process: work the next runs out from the table
+            now = datetime.now()
+            return sorted(({**schedule, 'next_run_at': next_run(schedule, now)} for schedule in self.load()),
+                          key=lambda schedule: schedule['next_run_at'])
+        with self.condition:
+            due = {schedule_id: at for at, schedule_id, version in self.heap
+                   if self.versions.get(schedule_id) == version}
+            return sorted(({**self.schedules[schedule_id], 'next_run_at': at} for schedule_id, at in due.items()),
+                          key=lambda schedule: schedule['next_run_at'])
+
+    def run(self):
+        """Timer thread: sleep until the earliest due run, fire it, queue the next one"""
+        while self.running:
+            if time.monotonic() - self.last_reload >= RELOAD_INTERVAL:
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Failed to reload schedules: {e}")
+                    self.last_reload = time.monotonic()
+            max_sleep = min(MAX_SLEEP, max(0.0, self.last_reload + RELOAD_INTERVAL - time.monotonic()))
+            with self.condition:
+                while self.heap and self.versions.get(self.heap[0][1]) != self.heap[0][2]:
+                    heapq.heappop(self.heap)  # Removed or rescheduled
+                if not self.heap:
+                    self.condition.wait(max_sleep)
+                    continue
+                due, schedule_id, _ = self.heap[0]
+                wait = (due - datetime.now()).total_seconds()
+                if wait > 0:
+                    self.condition.wait(min(wait, max_sleep))
+                    continue
+                heapq.heappop(self.heap)
+                schedule = self.schedules[schedule_id]
+                self.push(schedule, due)
+            try:
+                self.fire(schedule, due)
+            except Exception as e:
+                # Never let one run end the timer thread; the next run is already queued
+                logger.error(f"Schedule {schedule_id} failed to fire at {due}: {e}")
+
+    def fire(self, schedule, due):
+        """Insert the schedule's command and record the run"""
+        now = datetime.now()
+        conn = None
+        cursor = None
+        try:
+            conn = self.connect()
+            command_id, outcome = enqueue_command(
+                conn, {field: schedule[field] for field in ('command_type',) + COMMAND_FIELDS[schedule['command_type']]},
+                source='schedule'
+            )
+            cursor = conn.cursor()
+            cursor.execute("UPDATE schedules SET last_run_at = %s WHERE id = %s", (due, schedule['id']))
+            conn.commit()
+            schedule['last_run_at'] = due
+            logger.info(f"Schedule {schedule['id']} ({schedule['name']}) fired "
+                        f"{(now - due).total_seconds() * 1000:.0f} ms after its due time ({outcome} as {command_id})")
+        except Exception as e:
+            logger.error(f"Schedule {schedule['id']} failed to fire at {due}: {e}")
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()